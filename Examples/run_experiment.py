@@ -1,4 +1,4 @@
-# This file must be run with python -i run_experiment.py or the plot won't show
+# Runs a scan without the user interface, processing the data as it arrives
 import os
 import sys
 
@@ -6,22 +6,15 @@ import sys
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(base_dir)
 
-from time import sleep
-import threading
 from PFTL.model.experiment import Experiment
 
 
-experiment = Experiment("experiment.yml")
-experiment.load_config()
-experiment.load_daq()
-scan1 = threading.Thread(target=experiment.do_scan)
-scan1.start()
-sleep(2)
-experiment.keep_running = False
-sleep(0.5)
+with Experiment("experiment.yml") as experiment:
+    for voltages, currents in experiment.iter_scan():
+        print(f"{len(voltages)} new points, last one {voltages[-1]:.2f~P}: {currents[-1].to('mA'):.3f~P}")
+    print(f"Data saved to {experiment.save_data()}")
+
+    # Reads the input continuously, 100 points at a time, with the output at its last value
+    for currents in experiment.iter_stream(100, max_chunks=5):
+        print(f"Average current: {currents.mean().to('mA'):.3f~P}")
 print("Experiment finished")
-experiment.start_scan()
-while experiment.is_running:
-    print("Experiment Running")
-    sleep(1)
-experiment.finalize()
@@ -3,3 +3,6 @@ __version__ = "1.1.0"
 import pint
 
 ur = pint.UnitRegistry()
+
+#: Thermal voltage at room temperature, in Volts
+THERMAL_VOLTAGE = 0.02585
@@ -1,3 +1,4 @@
 from .start import start
 
-start()
+if __name__ == "__main__":
+    start()
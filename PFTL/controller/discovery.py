@@ -0,0 +1,199 @@
+"""
+Port discovery
+==============
+The name of the serial port of a device can change every time it is plugged in. Instead of editing the
+config file, the port can be found automatically::
+
+    DAQ:
+      name: AnalogDaq
+      port: auto
+      serial_number: PFTL DAQ device. Rev 02.2024  # Optional, the first device found is used if missing
+
+Every serial port is opened and asked for ``*IDN?``. Opening a port resets the board, which takes about a
+second (see :meth:`~PFTL.controller.pftl_daq.Device.initialize`), therefore all the ports are probed at the
+same time, each on its own thread. The device found is handed over still connected, so it is reset only
+once. The port where each serial number was found is stored in a cache file, and the next time that port is
+checked first, alone. Boards with the same identification can't be told apart: if several answer the
+serial number requested, the port has to be given in the config.
+
+The devices connected can be listed from the command line::
+
+    $ py4lab ports
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+from serial.tools import list_ports
+
+from PFTL.controller.pftl_daq import Device
+
+#: Where the port of every serial number is stored
+DEFAULT_CACHE_FILE = "~/.pftl/ports.yml"
+
+
+def candidate_ports():
+    """Serial ports that may have a device, the USB ones
+
+    Returns
+    -------
+    list of str
+    """
+    return sorted(port.device for port in list_ports.comports() if port.vid is not None)
+
+
+def connect(port):
+    """Opens a port and asks for its identification. The port is left open if a device answers
+
+    Returns
+    -------
+    Device or None
+        The device, initialized. None if there is no device answering on the port
+    str or None
+        The identification
+    """
+    device = Device(port)
+    try:
+        device.initialize()
+        idn = device.idn()
+        if idn:
+            return device, idn
+    except Exception:
+        pass
+    try:
+        device.finalize()
+    except Exception:
+        pass
+    return None, None
+
+
+def probe(port):
+    """Asks a port for its identification
+
+    Returns
+    -------
+    str or None
+        The identification, None if there is no device answering on the port
+    """
+    device, idn = connect(port)
+    if device is not None:
+        device.finalize()
+    return idn
+
+
+def connect_ports(ports):
+    """Opens several ports at the same time and asks them for their identification
+
+    Returns
+    -------
+    dict
+        The devices that answered, open, and their identification, by port
+    """
+    if not ports:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        answers = executor.map(connect, ports)
+    return {port: (device, idn) for port, (device, idn) in zip(ports, answers) if device is not None}
+
+
+def probe_ports(ports):
+    """Probes several ports at the same time
+
+    Returns
+    -------
+    dict
+        The identification of the devices found, by port. Several devices can have the same identification
+    """
+    devices = connect_ports(ports)
+    for device, _ in devices.values():
+        device.finalize()
+    return {port: idn for port, (_, idn) in devices.items()}
+
+
+def unique_ports(devices):
+    """The port of every identification found on a single port, the ones that can be stored in the cache"""
+    ports = {}
+    for port, idn in devices.items():
+        ports.setdefault(idn, []).append(port)
+    return {idn: found[0] for idn, found in ports.items() if len(found) == 1}
+
+
+def load_cache(cache_file=DEFAULT_CACHE_FILE):
+    path = Path(cache_file).expanduser()
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+def save_cache(devices, cache_file=DEFAULT_CACHE_FILE):
+    path = Path(cache_file).expanduser()
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path, "w") as f:
+        f.write(yaml.dump(devices, default_flow_style=False))
+
+
+def find_device(serial_number=None, cache_file=DEFAULT_CACHE_FILE):
+    """Finds a device and returns it connected, so it doesn't have to be opened (and reset) again. The port
+    stored in the cache is tried first, then all the others.
+
+    Parameters
+    ----------
+    serial_number : str
+        The identification of the device. If None, any device is accepted
+    cache_file : str
+        File with the port where each device was last found
+
+    Returns
+    -------
+    Device
+        The device, initialized
+    """
+    cache = load_cache(cache_file)
+    if serial_number is not None and serial_number in cache:
+        device, idn = connect(cache[serial_number])
+        if idn == serial_number:
+            return device
+        if device is not None:
+            device.finalize()
+
+    connected = connect_ports(candidate_ports())
+    devices = {port: idn for port, (_, idn) in connected.items()}
+    cache.update(unique_ports(devices))
+    save_cache(cache, cache_file)
+    matches = sorted(port for port, idn in devices.items() if serial_number is None or idn == serial_number)
+    port = matches[0] if matches else None
+    for other, (device, _) in connected.items():
+        if other != port:
+            device.finalize()
+
+    if serial_number is None:
+        if not matches:
+            raise Exception("No device found on any serial port")
+        if len(matches) > 1:
+            print(f"{len(matches)} devices found, using the one on {port}. Set serial_number or port to choose")
+        return connected[port][0]
+    if not matches:
+        found = ", ".join(sorted(set(devices.values()))) or "none"
+        raise Exception(f"Device {serial_number} not found. Devices available: {found}")
+    if len(matches) > 1:
+        connected[port][0].finalize()
+        raise Exception(
+            f"Devices on {', '.join(matches)} all answer {serial_number}, set the port instead of auto"
+        )
+    return connected[port][0]
+
+
+def main(args):
+    """Command line interface, see the module documentation"""
+    parser = argparse.ArgumentParser(prog="py4lab ports", description="Find the devices connected")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="File with the ports of the devices")
+    options = parser.parse_args(args)
+
+    ports = candidate_ports()
+    print(f"Probing {len(ports)} ports")
+    devices = probe_ports(ports)
+    save_cache({**load_cache(options.cache), **unique_ports(devices)}, options.cache)
+    for port, idn in sorted(devices.items()):
+        print(f"{port}: {idn}")
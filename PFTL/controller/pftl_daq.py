@@ -11,10 +11,13 @@ value by value and not a sequence. This forces the developer to think on how to
 purely on Python.
 """
 
-from time import sleep
+from collections import deque
+from time import perf_counter_ns, sleep
 
 import serial
 
+from PFTL.controller.recording import REPLAY_PREFIX, Recorder, ReplayTransport
+
 
 class Device:
     """controller for the serial devices that ships with Python for the Lab.
@@ -22,7 +25,10 @@ class Device:
     Parameters
     ----------
     port : str
-        The port where the device is connected. Something like COM3 on Windows, or /dev/ttyACM0 on Linux
+        The port where the device is connected. Something like COM3 on Windows, or /dev/ttyACM0 on Linux. A
+        port starting with ``replay://`` plays back a recording instead, see :mod:`~PFTL.controller.recording`
+    record : str
+        If given, everything sent to and received from the device is recorded to this file
 
     Attributes
     ----------
@@ -30,6 +36,11 @@ class Device:
         The serial communication with the device
     port : str
         The port where the device is connected, such as COM3 or /dev/ttyACM0
+    output_cache : dict
+        Last setpoint written to each analog output, keyed by channel. It is filled from the value the
+        device echoes back after every write, and cleared whenever the connection is (re)opened or closed.
+    latencies : deque
+        Duration of the latest transactions (a message and its reply), in nanoseconds
     """
 
     DEFAULTS = {
@@ -41,19 +52,30 @@ class Device:
         "write_timeout": 1,
     }
 
-    def __init__(self, port):
+    def __init__(self, port, record=None):
         self.port = port
+        self.record = record
         self.rsc = None
+        self.output_cache = {}
+        self.latencies = deque(maxlen=1000)
 
     def initialize(self):
-        """Opens the serial port with the DEFAULTS."""
-        self.rsc = serial.Serial(
-            port=self.port,
-            baudrate=self.DEFAULTS["baudrate"],
-            timeout=self.DEFAULTS["read_timeout"],
-            write_timeout=self.DEFAULTS["write_timeout"],
-        )
-        sleep(1)
+        """Opens the serial port with the DEFAULTS. Any cached output setpoint is discarded, since the device
+        resets its outputs when the port is opened. A port already open, for instance while looking for the
+        device (see :mod:`~PFTL.controller.discovery`), is kept, which avoids resetting the board again."""
+        self.clear_output_cache()
+        if self.rsc is None and self.port.startswith(REPLAY_PREFIX):
+            self.rsc = ReplayTransport.from_url(self.port)
+        elif self.rsc is None:
+            self.rsc = serial.Serial(
+                port=self.port,
+                baudrate=self.DEFAULTS["baudrate"],
+                timeout=self.DEFAULTS["read_timeout"],
+                write_timeout=self.DEFAULTS["write_timeout"],
+            )
+            sleep(1)
+        if self.record is not None and not isinstance(self.rsc, Recorder):
+            self.rsc = Recorder(self.rsc, self.record)
 
     def idn(self):
         """Get the serial number from the device.
@@ -101,27 +123,78 @@ class Device:
         int
             The value returned by the device
         """
-        message = f"OUT:CH{channel} {output_value}"
-        return self.query(message)
+        message = self.encode(f"OUT:CH{channel} {output_value}")
+        return str(self.write_output_command(channel, message))
+
+    def output_commands(self, channel, output_values):
+        """Builds, in advance, the encoded messages needed to set a sequence of values on an analog output.
+        They can later be sent with :meth:`write_output_command`, avoiding any string formatting while scanning.
+
+        Parameters
+        ----------
+        channel : int
+            The channel
+        output_values : iterable of int
+            The output values in the range 0-4095
+
+        Returns
+        -------
+        list of bytes
+            One encoded message per value
+        """
+        return [self.encode(f"OUT:CH{channel} {value}") for value in output_values]
 
-    def get_analog_output(self, channel):
-        """Retrieves the current value set to the analog channel
+    def write_output_command(self, channel, command):
+        """Sends a message built by :meth:`output_commands` and stores the value echoed by the device.
+
+        Parameters
+        ----------
+        channel : int
+            The channel the command refers to
+        command : bytes
+            The encoded message, including the write termination
+
+        Returns
+        -------
+        int
+            The value echoed by the device
+        """
+        self.output_cache.pop(channel, None)
+        ans = int(self.query_bytes(command))
+        self.output_cache[channel] = ans
+        return ans
+
+    def get_analog_output(self, channel, force=False):
+        """Retrieves the current value set to the analog channel.
+
+        The firmware echoes the value after every write, therefore the setpoint is normally known without
+        asking the device again. Only if the channel was not written since the last (re)connection, or if
+        ``force`` is set, the value is queried through the serial port.
 
         Parameters
         ----------
         channel : int
             The channel from which to retrieve the value
+        force : bool
+            If True, always read the value back from the device and refresh the cache
 
         Returns
         -------
         int
             The setpoint in the given channel
         """
+        if not force and channel in self.output_cache:
+            return self.output_cache[channel]
         message = f"OUT:CH{channel}?"
         ans = self.query(message)
         ans = int(ans)
+        self.output_cache[channel] = ans
         return ans
 
+    def clear_output_cache(self):
+        """Forget the cached setpoints. Next calls to :meth:`get_analog_output` will query the device."""
+        self.output_cache.clear()
+
     def query(self, message):
         """Wrapper around writing and reading from the device to make the flow easier.
 
@@ -135,10 +208,41 @@ class Device:
         str
             Whatever the message outputs
         """
+        return self.query_bytes(self.encode(message))
+
+    def encode(self, message):
+        """Appends the write termination to a message and encodes it as it should be sent to the device.
+
+        Parameters
+        ----------
+        message : str
+            The message to encode
+
+        Returns
+        -------
+        bytes
+            The message ready to be written to the serial port
+        """
         message = message + self.DEFAULTS["write_termination"]
-        message = message.encode(self.DEFAULTS["encoding"])
+        return message.encode(self.DEFAULTS["encoding"])
+
+    def query_bytes(self, message):
+        """Same as :meth:`query`, but for a message already encoded with :meth:`encode`.
+
+        Parameters
+        ----------
+        message : bytes
+            The encoded message, including the write termination
+
+        Returns
+        -------
+        str
+            Whatever the message outputs
+        """
+        start = perf_counter_ns()
         self.rsc.write(message)
         ans = self.rsc.readline()
+        self.latencies.append(perf_counter_ns() - start)
         ans = ans.decode(self.DEFAULTS["encoding"]).strip()
         if ans.startswith("ERROR"):
             raise Exception(f"There was an error with the message passed to the device: {ans}")
@@ -146,8 +250,10 @@ class Device:
 
     def finalize(self):
         """Closes the resource"""
+        self.clear_output_cache()
         if self.rsc is not None:
             self.rsc.close()
+            self.rsc = None
 
 
 if __name__ == "__main__":
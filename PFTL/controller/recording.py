@@ -0,0 +1,214 @@
+"""
+Recording and replay
+====================
+Everything that goes through the serial port can be recorded to a file, and played back later without the
+device. This allows to study offline what happened during a session in the lab, for example to find where
+the time goes, or to benchmark changes of the code against the same sequence of replies.
+
+Recording is enabled with the ``record`` option of the DAQ section of the config file::
+
+    DAQ:
+      name: AnalogDaq
+      port: /dev/ttyACM0
+      record: ~/Data/session.rec
+
+And a recording is played back by using it as the port::
+
+    DAQ:
+      name: AnalogDaq
+      port: replay://~/Data/session.rec?speed=0
+
+With ``speed`` 1 (the default), every reply takes as long as it took during the recording. Larger values
+play faster, and 0 replies immediately. The commands must be the same, in the same order, as those recorded.
+
+The file starts with :data:`MAGIC` and the time at which the recording started, in nanoseconds since the
+epoch. Then, every message written or read is stored as the time since the start, in nanoseconds, its kind
+(:data:`WRITE` or :data:`READ`), its length and its bytes.
+
+A summary of a recording, with the latency of every command, is available from the command line::
+
+    $ py4lab recording ~/Data/session.rec
+"""
+import argparse
+import re
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"PFTLREC1"
+HEADER = struct.Struct("<8sq")
+RECORD = struct.Struct("<qBH")
+WRITE = 0
+READ = 1
+#: Prefix of the ports that replay a recording
+REPLAY_PREFIX = "replay://"
+
+
+class Recorder:
+    """Wraps a serial port and records everything written to and read from it
+
+    Parameters
+    ----------
+    transport : serial.Serial
+        The open port, or anything with ``write``, ``readline`` and ``close``
+    path : str
+        The file of the recording. It is overwritten if it exists
+    """
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        path = Path(path).expanduser()
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, time.time_ns()))
+        self.start = time.perf_counter_ns()
+
+    def _record(self, kind, data):
+        self.file.write(RECORD.pack(time.perf_counter_ns() - self.start, kind, len(data)))
+        self.file.write(data)
+
+    def write(self, data):
+        self._record(WRITE, data)
+        return self.transport.write(data)
+
+    def readline(self):
+        data = self.transport.readline()
+        self._record(READ, data)
+        return data
+
+    def close(self):
+        self.file.close()
+        self.transport.close()
+
+
+def read_recording(path):
+    """Reads a recording
+
+    Returns
+    -------
+    start : int
+        Time at which the recording started, in nanoseconds since the epoch
+    records : list of tuple
+        ``(time, kind, data)`` of every message, with the time in nanoseconds since the start
+    """
+    content = Path(path).expanduser().read_bytes()
+    magic, start = HEADER.unpack_from(content)
+    if magic != MAGIC:
+        raise Exception(f"{path} is not a recording of the serial port")
+    records = []
+    position = HEADER.size
+    while position < len(content):
+        timestamp, kind, length = RECORD.unpack_from(content, position)
+        position += RECORD.size
+        records.append((timestamp, kind, content[position : position + length]))
+        position += length
+    return start, records
+
+
+def transactions(records):
+    """Pairs every message written with the reply that followed it
+
+    Returns
+    -------
+    list of tuple
+        ``(command, reply, latency)``, with the latency in nanoseconds
+    """
+    pairs = []
+    pending = None
+    for timestamp, kind, data in records:
+        if kind == WRITE:
+            pending = (timestamp, data)
+        elif pending is not None:
+            pairs.append((pending[1], data, timestamp - pending[0]))
+            pending = None
+    return pairs
+
+
+class ReplayTransport:
+    """Plays back a recording in place of the serial port
+
+    Parameters
+    ----------
+    path : str
+        The recording
+    speed : float
+        How fast the replies are given compared to the recording. 0 for no waiting at all
+    """
+
+    def __init__(self, path, speed=1):
+        _, records = read_recording(path)
+        self.transactions = transactions(records)
+        self.speed = speed
+        self.position = 0
+        self.reply = None
+
+    @classmethod
+    def from_url(cls, url):
+        """Creates the transport from a port like ``replay://path?speed=10``"""
+        path, _, query = url[len(REPLAY_PREFIX):].partition("?")
+        options = dict(option.split("=", 1) for option in query.split("&") if option)
+        return cls(path, float(options.get("speed", 1)))
+
+    def write(self, data):
+        if self.position >= len(self.transactions):
+            raise Exception("The recording has no more messages")
+        command, reply, latency = self.transactions[self.position]
+        if data != command:
+            raise Exception(f"Message {self.position} differs from the recording: {data!r} instead of {command!r}")
+        self.position += 1
+        self.reply = reply
+        if self.speed:
+            time.sleep(latency / self.speed * 1e-9)
+        return len(data)
+
+    def readline(self):
+        reply, self.reply = self.reply, None
+        return reply if reply is not None else b""
+
+    def close(self):
+        pass
+
+
+def command_name(command):
+    """The command without its values, to group transactions, such as ``OUT:CH0`` for ``OUT:CH0 1024``"""
+    return re.sub(rb"\s.*", b"", command.strip()).decode("ascii", errors="replace")
+
+
+def summary(records):
+    """Number of transactions and latency percentiles, in milliseconds, for every command
+
+    Parameters
+    ----------
+    records : list of tuple
+        The records of a recording, see :func:`read_recording`
+
+    Returns
+    -------
+    dict
+        For every command, ``count`` and the percentiles ``p50``, ``p90`` and ``p99``
+    """
+    latencies = {}
+    for command, _, latency in transactions(records):
+        latencies.setdefault(command_name(command), []).append(latency)
+    result = {}
+    for name, values in latencies.items():
+        p50, p90, p99 = np.percentile(np.array(values) * 1e-6, [50, 90, 99])
+        result[name] = {"count": len(values), "p50": p50, "p90": p90, "p99": p99}
+    return result
+
+
+def main(args):
+    """Command line interface, see the module documentation"""
+    parser = argparse.ArgumentParser(prog="py4lab recording", description="Summary of a serial recording")
+    parser.add_argument("file", help="The recording")
+    options = parser.parse_args(args)
+
+    start, records = read_recording(options.file)
+    duration = (records[-1][0] if records else 0) * 1e-9
+    print(f"Recorded {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start * 1e-9))}, "
+          f"{len(records)} messages in {duration:.1f} s")
+    print(f"{'command':12s} {'count':>8s} {'p50 (ms)':>9s} {'p90 (ms)':>9s} {'p99 (ms)':>9s}")
+    for name, values in sorted(summary(records).items()):
+        print(f"{name:12s} {values['count']:8d} {values['p50']:9.2f} {values['p90']:9.2f} {values['p99']:9.2f}")
@@ -7,6 +7,7 @@ into a separate model for the experiment may seem redundant, but incredibly usef
 
 """
 from PFTL import ur
+from PFTL.controller.discovery import find_device
 from PFTL.controller.pftl_daq import Device
 from PFTL.model.base_daq import DAQBase
 
@@ -19,6 +20,10 @@ class AnalogDaq(DAQBase):
     ----------
     port : str
         See :mod:`~PFTL.controller.pftl_daq`
+    record : str
+        File where the communication with the device is recorded, see :mod:`~PFTL.controller.recording`
+    device : Device
+        A device already connected to the port, used instead of opening it again
 
     Attributes
     ----------
@@ -27,10 +32,29 @@ class AnalogDaq(DAQBase):
     driver : Device
         The controller
     """
-    def __init__(self, port):
+
+    #: The firmware waits 20ms after every command
+    CAPABILITIES = {"sweep": False, "max_sample_rate": 40}
+
+    def __init__(self, port, record=None, device=None):
         super().__init__(port)
         self.port = port
-        self.driver = Device(self.port)
+        if device is None:
+            device = Device(self.port)
+        device.record = record
+        self.driver = device
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the DAQ from the port and the ``record`` option of the DAQ section of the config. If the
+        port is ``auto``, it is found from the ``serial_number`` option, see :mod:`~PFTL.controller.discovery`
+        """
+        port = config["port"]
+        if port == "auto":
+            device = find_device(config.get("serial_number"))
+            print(f"Device found on {device.port}")
+            return cls(device.port, record=config.get("record"), device=device)
+        return cls(port, record=config.get("record"))
 
     def initialize(self):
         """Initialize the driver and sets the voltage on the outputs to 0"""
@@ -54,25 +78,31 @@ class AnalogDaq(DAQBase):
         volts : Quantity
             The value to set, a quantity using Pint
         """
-        value_volts = volts.m_as("V")
-        value_int = round(value_volts / 3.3 * 4095)
+        value_int = int(self.volts_to_code(volts.m_as("V")))
         self.driver.set_analog_output(channel, value_int)
 
-    def get_output_voltage(self, channel):
-        """Gets the voltage from a given output channel
+    def idn(self):
+        """Identification of the device, see :meth:`Device.idn`"""
+        return self.driver.idn()
+
+    def get_output_voltage(self, channel, force=False):
+        """Gets the voltage from a given output channel. The value is taken from the setpoint cache of the
+        driver unless ``force`` is True.
 
         Parameters
         ----------
         channel : int
             The channel number
+        force : bool
+            If True, read the setpoint back from the device instead of using the cached value
 
         Returns
         -------
         Quantity
             The voltage setpoint in the channel
         """
-        voltage_bits = self.driver.get_analog_output(channel)
-        voltage = voltage_bits * ur("3.3V") / 4095
+        voltage_bits = self.driver.get_analog_output(channel, force=force)
+        voltage = self.code_to_volts(voltage_bits) * ur("V")
         return voltage
 
     def get_input_voltage(self, channel):
@@ -89,9 +119,21 @@ class AnalogDaq(DAQBase):
             The voltage read
         """
         voltage_bits = self.driver.get_analog_input(channel)
-        voltage = voltage_bits * ur("3.3V") / 1023
+        voltage = self.adc_to_volts(voltage_bits, channel) * ur("V")
         return voltage
 
+    def prepare_output(self, channel, codes):
+        """Formats and encodes the commands for every code in advance, see :meth:`Device.output_commands`"""
+        return self.driver.output_commands(channel, codes)
+
+    def write_prepared_output(self, channel, prepared):
+        """Sends a command built by :meth:`prepare_output`"""
+        self.driver.write_output_command(channel, prepared)
+
+    def get_input_code(self, channel):
+        """Reads the raw ADC value of an input channel"""
+        return self.driver.get_analog_input(channel)
+
     def __str__(self):
         return f"Analog Daq on port {self.port}"
 
@@ -0,0 +1,63 @@
+"""
+Averaging
+=========
+Repeated scans are averaged while they run, instead of saving every sweep and averaging the files later. The
+mean and the variance of every point are updated after each sweep with Welford's algorithm, which is
+numerically stable and only needs the running values, not the previous sweeps. It is enabled with the
+``repeats`` option of the Scan section of the config::
+
+    Scan:
+      repeats: 50  # Largest number of sweeps
+      target_error: 10uA  # Stop once the standard error of every point is below this value
+
+The sweeps are done one after the other with the same DAQ and the same prepared commands. After every sweep,
+a :class:`~PFTL.model.events.AverageUpdated` event is published with the average so far. Without a
+``target_error`` all the sweeps are done.
+"""
+import numpy as np
+
+
+class RunningAverage:
+    """Mean and variance of every point over the sweeps added so far. The arrays are updated in place
+
+    Parameters
+    ----------
+    num_points : int
+        The number of points of every sweep
+
+    Attributes
+    ----------
+    count : int
+        Number of sweeps added
+    mean : array of float
+        The average of every point
+    """
+
+    def __init__(self, num_points):
+        self.count = 0
+        self.mean = np.zeros(num_points)
+        self.sum_squares = np.zeros(num_points)  # Sum of squared differences from the mean
+        self._delta = np.empty(num_points)
+        self._delta_new = np.empty(num_points)
+
+    def add(self, values):
+        """Adds a sweep"""
+        self.count += 1
+        np.subtract(values, self.mean, out=self._delta)
+        np.multiply(self._delta, 1 / self.count, out=self._delta_new)
+        self.mean += self._delta_new
+        np.subtract(values, self.mean, out=self._delta_new)
+        self._delta *= self._delta_new
+        self.sum_squares += self._delta
+
+    @property
+    def variance(self):
+        """The sample variance of every point, NaN with less than two sweeps"""
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.sum_squares / (self.count - 1)
+
+    @property
+    def standard_error(self):
+        """The standard error of the mean of every point"""
+        return np.sqrt(self.variance / self.count)
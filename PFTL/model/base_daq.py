@@ -3,12 +3,46 @@ Base DAQ
 ========
 Base class for the DAQ objects. It keeps track of the functions that every new model should implement.
 This helps keeping the code organized and to maintain downstream compliancy.
+
+Besides the methods working with Pint quantities, the base class defines an integer (raw code) interface,
+used by the experiment to prepare scans in advance. Models that talk to real hardware should override it
+with a faster implementation, but the defaults defined here fall back to the quantity-based methods, so
+every model works with it.
 """
+from collections import deque
+from time import perf_counter, sleep
+
+import numpy as np
+
+from PFTL import ur
 
 
 class DAQBase:
+    #: Reference voltage of the converters, in Volts
+    V_REF = 3.3
+    #: Largest code accepted by the Digital-to-Analog converter (12 bits)
+    DAC_MAX = 4095
+    #: Largest code returned by the Analog-to-Digital converter (10 bits)
+    ADC_MAX = 1023
+    #: What the model can do faster than value by value. ``sweep`` means that :meth:`sweep` is not just a loop,
+    #: and ``max_sample_rate`` is the number of readings per second that can be expected (None if not limited
+    #: by the device)
+    CAPABILITIES = {"sweep": False, "max_sample_rate": None}
+
     def __init__(self, port):
         self.port = port
+        self.calibration = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the DAQ from the DAQ section of the config file. By default only the port is used.
+
+        Parameters
+        ----------
+        config : dict
+            The DAQ section of the config file
+        """
+        return cls(config["port"])
 
     def initialize(self):
         pass
@@ -22,11 +56,151 @@ class DAQBase:
     def set_output_voltage(self, channel, volts):
         pass
 
-    def get_output_voltage(self, channel):
+    def get_output_voltage(self, channel, force=False):
         pass
 
     def finalize(self):
         pass
 
+    def volts_to_code(self, volts):
+        """Converts voltages to the codes of the DAC.
+
+        Parameters
+        ----------
+        volts : float or array
+            Voltages expressed in Volts
+
+        Returns
+        -------
+        array of int
+            The closest DAC codes
+        """
+        codes = np.rint(np.asarray(volts, dtype=float) / self.V_REF * self.DAC_MAX).astype(int)
+        if np.any(codes < 0) or np.any(codes > self.DAC_MAX):
+            raise Exception(f"Output voltages must be between 0V and {self.V_REF}V")
+        return codes
+
+    def code_to_volts(self, codes):
+        """Converts DAC codes to the voltages that they produce, in Volts."""
+        return np.asarray(codes) * self.V_REF / self.DAC_MAX
+
+    def adc_to_volts(self, codes, channel=None):
+        """Converts ADC codes to the voltages that they represent, in Volts. If the channel is given and
+        there is a :attr:`calibration` for it, the corrected values are returned.
+        """
+        if channel is not None and self.calibration is not None and channel in self.calibration:
+            return self.calibration.to_volts(channel, codes)
+        return np.asarray(codes) * self.V_REF / self.ADC_MAX
+
+    def prepare_output(self, channel, codes):
+        """Prepares everything needed to output a sequence of codes on a channel, before starting a scan.
+
+        Parameters
+        ----------
+        channel : int
+            The output channel
+        codes : array of int
+            DAC codes, see :meth:`volts_to_code`
+
+        Returns
+        -------
+        list
+            One element per code, to be passed to :meth:`write_prepared_output`
+        """
+        return [int(code) for code in codes]
+
+    def write_prepared_output(self, channel, prepared):
+        """Outputs one of the elements returned by :meth:`prepare_output`"""
+        self.set_output_voltage(channel, self.code_to_volts(prepared) * ur("V"))
+
+    def get_input_code(self, channel):
+        """Reads an input channel and returns the ADC code instead of a quantity"""
+        volts = self.get_input_voltage(channel).m_as("V")
+        code = int(round(volts / self.V_REF * self.ADC_MAX))
+        return min(max(code, 0), self.ADC_MAX)
+
+    def get_input_codes(self, channel, num_samples):
+        """Reads an input channel several times in a row
+
+        Parameters
+        ----------
+        channel : int
+            The input channel
+        num_samples : int
+            How many readings to acquire
+
+        Returns
+        -------
+        array of int
+            The ADC codes
+        """
+        return np.array([self.get_input_code(channel) for _ in range(num_samples)], dtype=int)
+
+    def get_input_voltages(self, channel, num_samples):
+        """Same as :meth:`get_input_codes`, but returns the (calibrated) voltages as a quantity"""
+        codes = self.get_input_codes(channel, num_samples)
+        return self.adc_to_volts(codes, channel) * ur("V")
+
+    def settle(self, channel, tolerance, readings=3, max_wait=0.1, interval=0):
+        """Reads an input until it stops changing: the last ``readings`` values are within ``tolerance`` of
+        each other. Gives up after ``max_wait``, returning the last value anyway.
+
+        Parameters
+        ----------
+        channel : int
+            The input channel
+        tolerance : int
+            Largest difference between the readings considered settled, in ADC codes
+        readings : int
+            Number of consecutive readings that must agree
+        max_wait : float
+            Longest time to wait, in seconds
+        interval : float
+            Time between readings, in seconds
+
+        Returns
+        -------
+        code : int
+            The last reading
+        elapsed : float
+            Time until the input settled, or ``max_wait`` was exceeded, in seconds
+        """
+        start = perf_counter()
+        window = deque(maxlen=readings)
+        while True:
+            window.append(self.get_input_code(channel))
+            elapsed = perf_counter() - start
+            if len(window) == readings and max(window) - min(window) <= tolerance or elapsed >= max_wait:
+                return window[-1], elapsed
+            sleep(interval)
+
+    def sweep(self, channel_out, channel_in, codes, num_samples=1, delay=0):
+        """Outputs a sequence of codes and reads an input after each one of them
+
+        Parameters
+        ----------
+        channel_out : int
+            The output channel
+        channel_in : int
+            The input channel
+        codes : array of int
+            DAC codes to output, in order
+        num_samples : int
+            Readings acquired after each output
+        delay : float
+            Time to wait after each output, in seconds
+
+        Returns
+        -------
+        array of int
+            ADC codes, with shape ``(len(codes), num_samples)``
+        """
+        data = np.empty((len(codes), num_samples), dtype=int)
+        for i, prepared in enumerate(self.prepare_output(channel_out, codes)):
+            self.write_prepared_output(channel_out, prepared)
+            data[i] = self.get_input_codes(channel_in, num_samples)
+            sleep(delay)
+        return data
+
     def __str__(self):
-        return f"DAQ on port: {self.port}"
\ No newline at end of file
+        return f"DAQ on port: {self.port}"
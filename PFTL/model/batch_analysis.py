@@ -0,0 +1,277 @@
+"""
+Batch analysis
+==============
+Analyzes, in parallel, all the scans saved under one or more folders and writes the results in a single
+table. It is available from the command line::
+
+    $ py4lab analyze ~/Data --function diode_fit --output results.csv
+
+Scans are the ``.dat`` files written by :meth:`~PFTL.model.experiment.Experiment.save_data`, or the
+``.npz`` files of raw scans (see :mod:`~PFTL.model.raw_data`), next to their ``.yml`` metadata. Files are
+distributed in chunks over a pool of processes, which avoids the overhead of sending them one by one.
+
+Results are cached per file, together with a hash of its content and of its metadata. When the analysis is
+repeated, only new or modified files are processed. Files whose size and modification time did not change
+are not even read.
+
+The functions available are in :data:`ANALYSIS_FUNCTIONS`. Each one gets the voltages (V), the currents (A)
+and the metadata of a scan, and returns a dictionary with the results.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from PFTL import ur
+from PFTL.model.live_fit import fit_diode
+from PFTL.model.raw_data import load_raw_scan
+
+#: Name of the cache file, created in the first folder analyzed
+CACHE_FILENAME = "analysis_cache.sqlite"
+
+
+def parse_data(text):
+    """Voltages and currents in the text of a ``.dat`` file saved by
+    :meth:`~PFTL.model.experiment.Experiment.save_data`, or in a part of it made of whole lines. The comment
+    lines at the start are skipped, as well as the columns after the current (the settling time of scans with
+    adaptive settling, the standard error of repeated scans)
+
+    Returns
+    -------
+    voltages : array of float
+        In Volts
+    currents : array of float
+        In Amperes
+    """
+    start = 0
+    while text.startswith("#", start):
+        end = text.find("\n", start)
+        start = len(text) if end < 0 else end + 1
+    first_line = re.compile(r"\S[^\n]*").search(text, start)
+    num_columns = len(first_line.group().split()) if first_line else 2
+    data = np.fromstring(text[start:], sep=" ").reshape(-1, num_columns)
+    return data[:, 0], data[:, 1] * 1e-3
+
+
+def load_scan(path):
+    """Reads a file saved by :meth:`~PFTL.model.experiment.Experiment.save_data`, and its metadata
+
+    Parameters
+    ----------
+    path : Path
+        The ``.dat`` file, or the ``.npz`` file of a raw scan
+
+    Returns
+    -------
+    voltages : array of float
+        In Volts
+    currents : array of float
+        In Amperes
+    metadata : dict
+        The config used for the scan, empty if there is no ``.yml`` file
+    """
+    if Path(path).suffix == ".npz":
+        voltages, currents = load_raw_scan(path)
+    else:
+        voltages, currents = parse_data(Path(path).read_text())
+    metadata_file = Path(path).with_suffix(".yml")
+    metadata = {}
+    if metadata_file.exists():
+        with open(metadata_file, "r") as f:
+            metadata = yaml.load(f, Loader=getattr(yaml, "CLoader", yaml.FullLoader)) or {}
+    return voltages, currents, metadata
+
+
+def summary(voltages, currents, metadata):
+    """Number of points, range of the voltage and of the current, and voltage at which the current first
+    exceeds 1mA"""
+    above = np.flatnonzero(currents > 1e-3)
+    return {
+        "num_points": len(voltages),
+        "voltage_min": float(voltages.min()) if len(voltages) else np.nan,
+        "voltage_max": float(voltages.max()) if len(voltages) else np.nan,
+        "current_min": float(currents.min()) if len(currents) else np.nan,
+        "current_max": float(currents.max()) if len(currents) else np.nan,
+        "turn_on_voltage": float(voltages[above[0]]) if len(above) else np.nan,
+    }
+
+
+def diode_fit(voltages, currents, metadata):
+    """Fit of the diode equation, see :func:`~PFTL.model.live_fit.fit_diode`"""
+    resistance = ur(metadata.get("DAQ", {}).get("resistance", "220ohm")).m_as("ohm")
+    min_current = ur(str(metadata.get("Analysis", {}).get("min_current", "50uA"))).m_as("A")
+    result = fit_diode(voltages, currents, resistance, min_current)
+    return {key: value if key == "num_points" else float(value) for key, value in result.items()}
+
+
+ANALYSIS_FUNCTIONS = {
+    "summary": summary,
+    "diode_fit": diode_fit,
+}
+
+
+def find_scans(folders):
+    """Finds the data files, recursively, in the given folders
+
+    Returns
+    -------
+    list of Path
+        The ``.dat`` and raw ``.npz`` files that have a ``.yml`` file next to them. The ``.npz`` files next to
+        a ``.dat`` file (the dense data of grid scans) are not included
+    """
+    scans = []
+    for folder in folders:
+        for pattern in ("*.dat", "*.npz"):
+            for path in Path(folder).expanduser().rglob(pattern):
+                if not path.with_suffix(".yml").exists():
+                    continue
+                if path.suffix == ".npz" and path.with_suffix(".dat").exists():
+                    continue
+                scans.append(path)
+    return sorted(scans)
+
+
+def content_hash(path):
+    """Hash of a data file and its metadata"""
+    digest = hashlib.sha256(Path(path).read_bytes())
+    digest.update(Path(path).with_suffix(".yml").read_bytes())
+    return digest.hexdigest()
+
+
+def _analyze_file(task):
+    """Runs in the worker processes. Returns the path, the hash and the results (or the error) of a file"""
+    path, function_name = task
+    try:
+        digest = content_hash(path)
+        voltages, currents, metadata = load_scan(path)
+        return path, digest, ANALYSIS_FUNCTIONS[function_name](voltages, currents, metadata)
+    except Exception as e:
+        return path, None, {"error": str(e)}
+
+
+class ResultsCache:
+    """Results of previous analyses, stored in SQLite
+
+    Parameters
+    ----------
+    path : Path
+        The cache file
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(Path(path).expanduser())
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (path TEXT, function TEXT, size INTEGER, mtime INTEGER, "
+            "hash TEXT, results TEXT, PRIMARY KEY (path, function))"
+        )
+
+    @staticmethod
+    def _stat(path):
+        data = os.stat(path)
+        metadata = os.stat(Path(path).with_suffix(".yml"))
+        return data.st_size + metadata.st_size, max(data.st_mtime_ns, metadata.st_mtime_ns)
+
+    def get(self, path, function_name):
+        """Results for a file if they are still valid, None otherwise"""
+        row = self.connection.execute(
+            "SELECT size, mtime, hash, results FROM results WHERE path = ? AND function = ?",
+            (str(path), function_name),
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime, digest, results = row
+        if (size, mtime) != self._stat(path):
+            if digest != content_hash(path):
+                return None
+            self.store(path, function_name, digest, json.loads(results))
+        return json.loads(results)
+
+    def store(self, path, function_name, digest, results):
+        size, mtime = self._stat(path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (str(path), function_name, size, mtime, digest, json.dumps(results)),
+        )
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def analyze(folders, function_name="summary", cache_file=None, workers=None, chunk_size=64):
+    """Analyzes all the scans in the folders
+
+    Parameters
+    ----------
+    folders : list of str
+        Folders to search for scans, recursively
+    function_name : str
+        One of :data:`ANALYSIS_FUNCTIONS`
+    cache_file : str
+        The cache of results. By default :data:`CACHE_FILENAME` in the first folder
+    workers : int
+        Number of processes, by default as many as CPUs
+    chunk_size : int
+        Number of files sent at once to each process
+
+    Returns
+    -------
+    list of dict
+        The results of each file, including its path
+    """
+    if function_name not in ANALYSIS_FUNCTIONS:
+        raise Exception(f"Unknown analysis {function_name}. Available: {', '.join(ANALYSIS_FUNCTIONS)}")
+    cache = ResultsCache(cache_file or Path(folders[0]).expanduser() / CACHE_FILENAME)
+    results = {}
+    pending = []
+    for path in find_scans(folders):
+        cached = cache.get(path, function_name)
+        if cached is None:
+            pending.append((path, function_name))
+        else:
+            results[path] = cached
+    print(f"{len(results)} scans already analyzed, {len(pending)} to analyze")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, digest, result in executor.map(_analyze_file, pending, chunksize=chunk_size):
+                results[path] = result
+                if digest is not None:
+                    cache.store(path, function_name, digest, result)
+    cache.close()
+    return [{"path": str(path), **result} for path, result in sorted(results.items())]
+
+
+def write_table(results, output):
+    """Writes the results of :func:`analyze` as a CSV file"""
+    columns = ["path"]
+    for result in results:
+        columns.extend(key for key in result if key not in columns)
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main(args):
+    """Command line interface, see the module documentation"""
+    parser = argparse.ArgumentParser(prog="py4lab analyze", description="Analyze saved scans in parallel")
+    parser.add_argument("folders", nargs="+", help="Folders with scans, searched recursively")
+    parser.add_argument("--function", default="summary", choices=list(ANALYSIS_FUNCTIONS))
+    parser.add_argument("--output", default="analysis.csv", help="The table with all the results")
+    parser.add_argument("--cache", help=f"Cache of results, {CACHE_FILENAME} in the first folder by default")
+    parser.add_argument("--workers", type=int, help="Number of processes, as many as CPUs by default")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Files sent at once to each process")
+    options = parser.parse_args(args)
+
+    results = analyze(options.folders, options.function, options.cache, options.workers, options.chunk_size)
+    write_table(results, options.output)
+    print(f"Results of {len(results)} scans written to {options.output}")
@@ -0,0 +1,211 @@
+"""
+Calibration
+===========
+The conversion between the codes of the device and voltages assumes an ideal 3.3V reference and perfectly
+linear converters. Real boards have offset and gain errors, and some nonlinearity, that end up in the data.
+
+The calibration implemented here is a loopback scan: an analog output is wired to one or more analog inputs,
+the output is swept over its full range and the inputs are read several times per point. The output is
+taken as the reference, and for each input channel a straight line (gain and offset) is fitted. What the
+line can't explain is kept as a nonlinearity correction, and everything is combined in a lookup table with
+one voltage per possible ADC code. Correcting data is therefore a single indexing operation, which works
+equally fast for one value or for a full array of codes.
+
+Calibrations are stored as YAML files, one per device, named after the serial number reported by
+``idn()``. Once a device is calibrated, the file is loaded instead of repeating the scan.
+"""
+import re
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+
+class ChannelCalibration:
+    """Calibration of a single input channel
+
+    Parameters
+    ----------
+    gain : float
+        Volts per ADC code
+    offset : float
+        Voltage corresponding to the code 0, in Volts
+    lut : array of float
+        Corrected voltage for every ADC code, in Volts. It includes the nonlinearity correction.
+    """
+
+    def __init__(self, gain, offset, lut):
+        self.gain = gain
+        self.offset = offset
+        self.lut = np.asarray(lut, dtype=float)
+
+    @classmethod
+    def fit(cls, volts, codes, adc_max):
+        """Builds the calibration of a channel from the data of a loopback scan
+
+        Parameters
+        ----------
+        volts : array of float
+            The voltages applied, in Volts
+        codes : array of float
+            The (averaged) codes read by the ADC for each voltage
+        adc_max : int
+            The largest code of the ADC
+
+        Returns
+        -------
+        ChannelCalibration
+        """
+        volts = np.asarray(volts, dtype=float)
+        codes = np.asarray(codes, dtype=float)
+        gain, offset = np.polyfit(codes, volts, 1)
+        residuals = volts - (gain * codes + offset)
+        order = np.argsort(codes)
+        all_codes = np.arange(adc_max + 1)
+        lut = gain * all_codes + offset + np.interp(all_codes, codes[order], residuals[order])
+        return cls(float(gain), float(offset), lut)
+
+    def to_volts(self, codes):
+        """Corrected voltages, in Volts, for the given ADC codes"""
+        return self.lut[codes]
+
+
+class Calibration:
+    """Calibration of all the input channels of a device
+
+    Parameters
+    ----------
+    serial_number : str
+        The identification of the device, as returned by ``idn()``
+
+    Attributes
+    ----------
+    channels : dict
+        :class:`ChannelCalibration` for each calibrated input channel
+    """
+
+    def __init__(self, serial_number):
+        self.serial_number = serial_number
+        self.channels = {}
+
+    def __contains__(self, channel):
+        return channel in self.channels
+
+    def to_volts(self, channel, codes):
+        """Converts ADC codes of a channel to corrected voltages, in Volts"""
+        return self.channels[channel].to_volts(codes)
+
+    @staticmethod
+    def filename(folder, serial_number):
+        """Path of the file that stores the calibration of a device"""
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", serial_number).strip("_")
+        return Path(folder).expanduser() / f"{name}.yml"
+
+    def save(self, folder):
+        """Saves the calibration to the given folder, using the serial number for the file name"""
+        filename = self.filename(folder, self.serial_number)
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        data = {
+            "serial_number": self.serial_number,
+            "channels": {
+                channel: {"gain": cal.gain, "offset": cal.offset, "lut": cal.lut.tolist()}
+                for channel, cal in self.channels.items()
+            },
+        }
+        with open(filename, "w") as f:
+            f.write(yaml.dump(data, default_flow_style=None))
+
+    @classmethod
+    def load(cls, folder, serial_number):
+        """Loads a calibration stored with :meth:`save`.
+
+        Returns
+        -------
+        Calibration or None
+            None if the device was never calibrated
+        """
+        filename = cls.filename(folder, serial_number)
+        if not filename.exists():
+            return None
+        with open(filename, "r") as f:
+            data = yaml.load(f, Loader=yaml.FullLoader)
+        calibration = cls(data["serial_number"])
+        for channel, values in data["channels"].items():
+            calibration.channels[int(channel)] = ChannelCalibration(values["gain"], values["offset"], values["lut"])
+        return calibration
+
+
+def loopback_scan(daq, channel_out, channel_in, num_points=64, averages=4):
+    """Sweeps an output over its full range while reading an input wired to it.
+
+    Parameters
+    ----------
+    daq : DAQBase
+        An initialized DAQ
+    channel_out : int
+        The output channel used as reference
+    channel_in : int
+        The input channel, physically connected to the output
+    num_points : int
+        Number of voltages applied
+    averages : int
+        Readings averaged for every voltage
+
+    Returns
+    -------
+    volts : array of float
+        The voltages applied, in Volts
+    codes : array of float
+        The average code read for each voltage
+    """
+    out_codes = np.unique(np.linspace(0, daq.DAC_MAX, num_points).round().astype(int))
+    commands = daq.prepare_output(channel_out, out_codes)
+    codes = np.empty(len(out_codes))
+    for i, command in enumerate(commands):
+        daq.write_prepared_output(channel_out, command)
+        codes[i] = daq.get_input_codes(channel_in, averages).mean()
+    daq.write_prepared_output(channel_out, commands[0])
+    return daq.code_to_volts(out_codes), codes
+
+
+def calibrate(daq, channel_out, channels_in, folder, force=False, num_points=64, averages=4):
+    """Returns the calibration of a device, running a loopback scan only if there is none stored for it.
+
+    Readings that saturate the ADC (code 0 or the largest code) are not used for the fit.
+
+    Parameters
+    ----------
+    daq : DAQBase
+        An initialized DAQ
+    channel_out : int
+        The output channel used as reference
+    channels_in : list of int
+        The input channels to calibrate, all of them wired to ``channel_out``
+    folder : str
+        Folder where calibrations are stored
+    force : bool
+        If True, the scan is repeated even if a calibration is already stored
+    num_points : int
+        See :func:`loopback_scan`
+    averages : int
+        See :func:`loopback_scan`
+
+    Returns
+    -------
+    Calibration
+    """
+    serial_number = daq.idn() or str(daq)
+    if not force:
+        calibration = Calibration.load(folder, serial_number)
+        if calibration is not None and all(channel in calibration for channel in channels_in):
+            return calibration
+
+    calibration = Calibration(serial_number)
+    for channel in channels_in:
+        volts, codes = loopback_scan(daq, channel_out, channel, num_points, averages)
+        valid = (codes > 0) & (codes < daq.ADC_MAX)
+        if np.count_nonzero(valid) < 2:
+            raise Exception(f"Channel {channel} does not follow output {channel_out}, is it connected?")
+        calibration.channels[channel] = ChannelCalibration.fit(volts[valid], codes[valid], daq.ADC_MAX)
+    calibration.save(folder)
+    return calibration
@@ -0,0 +1,278 @@
+"""
+Catalog of scans
+================
+Every time the data of an experiment is saved, it is also registered in a catalog, a small SQLite database
+kept in the data folder. The catalog serves two purposes:
+
+* It allocates the number of the next file (``data_0001.dat``, ``data_0002.dat``, ...) with a single
+  transaction, instead of checking which files already exist one by one.
+* It indexes every scan: when it was saved, the device used, summary statistics of the data and every
+  value of the configuration, so scans can be found without opening any file.
+
+The catalog can be queried from Python::
+
+    >>> catalog = Catalog("~/Data/catalog.sqlite")
+    >>> catalog.query(since=datetime(2024, 5, 1), config={"resistance": "220ohm"})
+
+or from the command line::
+
+    $ py4lab catalog ~/Data --since 7d resistance=220ohm
+
+Keys of the configuration are stored with the name of their section, such as ``DAQ.resistance``, but can
+be queried with only their last part, like ``resistance``.
+"""
+import argparse
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+#: Name of the catalog file, created in the data folder
+CATALOG_FILENAME = "catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequences (
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    last INTEGER NOT NULL,
+    PRIMARY KEY (folder, name)
+);
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    saved_at REAL NOT NULL,
+    idn TEXT,
+    num_points INTEGER,
+    voltage_min REAL,
+    voltage_max REAL,
+    current_min REAL,
+    current_max REAL,
+    current_mean REAL
+);
+CREATE INDEX IF NOT EXISTS scans_saved_at ON scans (saved_at);
+CREATE INDEX IF NOT EXISTS scans_idn ON scans (idn);
+CREATE TABLE IF NOT EXISTS config (
+    scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS config_value ON config (value, key);
+"""
+
+
+def flatten_config(config, prefix=""):
+    """Converts a nested config into a flat dictionary, with keys such as ``DAQ.resistance``"""
+    flat = {}
+    for key, value in config.items():
+        key = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_config(value, f"{key}."))
+        else:
+            flat[key] = str(value)
+    return flat
+
+
+class Catalog:
+    """Index of the saved scans
+
+    Parameters
+    ----------
+    path : str
+        The database file. If it is a folder (or has no extension), :data:`CATALOG_FILENAME` inside of it is
+        used
+    """
+
+    def __init__(self, path):
+        path = Path(path).expanduser()
+        if path.is_dir() or not path.suffix:
+            path = path / CATALOG_FILENAME
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def next_filename(self, folder, filename):
+        """Reserves the next free name for a file, such as ``data_0003.dat`` for ``data.dat``.
+
+        The number is reserved in a transaction, so two experiments saving to the same folder never get
+        the same name. The first time a folder is used, files already there are taken into account.
+
+        Parameters
+        ----------
+        folder : Path
+            The folder where the file will be saved
+        filename : str
+            The base name, such as ``data.dat``
+
+        Returns
+        -------
+        Path
+            The complete path of the file
+        """
+        folder = Path(folder)
+        filename = Path(filename)
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            row = cursor.execute(
+                "SELECT last FROM sequences WHERE folder = ? AND name = ?", (str(folder), filename.name)
+            ).fetchone()
+            if row is None:
+                last = self._last_on_disk(folder, filename)
+                cursor.execute("INSERT INTO sequences VALUES (?, ?, ?)", (str(folder), filename.name, last + 1))
+            else:
+                last = row["last"]
+                cursor.execute(
+                    "UPDATE sequences SET last = ? WHERE folder = ? AND name = ?",
+                    (last + 1, str(folder), filename.name),
+                )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return folder / f"{filename.stem}_{last + 1:04d}{filename.suffix}"
+
+    @staticmethod
+    def _last_on_disk(folder, filename):
+        """Largest number used by files in the folder, 0 if there are none. Every file of a scan counts, whatever
+        its extension (``.dat``, ``.npz`` of raw scans, ``.yml`` metadata, ``_processed`` data...)"""
+        pattern = re.compile(rf"{re.escape(filename.stem)}_(\d+)(?:[._]|$)")
+        numbers = [int(m.group(1)) for f in folder.glob(f"{filename.stem}_*") if (m := pattern.match(f.name))]
+        return max(numbers, default=0)
+
+    def add_scan(self, path, config, scan_range, scan_data, idn=None, saved_at=None):
+        """Registers a saved scan
+
+        Parameters
+        ----------
+        path : Path
+            The data file
+        config : dict
+            The configuration used for the scan
+        scan_range : array of float
+            The output voltages, in Volts
+        scan_data : array of float
+            The measured currents, in Amperes
+        idn : str
+            The identification of the device
+        saved_at : datetime
+            When the scan was saved, now by default
+
+        Returns
+        -------
+        int
+            The id of the scan in the catalog
+        """
+        saved_at = saved_at or datetime.now()
+        scan_range = np.asarray(scan_range)
+        scan_data = np.asarray(scan_data)
+        has_data = len(scan_data) > 0
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(
+                "INSERT OR REPLACE INTO scans (path, saved_at, idn, num_points, voltage_min, voltage_max, "
+                "current_min, current_max, current_mean) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(Path(path).expanduser().absolute()),
+                    saved_at.timestamp(),
+                    idn,
+                    len(scan_data),
+                    float(scan_range.min()) if has_data else None,
+                    float(scan_range.max()) if has_data else None,
+                    float(scan_data.min()) if has_data else None,
+                    float(scan_data.max()) if has_data else None,
+                    float(scan_data.mean()) if has_data else None,
+                ),
+            )
+            scan_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO config VALUES (?, ?, ?)",
+                [(scan_id, key, value) for key, value in flatten_config(config).items()],
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return scan_id
+
+    def query(self, since=None, until=None, idn=None, config=None):
+        """Finds scans in the catalog
+
+        Parameters
+        ----------
+        since : datetime
+            Only scans saved at or after this moment
+        until : datetime
+            Only scans saved before this moment
+        idn : str
+            Only scans acquired with this device
+        config : dict
+            Values that the config of the scans must have, such as ``{"resistance": "220ohm"}``. Keys can be
+            complete (``DAQ.resistance``) or only their last part
+
+        Returns
+        -------
+        list of dict
+            The scans found, sorted by the time they were saved
+        """
+        conditions = []
+        parameters = []
+        if since is not None:
+            conditions.append("saved_at >= ?")
+            parameters.append(since.timestamp())
+        if until is not None:
+            conditions.append("saved_at < ?")
+            parameters.append(until.timestamp())
+        if idn is not None:
+            conditions.append("idn = ?")
+            parameters.append(idn)
+        for key, value in (config or {}).items():
+            # The end of the key is compared exactly, LIKE would take _ and % in the key as wildcards
+            conditions.append(
+                "id IN (SELECT scan_id FROM config WHERE value = ? AND (key = ? OR substr(key, ?) = ?))"
+            )
+            parameters.extend([str(value), key, -len(key) - 1, f".{key}"])
+        sql = "SELECT * FROM scans"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY saved_at"
+        scans = []
+        for row in self.connection.execute(sql, parameters):
+            scan = dict(row)
+            scan["saved_at"] = datetime.fromtimestamp(scan["saved_at"])
+            scans.append(scan)
+        return scans
+
+    def close(self):
+        self.connection.close()
+
+
+def parse_moment(text):
+    """Converts an ISO date, such as ``2024-05-01``, or a time ago, such as ``7d`` or ``12h``, to a datetime"""
+    match = re.fullmatch(r"(\d+)([dhm])", text)
+    if match:
+        units = {"d": "days", "h": "hours", "m": "minutes"}[match.group(2)]
+        return datetime.now() - timedelta(**{units: int(match.group(1))})
+    return datetime.fromisoformat(text)
+
+
+def main(args):
+    """Command line interface to query the catalog, see the module documentation"""
+    parser = argparse.ArgumentParser(prog="py4lab catalog", description="Find saved scans")
+    parser.add_argument("catalog", help="The catalog file or the data folder that contains it")
+    parser.add_argument("filters", nargs="*", metavar="KEY=VALUE", help="Values of the config of the scans")
+    parser.add_argument("--since", type=parse_moment, help="Date (2024-05-01) or time ago (7d, 12h)")
+    parser.add_argument("--until", type=parse_moment, help="Date (2024-05-01) or time ago (7d, 12h)")
+    parser.add_argument("--idn", help="Identification of the device")
+    options = parser.parse_intermixed_args(args)
+
+    config = dict(f.split("=", 1) for f in options.filters)
+    catalog = Catalog(options.catalog)
+    for scan in catalog.query(options.since, options.until, options.idn, config):
+        print(f"{scan['saved_at']:%Y-%m-%d %H:%M:%S}  {scan['num_points']:6d} points  {scan['path']}")
+    catalog.close()
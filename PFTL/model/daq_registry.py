@@ -0,0 +1,60 @@
+"""
+DAQ Registry
+============
+DAQ models are found through the ``pftl.daq`` entry point group. Any installed package can make its own
+models available to Python for the Lab, without modifying this package, by declaring them in its
+``setup.py``::
+
+    entry_points={
+        "pftl.daq": ["MyBoard = my_package.my_board:MyBoardDaq"],
+    }
+
+The name used in the entry point is the one to use in the DAQ section of the config file. Modules are
+imported only when a DAQ is loaded, therefore a model that depends on drivers that are not installed does
+not prevent the others from working.
+
+Models that ship with this package are always available, even when it is used without being installed.
+"""
+from importlib import import_module
+from importlib.metadata import entry_points
+
+ENTRY_POINT_GROUP = "pftl.daq"
+
+BUILTIN_DAQS = {
+    "DummyDaq": "PFTL.model.dummy_daq:DummyDaq",
+    "AnalogDaq": "PFTL.model.analog_daq:AnalogDaq",
+}
+
+
+def available_daqs():
+    """Finds the available DAQ models without importing them
+
+    Returns
+    -------
+    dict
+        The path of each model, in the form ``module:ClassName``, keyed by name
+    """
+    daqs = dict(BUILTIN_DAQS)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        daqs[entry_point.name] = entry_point.value
+    return daqs
+
+
+def load_daq_class(name):
+    """Imports the class of a DAQ model
+
+    Parameters
+    ----------
+    name : str
+        The name of the model, as in the config file
+
+    Returns
+    -------
+    type
+        A subclass of :class:`~PFTL.model.base_daq.DAQBase`
+    """
+    daqs = available_daqs()
+    if name not in daqs:
+        raise Exception(f"The daq specified is not yet supported. Available: {', '.join(sorted(daqs))}")
+    module_name, class_name = daqs[name].split(":")
+    return getattr(import_module(module_name), class_name)
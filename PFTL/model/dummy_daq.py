@@ -3,42 +3,181 @@ Dummy DAQ model
 ===============
 Simulated device that allows to run the program without any DAQ card attached to the computer.
 
-It returns random values for the methods that should read from the device.
+It simulates the circuit of the experiment: each analog output drives a diode (following the Shockley
+equation) in series with a resistor, and the analog input with the same number reads the voltage across the
+resistor. Both the outputs and the inputs keep the resolution of the real converters, and Gaussian noise is
+added to the inputs. The noise can be seeded to get reproducible data, and a latency per reading can be
+added to mimic the time it takes to communicate with the real device.
 
+The voltage across the resistor is computed for every DAC code when the object is created, therefore
+simulating readings, one by one or as full arrays, is only a matter of indexing and adding noise.
 """
 
-from random import random
+from time import sleep
 
-from PFTL import ur
+import numpy as np
+
+from PFTL import THERMAL_VOLTAGE, ur
 from PFTL.model.base_daq import DAQBase
 
 
+def _magnitude(value, units):
+    """Returns the magnitude of a value in the given units. Strings such as ``'220ohm'`` and quantities are
+    converted, plain numbers are assumed to already be in the right units."""
+    if isinstance(value, str):
+        value = ur(value)
+    if hasattr(value, "m_as"):
+        return value.m_as(units)
+    return float(value)
+
+
 class DummyDaq(DAQBase):
-    def get_input_voltage(self, channel):
-        """Generates a random value in Volts
+    """Simulated DAQ, with a diode and a resistor connected to each output
+
+    Parameters
+    ----------
+    port : str
+        Not used, kept to have the same signature than the other DAQs
+    resistance : Quantity or str or float
+        The resistor in series with the diode (Ohm if a number)
+    saturation_current : Quantity or str or float
+        Saturation current of the diode (A if a number)
+    ideality : float
+        Ideality factor of the diode
+    noise : Quantity or str or float
+        Standard deviation of the noise added to the inputs (V if a number)
+    latency : Quantity or str or float
+        Time that every reading takes (s if a number). Reading several samples takes that time for each one
+    seed : int
+        Seed for the noise, None for non-reproducible data
+    """
+
+    CAPABILITIES = {"sweep": True, "max_sample_rate": None}
+
+    def __init__(self, port, resistance="220ohm", saturation_current="1e-18A", ideality=2,
+                 noise="2mV", latency="0s", seed=None):
+        super().__init__(port)
+        self.resistance = _magnitude(resistance, "ohm")
+        self.saturation_current = _magnitude(saturation_current, "A")
+        self.ideality = float(ideality)
+        self.noise = _magnitude(noise, "V")
+        self.latency = _magnitude(latency, "s")
+        self.rng = np.random.default_rng(seed)
+        self.outputs = {0: 0, 1: 0}
+        self.resistor_volts = self.circuit_response(self.code_to_volts(np.arange(self.DAC_MAX + 1)))
+
+    @classmethod
+    def from_config(cls, config):
+        """Uses the resistance of the DAQ section and the options of its ``simulation`` entry, if any"""
+        options = {"resistance": config["resistance"]}
+        options.update(config.get("simulation") or {})
+        return cls(config["port"], **options)
+
+    def circuit_response(self, volts):
+        """Voltage across the resistor when applying the given voltages to the diode and the resistor.
+
+        The current ``I`` solves ``V = I * R + n * Vt * ln(1 + I / Is)``, which is monotonic in ``I`` and is
+        solved by bisection for all the voltages at once.
+
+        Parameters
+        ----------
+        volts : array of float
+            Applied voltages, in Volts
+
+        Returns
+        -------
+        array of float
+            Voltage across the resistor, in Volts
+        """
+        volts = np.asarray(volts, dtype=float)
+        low = np.zeros_like(volts)
+        high = np.clip(volts, 0, None) / self.resistance
+        n_vt = self.ideality * THERMAL_VOLTAGE
+        for _ in range(60):
+            current = (low + high) / 2
+            too_high = current * self.resistance + n_vt * np.log1p(current / self.saturation_current) > volts
+            high = np.where(too_high, current, high)
+            low = np.where(too_high, low, current)
+        return (low + high) / 2 * self.resistance
+
+    def idn(self):
+        return "PFTL Dummy DAQ"
+
+    def set_output_voltage(self, channel, volts):
+        self.outputs[channel] = int(self.volts_to_code(volts.m_as("V")))
+
+    def write_prepared_output(self, channel, prepared):
+        self.outputs[channel] = prepared
+
+    def get_output_voltage(self, channel, force=False):
+        """The voltage set on an output, as limited by the resolution of the DAC
 
         Returns
         -------
         Quantity
-            Random value
+            The voltage setpoint in the channel
+        """
+        return self.code_to_volts(self.outputs[channel]) * ur("V")
+
+    def simulate_input(self, volts):
+        """Adds noise to voltages on an input and quantizes them as the ADC would
+
+        Parameters
+        ----------
+        volts : float or array of float
+            The voltage on the input, in Volts
+
+        Returns
+        -------
+        array of int
+            ADC codes
         """
-        return random()*ur('V')
+        volts = volts + self.rng.normal(0, self.noise, np.shape(volts))
+        codes = np.rint(volts / self.V_REF * self.ADC_MAX)
+        return np.clip(codes, 0, self.ADC_MAX).astype(int)
 
-    def get_output_voltage(self, channel):
-        """ Generates a random value in Volts
+    def get_input_voltage(self, channel):
+        """Simulated reading of the voltage across the resistor
 
         Returns
         -------
         Quantity
-            Random value
+            The voltage read
         """
-        return random() * ur('V')
+        return self.adc_to_volts(self.get_input_code(channel), channel) * ur("V")
+
+    def get_input_code(self, channel):
+        return int(self.get_input_codes(channel, 1)[0])
+
+    def get_input_codes(self, channel, num_samples):
+        if self.latency:
+            sleep(self.latency * num_samples)
+        if channel in self.outputs:
+            volts = self.resistor_volts[self.outputs[channel]]
+        else:
+            volts = 0
+        return self.simulate_input(np.full(num_samples, volts))
+
+    def sweep(self, channel_out, channel_in, codes, num_samples=1, delay=0):
+        """Generates the readings of a full sweep at once. See :meth:`~PFTL.model.base_daq.DAQBase.sweep`"""
+        codes = np.asarray(codes, dtype=int)
+        if self.latency or delay:
+            sleep((self.latency * num_samples + delay) * len(codes))
+        if channel_in == channel_out:
+            volts = self.resistor_volts[codes]
+        elif channel_in in self.outputs:
+            volts = np.full(len(codes), self.resistor_volts[self.outputs[channel_in]])
+        else:
+            volts = np.zeros(len(codes))
+        if len(codes):
+            self.outputs[channel_out] = int(codes[-1])
+        return self.simulate_input(np.repeat(volts[:, np.newaxis], num_samples, axis=1))
 
 
 if __name__ == "__main__":
-    daq = DummyDaq("/dev/ttyACM0")
+    daq = DummyDaq("/dev/ttyACM0", seed=0)
     daq.initialize()
-    voltage = 3
+    voltage = ur("3V")
     daq.set_output_voltage(0, voltage)
     input_volts = daq.get_input_voltage(0)
     print(input_volts)
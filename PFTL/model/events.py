@@ -0,0 +1,63 @@
+"""
+Experiment events
+=================
+Instead of checking periodically whether there is new data, code that uses an
+:class:`~PFTL.model.experiment.Experiment` can subscribe to it and gets notified when something happens::
+
+    >>> def on_event(event):
+    ...     if isinstance(event, PointsAcquired):
+    ...         print(experiment.scan_data[event.start:event.stop])
+    >>> experiment.subscribe(on_event)
+
+Callbacks are called from the thread that runs the scan, therefore they must be quick. New points are
+notified in batches, at most every :data:`~PFTL.model.experiment.PUBLISH_INTERVAL`. For the user interface,
+see :mod:`~PFTL.view.experiment_signals`, which turns events into Qt signals.
+"""
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class ScanStarted:
+    """A scan started. ``num_points`` is the number of points it will acquire"""
+    num_points: int
+
+
+@dataclass
+class PointsAcquired:
+    """New data available in ``scan_data[start:stop]``"""
+    start: int
+    stop: int
+
+
+@dataclass
+class ScanFinished:
+    """The scan is over, either because it was completed or stopped. ``num_points`` were acquired"""
+    num_points: int
+
+
+@dataclass
+class ScanError:
+    """The scan stopped because of an error"""
+    message: str
+
+
+@dataclass
+class FitUpdated:
+    """New result of the :mod:`~PFTL.model.live_fit`. ``voltages`` and ``currents`` are the fitted curve"""
+    ideality: float
+    saturation_current: Any
+    series_resistance: Any
+    num_points: int
+    converged: bool
+    voltages: Any
+    currents: Any
+
+
+@dataclass
+class AverageUpdated:
+    """A sweep of a repeated scan finished. ``average`` and ``standard_error`` are the currents of every point
+    over the first ``repeats`` sweeps, see :mod:`~PFTL.model.averaging`"""
+    repeats: int
+    average: Any
+    standard_error: Any
@@ -5,15 +5,37 @@ Building a model for the experiment allows developers to have a clear picture of
 experiments. It allows to build simple GUIs around them and to easily share the code with other users.
 
 """
+import queue
 import threading
+import traceback
 from datetime import datetime
 from pathlib import Path
-from time import sleep
+from time import perf_counter, sleep
 
 import numpy as np
 import yaml
 
 from PFTL import ur
+from PFTL.model.averaging import RunningAverage
+from PFTL.model.calibration import calibrate
+from PFTL.model.catalog import Catalog
+from PFTL.model.daq_registry import load_daq_class
+from PFTL.model.events import AverageUpdated, PointsAcquired, ScanError, ScanFinished, ScanStarted
+from PFTL.model.grid_scan import GridOrder, GridPlan
+from PFTL.model.live_fit import LiveFit
+from PFTL.model.processing import LiveProcessing, Pipeline
+from PFTL.model.raw_data import CodeArray, save_raw_scan
+from PFTL.model.scan_plan import ScanPlan
+from PFTL.model.telemetry import Telemetry
+
+#: Approximate duration of each of the sweeps in which a scan is split, in seconds
+SWEEP_CHUNK_TIME = 0.05
+#: Largest number of points swept at once
+MAX_SWEEP_CHUNK = 4096
+#: Minimum time between notifications of new points, in seconds
+PUBLISH_INTERVAL = 0.02
+#: Sweeps of a repeated scan done before its standard error is used to stop it
+MIN_REPEATS = 3
 
 
 class Experiment:
@@ -31,16 +53,25 @@ class Experiment:
         self.config_file = config_file
         self.is_running = False  # Variable to check if the scan is running
         self.daq = None
+        self.idn = None  # Identification of the DAQ, stored with the data
 
         self.scan_range = np.array([0]) * ur("V")
         self.scan_data = np.array([0]) * ur("V")
+        self.settling_time = np.array([0]) * ur("s")
+        self.last_average = None  # The latest AverageUpdated event of a repeated scan
 
-        self.last_measured_value = 0 * ur("A")
-        self.voltage_out = 0 * ur("V")
+        self._stream_value = 0 * ur("A")  # The latest reading of iter_stream
 
         self.keep_running = False
         self.current_scan_index = 0
 
+        self.subscribers = []
+        self.live_fit = None
+        self.processing = None
+        self.telemetry = None
+        self.idle = threading.Event()  # Set while no scan is running
+        self.idle.set()
+
     def load_config(self):
         """Load the configuration file"""
         with open(self.config_file, "r") as f:
@@ -48,55 +79,408 @@ class Experiment:
         self.config = data
 
     def load_daq(self):
-        """Load the DAQ. Works with ``DummyDaq`` or ``AnalogDaq``
+        """Load the DAQ specified in the config file. Models are found by name through the
+        :mod:`~PFTL.model.daq_registry` and each one of them builds itself from the DAQ section of the config,
+        see :meth:`~PFTL.model.base_daq.DAQBase.from_config`.
 
         NOTE:
-            The import of DummyDaq or AnalogDaq happen in this method. It is not best practice, but shows a pattern that
+            The module of the DAQ is imported in this method. It is not best practice, but shows a pattern that
             is allowed by Python and exploited by many developers. It allows to dynamically load modules if we need them
             which opens interesting alternatives to having the full program developed.
         """
-        name = self.config["DAQ"]["name"]
-        port = self.config["DAQ"]["port"]
-        if name == "DummyDaq":
-            from PFTL.model.dummy_daq import DummyDaq
-            self.daq = DummyDaq(port)
-
-        elif name == "AnalogDaq":
-            from PFTL.model.analog_daq import AnalogDaq
-            self.daq = AnalogDaq(port)
-        else:
-            raise Exception("The daq specified is not yet supported")
+        daq_class = load_daq_class(self.config["DAQ"]["name"])
+        self.daq = daq_class.from_config(self.config["DAQ"])
 
         self.daq.initialize()
+        self.idn = self.daq.idn()
+        if "calibration" in self.config["DAQ"]:
+            self.calibrate()
+        self.setup_analysis()
+        self.setup_processing()
+        self.setup_telemetry()
+
+    def setup_analysis(self):
+        """Starts the :mod:`~PFTL.model.live_fit` if it is enabled in the ``Analysis`` section of the config"""
+        options = dict(self.config.get("Analysis") or {})
+        if options.pop("live_fit", False) and self.live_fit is None:
+            self.live_fit = LiveFit(self, **options)
+
+    def setup_processing(self):
+        """Starts processing the data as it is acquired if there is a ``Processing`` section in the config, see
+        :mod:`~PFTL.model.processing`"""
+        if self.config.get("Processing") and self.processing is None:
+            self.processing = LiveProcessing(self, Pipeline.from_config(self.config["Processing"]))
+
+    def setup_telemetry(self):
+        """Starts serving the :mod:`~PFTL.model.telemetry` if there is a ``Telemetry`` section in the config"""
+        if "Telemetry" in self.config and self.telemetry is None:
+            self.telemetry = Telemetry(self, **(self.config["Telemetry"] or {}))
+            print(f"Telemetry available at {self.telemetry.address}/metrics")
+
+    def calibrate(self, force=False):
+        """Loads the calibration of the DAQ, running a loopback scan if the device was never calibrated. See
+        :mod:`~PFTL.model.calibration`. The options are taken from the ``calibration`` entry of the DAQ
+        section of the config file, for example::
+
+            calibration:
+              folder: ~/.pftl/calibration
+              channel_out: 1
+              channels_in: [0]
+              num_points: 64
+              averages: 4
+
+        Parameters
+        ----------
+        force : bool
+            If True, the calibration scan is repeated even if the device was already calibrated
+        """
+        options = self.config["DAQ"]["calibration"] or {}
+        self.daq.calibration = calibrate(
+            self.daq,
+            options.get("channel_out", 0),
+            options.get("channels_in", [0]),
+            options.get("folder", "~/.pftl/calibration"),
+            force=force,
+            num_points=options.get("num_points", 64),
+            averages=options.get("averages", 4),
+        )
 
     def do_scan(self):
-        """Does a scan. This method blocks. See :meth:`~start_scan` for threaded scans."""
+        """Does a scan. This method blocks. See :meth:`~start_scan` for threaded scans.
+
+        The setpoints, the commands for the device and the conversion from ADC values to currents are
+        prepared before the scan starts (see :class:`~PFTL.model.scan_plan.ScanPlan`). If the option
+        ``deduplicate`` is set in the Scan section of the config, setpoints that the DAC can't distinguish
+        are measured only once. If the Scan section has ``axes``, the scan is a grid over several outputs,
+        see :mod:`~PFTL.model.grid_scan`.
+
+        Instead of waiting a fixed ``delay`` after every setpoint, the input can be read until it settles, see
+        :meth:`settling_options`. The time each point needed is stored in :attr:`settling_time`.
+
+        With the ``repeats`` option, the sweep is done several times and averaged, see
+        :mod:`~PFTL.model.averaging`. The data holds the latest sweep and :attr:`last_average` the average.
+        """
         if self.is_running:
-            print("Scan already running")
-            return
+            raise Exception("Scan already running")
         self.is_running = True
-        start = ur(self.config["Scan"]["start"]).m_as("V")
-        stop = ur(self.config["Scan"]["stop"]).m_as("V")
-        num_steps = int(self.config["Scan"]["num_steps"])
-        delay = ur(self.config["Scan"]["delay"])
-        self.scan_range = np.linspace(start, stop, num_steps) * ur("V")
-        self.scan_data = np.zeros(num_steps) * ur("A")
+        self.idle.clear()
+        try:
+            if self.is_grid_scan:
+                self._grid_scan()
+            else:
+                self._line_scan()
+            self._publish_progress(force=True)
+        except Exception as e:
+            self.publish(ScanError(str(e)))
+            raise
+        finally:
+            self.is_running = False
+            self.idle.set()
+            self.publish(ScanFinished(self.current_scan_index))
+
+    @property
+    def voltage_out(self):
+        """The output voltage of the latest point of the scan. It is taken from the data when it is read, so the
+        scan loops only update :attr:`current_scan_index`"""
+        if not self.current_scan_index:
+            return 0 * ur("V")
+        return self.scan_range[self.current_scan_index - 1]
+
+    @property
+    def last_measured_value(self):
+        """The current of the latest point of the scan, or the latest reading of :meth:`iter_stream`"""
+        if not self.current_scan_index:
+            return self._stream_value
+        return self.scan_data[self.current_scan_index - 1]
+
+    @property
+    def is_grid_scan(self):
+        """Whether the Scan section of the config defines a grid over several outputs"""
+        return "axes" in self.config["Scan"]
+
+    def _line_scan(self):
+        """Scans a single output"""
+        channel_out = self.config["Scan"]["channel_out"]
+        channel_in = self.config["Scan"]["channel_in"]
+        plan = ScanPlan(
+            self.daq,
+            channel_out,
+            channel_in,
+            ur(self.config["Scan"]["start"]).m_as("V"),
+            ur(self.config["Scan"]["stop"]).m_as("V"),
+            int(self.config["Scan"]["num_steps"]),
+            ur(self.config["DAQ"]["resistance"]).m_as("ohm"),
+            deduplicate=self.config["Scan"].get("deduplicate", False),
+        )
+        if plan.num_repeated:
+            print(f"{plan.num_repeated} setpoints repeat the previous DAC value")
+        delay = ur(self.config["Scan"]["delay"]).m_as("s")
+        self._begin_scan(plan.codes, plan.input_current)
+        for _ in self._repeats():
+            if self.daq.CAPABILITIES.get("sweep") and self._settling is None:
+                self._sweep(channel_out, channel_in, plan.codes, delay)
+            else:
+                self._step(channel_out, channel_in, plan.commands, delay)
+
+    def _grid_scan(self):
+        """Scans a grid line by line. Slower outputs are only written when they change, which in serpentine
+        order means once per line"""
+        channel_in = self.config["Scan"]["channel_in"]
+        plan = GridPlan(self.daq, self.config["Scan"], ur(self.config["DAQ"]["resistance"]).m_as("ohm"))
+        delay = ur(self.config["Scan"]["delay"]).m_as("s")
+        self._begin_scan(plan.fast_codes(), plan.input_current)
+        fast = plan.axes[-1]
+        positions = [None] * (len(plan.axes) - 1)
+        for _ in self._repeats():
+            for number in range(plan.order.num_lines):
+                if not self.keep_running:
+                    break
+                first, outer, steps = plan.line(number)
+                for axis, step in enumerate(outer):
+                    if positions[axis] != step:
+                        self.daq.write_prepared_output(plan.channels[axis], plan.axes[axis].commands[step])
+                        positions[axis] = step
+                if self.daq.CAPABILITIES.get("sweep") and self._settling is None:
+                    self._sweep(plan.channels[-1], channel_in, fast.codes[steps], delay, first)
+                else:
+                    commands = [fast.commands[step] for step in steps]
+                    self._step(plan.channels[-1], channel_in, commands, delay, first)
+
+    def _repeats(self):
+        """Yields once per sweep of the scan, as many times as the ``repeats`` option of the Scan section asks.
+        Complete sweeps are added to the average, and the sweeps end when the standard error of every point
+        is below ``target_error``. See :mod:`~PFTL.model.averaging`"""
+        repeats = int(self.config["Scan"].get("repeats", 1))
+        if repeats < 1:
+            raise Exception(f"repeats must be at least 1, not {repeats}")
+        target_error = self.config["Scan"].get("target_error")
+        target_error = ur(target_error).m_as("A") if target_error else None
+        num_points = len(self.scan_data)
+        average = RunningAverage(num_points) if repeats > 1 else None
+        for number in range(repeats):
+            if number:
+                self.current_scan_index = 0
+                self._published_index = 0
+                self.publish(ScanStarted(num_points))
+            yield number
+            if average is None or self.current_scan_index < num_points:
+                break
+            self._publish_progress(force=True)
+            average.add(self.scan_data.m_as("A"))
+            standard_error = average.standard_error
+            self.last_average = AverageUpdated(
+                average.count, ur.Quantity(average.mean.copy(), "A"), ur.Quantity(standard_error, "A")
+            )
+            self.publish(self.last_average)
+            if not self.keep_running:
+                break
+            if target_error is not None and average.count >= MIN_REPEATS and standard_error.max() <= target_error:
+                print(f"Standard error below {target_error:.2e} A after {average.count} sweeps")
+                break
+
+    def _begin_scan(self, codes, input_current):
+        """Allocates the data of a scan with the given DAC codes, in the order they are output, and announces
+        it. ``input_current`` is the current for every ADC code"""
+        self.allocate_scan(len(codes))
+        if isinstance(self.scan_data, CodeArray):
+            self.scan_range.codes[:] = codes
+            self.scan_range.table = self.daq.code_to_volts(np.arange(self.daq.DAC_MAX + 1))
+            self.scan_data.table = input_current
+            self._input_buffer = self.scan_data.codes
+            self._input_table = np.arange(self.daq.ADC_MAX + 1, dtype=np.uint16)
+        else:
+            self.scan_range.magnitude[:] = self.daq.code_to_volts(codes)
+            self._input_buffer = self.scan_data.magnitude
+            self._input_table = input_current
         self.current_scan_index = 0
+        self._published_index = 0
+        self._last_publish = perf_counter()
+        self._settling = self.settling_options()
+        self.last_average = None
         self.keep_running = True
-        for volt in self.scan_range:
+        self.publish(ScanStarted(len(codes)))
+
+    def settling_options(self):
+        """Options to wait for the input to settle after every setpoint, instead of waiting a fixed delay. They
+        are set with the ``settling`` entry of the Scan section of the config::
+
+            settling:
+              tolerance: 5mV  # Largest difference between readings considered settled
+              readings: 3  # Consecutive readings that must agree
+              max_wait: 100ms  # Move on after this time even if the input didn't settle
+              interval: 0ms  # Time between readings
+
+        Returns
+        -------
+        dict or None
+            Arguments for :meth:`~PFTL.model.base_daq.DAQBase.settle`, None to use the fixed delay
+        """
+        options = self.config["Scan"].get("settling")
+        if not options:
+            return None
+        tolerance = ur(options.get("tolerance", "5mV")).m_as("V")
+        return {
+            "tolerance": tolerance / self.daq.V_REF * self.daq.ADC_MAX,
+            "readings": int(options.get("readings", 3)),
+            "max_wait": ur(options.get("max_wait", "100ms")).m_as("s"),
+            "interval": ur(options.get("interval", "0ms")).m_as("s"),
+        }
+
+    def grid_data(self, currents=None):
+        """The data of the current grid scan arranged as a dense array, with one dimension per axis (and one
+        more for the direction in bidirectional scans). Points not measured yet are NaN.
+
+        Parameters
+        ----------
+        currents : Quantity
+            The values to arrange, in the order of the scan. By default, the points measured so far
+
+        Returns
+        -------
+        Quantity
+            In Amperes
+        """
+        order = GridOrder.from_config(self.config["Scan"])
+        if currents is None:
+            currents = self.scan_data[: self.current_scan_index]
+        return ur.Quantity(order.to_dense(currents.m_as("A")), "A")
+
+    def grid_axes(self):
+        """The output channel and the setpoints of each axis of the grid scan
+
+        Returns
+        -------
+        list of tuple
+            ``(channel_out, setpoints)``, with the setpoints as a Quantity in Volts
+        """
+        return [
+            (
+                axis["channel_out"],
+                ur.Quantity(
+                    np.linspace(ur(axis["start"]).m_as("V"), ur(axis["stop"]).m_as("V"), int(axis["num_steps"])),
+                    "V",
+                ),
+            )
+            for axis in self.config["Scan"]["axes"]
+        ]
+
+    def merge_scan(self, values):
+        """The Scan section of the config with some values replaced. In grid scans, ``start``, ``stop``,
+        ``num_steps`` and ``channel_out`` refer to the fast axis.
+
+        Parameters
+        ----------
+        values : dict
+            New values for the Scan section
+
+        Returns
+        -------
+        dict
+        """
+        scan = dict(self.config["Scan"])
+        if "axes" not in scan:
+            scan.update(values)
+            return scan
+        axes = [dict(axis) for axis in scan["axes"]]
+        for key, value in values.items():
+            if key in ("start", "stop", "num_steps", "channel_out"):
+                axes[-1][key] = value
+            else:
+                scan[key] = value
+        scan["axes"] = axes
+        return scan
+
+    def subscribe(self, callback):
+        """Registers a function to be called with every event of the experiment, see :mod:`~PFTL.model.events`
+
+        Parameters
+        ----------
+        callback : callable
+            Function that takes the event as its only argument. It is called from the thread of the scan
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stops calling a function registered with :meth:`subscribe`"""
+        self.subscribers.remove(callback)
+
+    def publish(self, event):
+        """Calls all the subscribers with an event. Errors in the subscribers are printed but don't stop the
+        experiment."""
+        for callback in list(self.subscribers):
+            try:
+                callback(event)
+            except Exception:
+                traceback.print_exc()
+
+    def _publish_progress(self, force=False):
+        """Publishes the points acquired since the last time, if :data:`PUBLISH_INTERVAL` has passed"""
+        now = perf_counter()
+        if self.current_scan_index > self._published_index and (
+            force or now - self._last_publish >= PUBLISH_INTERVAL
+        ):
+            self.publish(PointsAcquired(self._published_index, self.current_scan_index))
+            self._published_index = self.current_scan_index
+            self._last_publish = now
+
+    def allocate_scan(self, num_points):
+        """Creates the arrays that hold the scan range, in Volts, the scan data, in Amperes, and the settling
+        time of every point, in seconds. The scan writes directly into their magnitudes, therefore subclasses
+        can place them elsewhere, for example in shared memory (see :mod:`~PFTL.model.process_experiment`).
+        With the ``raw`` option of the Scan section, the range and the data keep the integer codes instead,
+        see :mod:`~PFTL.model.raw_data`.
+
+        Parameters
+        ----------
+        num_points : int
+            The number of points of the scan
+        """
+        if self.config["Scan"].get("raw"):
+            self.scan_range = CodeArray(np.zeros(num_points, dtype=np.uint16), np.zeros(1), "V")
+            self.scan_data = CodeArray(np.zeros(num_points, dtype=np.uint16), np.zeros(1), "A")
+        else:
+            self.scan_range = ur.Quantity(np.zeros(num_points), "V")
+            self.scan_data = ur.Quantity(np.zeros(num_points), "A")
+        self.settling_time = ur.Quantity(np.zeros(num_points), "s")
+
+    def _step(self, channel_out, channel_in, commands, delay, first=0):
+        """Scans point by point, for DAQs that can't do sweeps on their own or to wait for every point to
+        settle. The data is stored from the position ``first`` on"""
+        data = self._input_buffer
+        input_table = self._input_table
+        settling_time = self.settling_time.magnitude
+        settling = self._settling
+        for i, command in enumerate(commands, start=first):
             if not self.keep_running:
                 break
-            self.daq.set_output_voltage(self.config["Scan"]["channel_out"], volt)
-            self.voltage_out = self.daq.get_output_voltage(
-                self.config["Scan"]["channel_out"]
-            )
-            measured_voltage = self.daq.get_input_voltage(self.config["Scan"]["channel_in"])
-            measured_current = measured_voltage / ur(self.config['DAQ']['resistance'])
-            self.last_measured_value = measured_current
-            self.scan_data[self.current_scan_index] = measured_current
+            self.daq.write_prepared_output(channel_out, command)
+            if settling is None:
+                data[i] = input_table[self.daq.get_input_code(channel_in)]
+            else:
+                code, settling_time[i] = self.daq.settle(channel_in, **settling)
+                data[i] = input_table[code]
             self.current_scan_index += 1
-            sleep(delay.m_as("s"))
-        self.is_running = False
+            self._publish_progress()
+            if settling is None:
+                sleep(delay)
+
+    def _sweep(self, channel_out, channel_in, codes, delay, first=0):
+        """Scans using :meth:`~PFTL.model.base_daq.DAQBase.sweep`. The scan is split in chunks that last
+        about :data:`SWEEP_CHUNK_TIME`, to keep the progress up to date and to be able to stop it. The data
+        is stored from the position ``first`` on"""
+        data = self._input_buffer
+        max_rate = self.daq.CAPABILITIES.get("max_sample_rate")
+        point_time = max(delay, 1 / max_rate if max_rate else 0)
+        chunk = max(1, int(SWEEP_CHUNK_TIME / point_time)) if point_time else MAX_SWEEP_CHUNK
+        chunk = min(chunk, MAX_SWEEP_CHUNK)
+        for start in range(0, len(codes), chunk):
+            if not self.keep_running:
+                break
+            stop = min(start + chunk, len(codes))
+            measured = self.daq.sweep(channel_out, channel_in, codes[start:stop], delay=delay)
+            data[first + start : first + stop] = self._input_table[measured[:, 0]]
+            self.current_scan_index = first + stop
+            self._publish_progress()
 
     def start_scan(self):
         """Start a scan on a separate thread"""
@@ -112,8 +496,115 @@ class Experiment:
         """
         self.keep_running = False
 
+    def iter_scan(self, max_pending=16):
+        """Runs a scan and yields its data as it is acquired. The scan runs on its own thread, as with
+        :meth:`start_scan`::
+
+            for voltages, currents in experiment.iter_scan():
+                print(currents.mean())
+
+        If the code consuming the data falls behind by more than ``max_pending`` batches, the scan waits for
+        it. Leaving the loop early stops the scan.
+
+        Parameters
+        ----------
+        max_pending : int
+            Number of batches of new points that can wait to be consumed
+
+        Yields
+        ------
+        voltages : Quantity
+            The output voltages of the new points. It is a view of :attr:`scan_range`, not a copy
+        currents : Quantity
+            The currents measured, a view of :attr:`scan_data`
+        """
+        if self.is_running:
+            raise Exception("Scan already running")
+        events = queue.Queue(maxsize=max_pending)
+
+        def on_event(event):
+            if isinstance(event, (PointsAcquired, ScanError, ScanFinished)):
+                events.put(event)
+
+        self.subscribe(on_event)
+        finished = False
+        try:
+            self.start_scan()
+            while not finished:
+                event = events.get()
+                if isinstance(event, PointsAcquired):
+                    yield self.scan_range[event.start : event.stop], self.scan_data[event.start : event.stop]
+                elif isinstance(event, ScanError):
+                    raise Exception(event.message)
+                else:
+                    finished = True
+        finally:
+            if not finished:
+                self.stop_scan()
+                # The scan may be waiting for room in the queue, it is emptied until the scan finishes
+                while not finished:
+                    finished = isinstance(events.get(), ScanFinished)
+            self.unsubscribe(on_event)
+
+    def iter_stream(self, chunk_size, channel_in=None, max_chunks=None):
+        """Reads an input continuously, leaving the outputs as they are, and yields the data in chunks of
+        ``chunk_size`` points. Readings are acquired only when the next chunk is requested, therefore a slow
+        consumer slows down the acquisition instead of piling up data in memory. It ends after ``max_chunks``
+        chunks, when the loop is left, or when :meth:`stop_scan` is called.
+
+        Parameters
+        ----------
+        chunk_size : int
+            Number of readings per chunk
+        channel_in : int
+            The input channel, by default the one of the Scan section of the config
+        max_chunks : int
+            Number of chunks to acquire, None to go on until stopped
+
+        Yields
+        ------
+        Quantity
+            The currents measured, in Amperes
+        """
+        if self.is_running:
+            raise Exception("Scan already running")
+        if channel_in is None:
+            channel_in = self.config["Scan"]["channel_in"]
+        resistance = ur(self.config["DAQ"]["resistance"]).m_as("ohm")
+        input_current = self.daq.adc_to_volts(np.arange(self.daq.ADC_MAX + 1), channel_in) / resistance
+        self.is_running = True
+        self.idle.clear()
+        self.keep_running = True
+        self.current_scan_index = 0  # The latest value is the one of the stream
+        try:
+            num_chunks = 0
+            while self.keep_running and (max_chunks is None or num_chunks < max_chunks):
+                currents = ur.Quantity(input_current[self.daq.get_input_codes(channel_in, chunk_size)], "A")
+                self._stream_value = currents[-1]
+                num_chunks += 1
+                yield currents
+        finally:
+            self.is_running = False
+            self.idle.set()
+
     def save_data(self):
-        """Save data to the folder specified in the config file."""
+        """Save data to the folder specified in the config file. The scan is registered in the
+        :mod:`~PFTL.model.catalog` of the folder, which also allocates the number of the new file.
+
+        The data of grid scans is also saved as a ``.npz`` file, with the dense array (``data``, in mA), the
+        setpoints of every axis (``axis_0``, ``axis_1``, ..., in V), their ``channels`` and the ``order``.
+        Scans acquired with the ``raw`` option are saved only as a ``.npz`` file with the codes, see
+        :func:`~PFTL.model.raw_data.save_raw_scan`.
+
+        Repeated scans are saved with the average of the sweeps instead of the latest one, and the standard
+        error of every point as the last column. If the data is processed while it is acquired (see
+        :mod:`~PFTL.model.processing`), the result is saved as well, with ``_processed`` added to the name.
+
+        Returns
+        -------
+        Path
+            The data file
+        """
 
         data_folder = Path(self.config["Saving"]["folder"]).expanduser()
         today_folder = f"{datetime.today():%Y-%m-%d}"
@@ -121,30 +612,96 @@ class Experiment:
 
         saving_folder.mkdir(exist_ok=True, parents=True)
 
-        data = np.vstack([self.scan_range.m_as('V'), self.scan_data.m_as('mA')]).T
-        header = "Scan range in 'V', Scan Data in 'mA'"
-
-        filename = Path(self.config["Saving"]["filename"])
-
-        i = 1
-        new_filename = f'{filename.stem}_{i:04d}{filename.suffix}'
-        complete_path = saving_folder / new_filename
-        while complete_path.exists():
-            new_filename = f'{filename.stem}_{i:04d}{filename.suffix}'
-            complete_path = saving_folder / new_filename
-            i += 1
+        catalog = Catalog(self.config["Saving"].get("catalog", data_folder))
+        complete_path = catalog.next_filename(saving_folder, self.config["Saving"]["filename"])
 
         metadata_file = complete_path.with_suffix('.yml')
-        np.savetxt(complete_path, data, header=header)
-
         with open(metadata_file, "w") as f:
             f.write(yaml.dump(self.config, default_flow_style=False))
 
+        grid = {}
+        if self.is_grid_scan:
+            axes = self.grid_axes()
+            grid = {
+                "channels": [channel for channel, _ in axes],
+                "order": self.config["Scan"].get("order", "serpentine"),
+                **{f"axis_{i}": setpoints.m_as("V") for i, (_, setpoints) in enumerate(axes)},
+            }
+
+        if isinstance(self.scan_data, CodeArray):
+            complete_path = complete_path.with_suffix(".npz")
+            channel_in = self.config["Scan"]["channel_in"]
+            calibration = self.daq.calibration
+            if self.config["Scan"].get("settling"):
+                grid["settling_time"] = self.settling_time.m_as("s")
+            if self.last_average is not None:
+                grid["average"] = self.last_average.average.m_as("A")
+                grid["standard_error"] = self.last_average.standard_error.m_as("A")
+                grid["repeats"] = self.last_average.repeats
+            save_raw_scan(
+                complete_path,
+                self.scan_range.codes,
+                self.scan_data.codes,
+                self.scan_range.table,
+                self.daq.adc_to_volts(np.arange(self.daq.ADC_MAX + 1), channel_in),
+                ur(self.config["DAQ"]["resistance"]).m_as("ohm"),
+                channel_in,
+                calibration.channels.get(channel_in) if calibration is not None else None,
+                **grid,
+            )
+        else:
+            currents = self.scan_data if self.last_average is None else self.last_average.average
+            data = np.vstack([self.scan_range.m_as('V'), currents.m_as('mA')]).T
+            header = "Scan range in 'V', Scan Data in 'mA'"
+            if self.config["Scan"].get("settling"):
+                data = np.column_stack([data, self.settling_time.m_as('ms')])
+                header += ", Settling time in 'ms'"
+            if self.last_average is not None:
+                data = np.column_stack([data, self.last_average.standard_error.m_as('mA')])
+                header = f"Average of {self.last_average.repeats} sweeps. {header}, Standard error in 'mA'"
+            np.savetxt(complete_path, data, header=header)
+            if grid:
+                np.savez(complete_path.with_suffix(".npz"), data=self.grid_data(currents).m_as("mA"), **grid)
+
+        if self.processing is not None and self.processing.num_points:
+            voltages, values = self.processing.data
+            np.savetxt(
+                complete_path.with_name(f"{complete_path.stem}_processed.dat"),
+                np.column_stack([voltages.m_as("V"), values.magnitude]),
+                header=f"Scan range in 'V', Processed data in '{values.units:~}'",
+            )
+
+        currents = self.scan_data if self.last_average is None else self.last_average.average
+        catalog.add_scan(complete_path, self.config, self.scan_range.m_as("V"), currents.m_as("A"), idn=self.idn)
+        catalog.close()
+        return complete_path
+
     def finalize(self):
         """Finalize the experiment, closing the communication with the device and stopping the scan"""
         print("Finalizing Experiment")
         self.stop_scan()
-        while self.is_running:
-            sleep(0.1)
+        self.idle.wait()
+        if self.live_fit is not None:
+            self.live_fit.close()
+        if self.processing is not None:
+            self.processing.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
 
         self.daq.finalize()
+
+    def __enter__(self):
+        """Loads the config, if it wasn't loaded yet, and the DAQ. The experiment is finalized at the end of
+        the block::
+
+            with Experiment("experiment.yml") as experiment:
+                for voltages, currents in experiment.iter_scan():
+                    ...
+        """
+        if not self.config:
+            self.load_config()
+        self.load_daq()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.finalize()
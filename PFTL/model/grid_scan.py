@@ -0,0 +1,181 @@
+"""
+Grid scans
+==========
+Scans over more than one output at once, for example a grid of the voltages of channels 0 and 1. Each
+output is an axis, and the data is a dense array with one dimension per axis. They are defined in the Scan
+section of the config file, the last axis being the one that changes fastest::
+
+    Scan:
+      channel_in: 0
+      delay: 10ms
+      order: serpentine
+      axes:
+        - {channel_out: 1, start: 0V, stop: 3.3V, num_steps: 100}
+        - {channel_out: 0, start: 0V, stop: 3.3V, num_steps: 100}
+
+The grid is scanned line by line along the last axis. The order of the lines determines how far the outputs
+have to jump between consecutive points, and therefore how long they need to settle:
+
+* ``raster``: every line goes from start to stop. The fast axis jumps back to the start after each line.
+* ``serpentine``: lines alternate direction, and so do the slower axes, therefore consecutive points differ
+  in a single step of a single output. This is the default.
+* ``bidirectional``: every line is scanned forward and then backward, to see hysteresis. The data has an
+  extra last dimension of size 2, the first element for the forward and the second for the backward sweep.
+"""
+import numpy as np
+
+from PFTL import ur
+from PFTL.model.scan_plan import ScanPlan
+
+ORDERS = ("raster", "serpentine", "bidirectional")
+
+
+class GridOrder:
+    """Order in which the points of a grid are measured. It only depends on the shape of the grid, therefore
+    it can be rebuilt anywhere from the config, for example to arrange data acquired in another process.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Number of steps of each axis
+    order : str
+        One of :data:`ORDERS`
+
+    Attributes
+    ----------
+    index : array of int
+        One row per point, in the order they are measured, with the position of the point in the dense data.
+        For bidirectional scans the last column is the direction
+    reversed : array of bool
+        For each line, whether it is scanned backward
+    dense_shape : tuple of int
+        The shape of the dense data
+    """
+
+    def __init__(self, shape, order="serpentine"):
+        if order not in ORDERS:
+            raise Exception(f"Unknown scan order {order}. Available: {', '.join(ORDERS)}")
+        self.shape = tuple(int(n) for n in shape)
+        self.order = order
+        line_length = self.shape[-1]
+        outer_shape = self.shape[:-1]
+        if not outer_shape:
+            lines = np.zeros((1, 0), dtype=int)
+        elif order == "raster":
+            lines = np.indices(outer_shape).reshape(len(outer_shape), -1).T
+        else:
+            lines = GridOrder(outer_shape, "serpentine").index
+
+        if order == "bidirectional":
+            lines = np.repeat(lines, 2, axis=0)
+            self.reversed = np.tile([False, True], len(lines) // 2)
+        elif order == "serpentine":
+            self.reversed = np.arange(len(lines)) % 2 == 1
+        else:
+            self.reversed = np.zeros(len(lines), dtype=bool)
+
+        steps = np.arange(line_length)
+        fast = np.where(self.reversed[:, None], steps[::-1], steps)
+        index = np.column_stack([np.repeat(lines, line_length, axis=0), fast.ravel()])
+        self.dense_shape = self.shape
+        if order == "bidirectional":
+            index = np.column_stack([index, np.repeat(self.reversed, line_length)])
+            self.dense_shape = self.shape + (2,)
+        self.index = index
+        self.line_length = line_length
+
+    @classmethod
+    def from_config(cls, scan_config):
+        """Builds the order from the Scan section of the config"""
+        shape = [int(axis["num_steps"]) for axis in scan_config["axes"]]
+        return cls(shape, scan_config.get("order", "serpentine"))
+
+    @property
+    def num_lines(self):
+        return len(self.reversed)
+
+    def to_dense(self, data, fill=np.nan):
+        """Arranges data measured in this order as a dense array. Points not measured yet are ``fill``
+
+        Parameters
+        ----------
+        data : array of float
+            The first points measured, in order
+
+        Returns
+        -------
+        array of float
+            Array of :attr:`dense_shape`
+        """
+        dense = np.full(self.dense_shape, fill, dtype=float)
+        dense[tuple(self.index[: len(data)].T)] = data
+        return dense
+
+    def __len__(self):
+        return len(self.index)
+
+
+class GridPlan:
+    """Precomputed setpoints of all the axes of a grid scan, see :class:`~PFTL.model.scan_plan.ScanPlan`
+
+    Parameters
+    ----------
+    daq : DAQBase
+        The DAQ that will perform the scan
+    scan_config : dict
+        The Scan section of the config, with the ``axes`` entry
+    resistance : float
+        The resistance used to convert the measured voltage to a current, in Ohms
+
+    Attributes
+    ----------
+    axes : list of ScanPlan
+        One plan per axis, the last one is the fast axis
+    channels : list of int
+        The output channel of each axis
+    order : GridOrder
+        The order of the points
+    """
+
+    def __init__(self, daq, scan_config, resistance):
+        channel_in = scan_config["channel_in"]
+        self.channels = [axis["channel_out"] for axis in scan_config["axes"]]
+        if len(set(self.channels)) != len(self.channels):
+            raise Exception("Each axis of a grid scan needs its own output channel")
+        self.axes = [
+            ScanPlan(
+                daq,
+                axis["channel_out"],
+                channel_in,
+                ur(axis["start"]).m_as("V"),
+                ur(axis["stop"]).m_as("V"),
+                int(axis["num_steps"]),
+                resistance,
+            )
+            for axis in scan_config["axes"]
+        ]
+        self.order = GridOrder([len(axis) for axis in self.axes], scan_config.get("order", "serpentine"))
+        self.input_current = self.axes[-1].input_current
+
+    def line(self, number):
+        """The points of a line
+
+        Returns
+        -------
+        first : int
+            Position of the first point of the line in the order of the scan
+        outer : array of int
+            Position of the line along each of the slower axes
+        steps : array of int
+            Positions along the fast axis, in the order they are measured
+        """
+        first = number * self.order.line_length
+        index = self.order.index[first : first + self.order.line_length]
+        return first, index[0, : len(self.axes) - 1], index[:, len(self.axes) - 1]
+
+    def fast_codes(self):
+        """The DAC code of the fast axis at every point, in the order of the scan"""
+        return self.axes[-1].codes[self.order.index[:, len(self.axes) - 1]]
+
+    def __len__(self):
+        return len(self.order)
@@ -0,0 +1,428 @@
+"""
+Job queue
+=========
+Scans can be queued to run one after the other, unattended, on a DAQ that is loaded only once. The queue is
+stored in an SQLite file, therefore jobs can be submitted from any process (the command line, the GUI, a
+script) while another one runs them, and nothing is lost if the program stops. Jobs that were running when
+the program stopped are run again when it restarts: every job records the computer and the process that
+claimed it, and it is put back in the queue only once that process is gone.
+
+Each job is a set of values that replace those of the Scan section of the config, such as
+``{"start": "0V", "stop": "2V", "num_steps": 200}``. Jobs with a higher priority run first, and jobs with
+the same priority run in the order they were submitted. The data of every job is saved with
+:meth:`~PFTL.model.experiment.Experiment.save_data` as soon as it finishes.
+
+From the command line::
+
+    $ py4lab queue submit stop=2V num_steps=200 --priority 1 --repeat 5
+    $ py4lab queue list
+    $ py4lab queue cancel 12
+    $ py4lab queue run Config/experiment.yml
+
+The GUI runs the queue when the config file has a ``Queue`` section::
+
+    Queue:
+      file: ~/.pftl/queue.sqlite
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import traceback
+from datetime import datetime
+from pathlib import Path
+from time import monotonic
+
+import yaml
+
+from PFTL.model.events import PointsAcquired
+
+#: Queue used if none is specified
+DEFAULT_QUEUE_FILE = "~/.pftl/queue.sqlite"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    scan TEXT NOT NULL,
+    submitted_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    data_file TEXT,
+    error TEXT,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_next ON jobs (status, priority DESC, id);
+"""
+
+
+def _process_exists(pid):
+    """Whether a process of this computer is still running"""
+    if os.name == "nt":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Persistent queue of scans
+
+    Parameters
+    ----------
+    path : str
+        The SQLite file where the queue is stored
+
+    Attributes
+    ----------
+    owner : str
+        Recorded with the jobs claimed, ``host:pid`` of this process
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_FILE):
+        path = Path(path).expanduser()
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+        if "owner" not in columns:  # Queues created before jobs had an owner
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+
+    def submit(self, scan, priority=0):
+        """Adds a job to the queue
+
+        Parameters
+        ----------
+        scan : dict
+            Values that replace those of the Scan section of the config
+        priority : int
+            Jobs with higher priority run first
+
+        Returns
+        -------
+        int
+            The id of the job
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (priority, status, scan, submitted_at) VALUES (?, ?, ?, ?)",
+                (priority, PENDING, json.dumps(scan), datetime.now().isoformat()),
+            )
+        return cursor.lastrowid
+
+    def cancel(self, job_id):
+        """Cancels a job. A running job is stopped by the runner shortly after
+
+        Returns
+        -------
+        bool
+            False if the job was already finished
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = ? WHERE id = ? AND status IN (?, ?)", (CANCELLED, job_id, PENDING, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def status(self, job_id):
+        """The status of a job"""
+        with self.lock:
+            row = self.connection.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def jobs(self, status=None):
+        """Lists the jobs, optionally only those with a given status, in the order they would run
+
+        Returns
+        -------
+        list of dict
+        """
+        sql = "SELECT * FROM jobs"
+        parameters = ()
+        if status is not None:
+            sql += " WHERE status = ?"
+            parameters = (status,)
+        sql += " ORDER BY status != 'running', status != 'pending', priority DESC, id"
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["scan"] = json.loads(job["scan"])
+            jobs.append(job)
+        return jobs
+
+    def claim(self):
+        """Takes the next pending job and marks it as running, by this process
+
+        Returns
+        -------
+        dict or None
+            The job, None if there are no pending jobs
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, id LIMIT 1", (PENDING,)
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, owner = ? WHERE id = ?",
+                        (RUNNING, datetime.now().isoformat(), self.owner, row["id"]),
+                    )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row, status=RUNNING, owner=self.owner)
+        job["scan"] = json.loads(job["scan"])
+        return job
+
+    def finish(self, job_id, status, data_file=None, error=None):
+        """Records the end of a job. A job cancelled while running keeps its cancelled status"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN status = ? THEN status ELSE ? END, finished_at = ?, "
+                "data_file = ?, error = ? WHERE id = ?",
+                (CANCELLED, status, datetime.now().isoformat(), data_file, error, job_id),
+            )
+
+    def requeue(self, job_id):
+        """Puts a job that was claimed back in the queue, without running it"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL WHERE id = ? AND status = ?",
+                (PENDING, job_id, RUNNING),
+            )
+
+    def recover(self):
+        """Puts back in the queue the jobs that were running in a process of this computer that ended, when
+        the program stopped. Jobs claimed by other computers are left alone, their processes can't be checked
+
+        Returns
+        -------
+        int
+            The number of jobs recovered
+        """
+        host = socket.gethostname()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute("SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+                orphans = []
+                for row in rows:
+                    owner_host, _, pid = (row["owner"] or "").rpartition(":")
+                    if row["owner"] is None or (owner_host == host and not _process_exists(int(pid))):
+                        orphans.append(row["id"])
+                self.connection.executemany(
+                    "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL WHERE id = ? AND status = ?",
+                    [(PENDING, job_id, RUNNING) for job_id in orphans],
+                )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return len(orphans)
+
+    def close(self):
+        self.connection.close()
+
+
+class QueueRunner:
+    """Runs the jobs of a queue, one after the other, on an experiment with the DAQ already loaded
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment, with the DAQ loaded
+    queue : JobQueue
+        The queue to run
+    poll_interval : float
+        Time between checks of the queue when it is empty, and of the cancellation of the running job, in
+        seconds
+    """
+
+    def __init__(self, experiment, queue, poll_interval=1):
+        self.experiment = experiment
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.current_job = None
+        self.thread = None
+        self.keep_running = False
+        self.wake_up = threading.Event()
+        self._last_check = 0
+
+    def start(self, wait=True):
+        """Runs the queue on a separate thread
+
+        Parameters
+        ----------
+        wait : bool
+            If True, keep waiting for new jobs when the queue is empty. If False, stop when it is empty
+        """
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"{recovered} interrupted jobs put back in the queue")
+        self.keep_running = True
+        self.experiment.subscribe(self._check_cancelled)
+        self.thread = threading.Thread(target=self.run, args=(wait,), daemon=True)
+        self.thread.start()
+
+    def submit(self, scan, priority=0):
+        """Submits a job and wakes up the runner if it was waiting"""
+        job_id = self.queue.submit(scan, priority)
+        self.wake_up.set()
+        return job_id
+
+    def run(self, wait=True):
+        """Runs jobs until the queue is empty (if ``wait`` is False) or :meth:`stop` is called"""
+        while self.keep_running:
+            if self.experiment.is_running:
+                # A scan started from the window has the DAQ, the jobs wait for it to finish
+                self.wake_up.wait(self.poll_interval)
+                self.wake_up.clear()
+                continue
+            job = self.queue.claim()
+            if job is None:
+                if not wait:
+                    break
+                self.wake_up.wait(self.poll_interval)
+                self.wake_up.clear()
+                continue
+            self.run_job(job)
+        self.keep_running = False
+
+    def run_job(self, job):
+        """Runs a single job and saves its data, unless the job was cancelled. The settings of the job are applied
+        on top of the current Scan section, which is restored afterwards"""
+        self.current_job = job
+        previous_scan = self.experiment.config["Scan"]
+        if self.experiment.is_running:
+            self.queue.requeue(job["id"])
+            self.current_job = None
+            return
+        print(f"Running job {job['id']}: {job['scan']}")
+        self.experiment.config["Scan"] = {**previous_scan, **job["scan"]}
+        try:
+            self.experiment.do_scan()
+            if not self.keep_running:
+                # Stopped by stop(), the job runs again on the next start
+                self.queue.requeue(job["id"])
+                return
+            if self.queue.status(job["id"]) == CANCELLED:
+                self.queue.finish(job["id"], CANCELLED)
+                return
+            data_file = self.experiment.save_data()
+            self.queue.finish(job["id"], DONE, data_file=str(data_file))
+        except Exception:
+            traceback.print_exc()
+            self.queue.finish(job["id"], FAILED, error=traceback.format_exc(limit=1))
+        finally:
+            self.current_job = None
+            self.experiment.config["Scan"] = previous_scan
+
+    def _check_cancelled(self, event):
+        """Stops the scan if its job was cancelled. Checked at most every ``poll_interval``"""
+        if not isinstance(event, PointsAcquired) or self.current_job is None:
+            return
+        if monotonic() - self._last_check < self.poll_interval:
+            return
+        self._last_check = monotonic()
+        if self.queue.status(self.current_job["id"]) == CANCELLED:
+            print(f"Job {self.current_job['id']} cancelled")
+            self.experiment.stop_scan()
+
+    def stop(self):
+        """Stops running jobs. The job currently running is stopped and will run again on the next start"""
+        self.keep_running = False
+        self.wake_up.set()
+        job = self.current_job
+        if job is not None:
+            self.experiment.stop_scan()
+        if self.thread is not None:
+            self.thread.join()
+        self.experiment.unsubscribe(self._check_cancelled)
+
+
+def _parse_values(values):
+    """Converts ``KEY=VALUE`` arguments to a dictionary, with numbers as numbers"""
+    scan = {}
+    for value in values:
+        key, value = value.split("=", 1)
+        scan[key] = yaml.safe_load(value)
+    return scan
+
+
+def main(args):
+    """Command line interface, see the module documentation"""
+    parser = argparse.ArgumentParser(prog="py4lab queue", description="Queue of scans")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_FILE, help="The queue file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="Add a scan to the queue")
+    submit.add_argument("values", nargs="*", metavar="KEY=VALUE", help="Values of the Scan section of the config")
+    submit.add_argument("--priority", type=int, default=0)
+    submit.add_argument("--repeat", type=int, default=1, help="Number of times to add the scan")
+    commands.add_parser("list", help="Show the jobs")
+    cancel = commands.add_parser("cancel", help="Cancel jobs")
+    cancel.add_argument("ids", nargs="+", type=int)
+    run = commands.add_parser("run", help="Run the queue without the GUI")
+    run.add_argument("config", help="The config file of the experiment")
+    run.add_argument("--wait", action="store_true", help="Keep waiting for new jobs when the queue is empty")
+    options = parser.parse_args(args)
+
+    queue = JobQueue(options.queue)
+    if options.command == "submit":
+        scan = _parse_values(options.values)
+        for _ in range(options.repeat):
+            print(f"Job {queue.submit(scan, options.priority)} submitted")
+    elif options.command == "list":
+        for job in queue.jobs():
+            print(f"{job['id']:5d}  {job['status']:9s}  priority {job['priority']:3d}  {job['scan']}  "
+                  f"{job['data_file'] or ''}")
+    elif options.command == "cancel":
+        for job_id in options.ids:
+            print(f"Job {job_id} {'cancelled' if queue.cancel(job_id) else 'already finished'}")
+    elif options.command == "run":
+        from PFTL.model.experiment import Experiment
+
+        experiment = Experiment(options.config)
+        experiment.load_config()
+        experiment.load_daq()
+        runner = QueueRunner(experiment, queue)
+        runner.start(wait=options.wait)
+        try:
+            while runner.thread.is_alive():
+                runner.thread.join(0.5)
+        except KeyboardInterrupt:
+            runner.stop()
+        experiment.finalize()
+    queue.close()
@@ -0,0 +1,232 @@
+"""
+Live fit
+========
+Fits the diode equation to the data while the scan is running, so it is possible to see the parameters of
+the diode, and to stop the scan, as soon as they are known well enough.
+
+The circuit is a diode in series with the resistor used to measure the current. Subtracting the voltage on
+the resistor, the voltage on the diode is, for currents much larger than the saturation current::
+
+    V_diode = n * Vt * ln(I) - n * Vt * ln(Is) + Rs * I
+
+where ``n`` is the ideality factor, ``Is`` the saturation current and ``Rs`` the series resistance of the
+diode. This is linear in ``n * Vt``, ``n * Vt * ln(Is)`` and ``Rs``, therefore it is solved with linear least
+squares. The sums needed for it are updated with every batch of new points, so each update costs the same
+regardless of how many points were already acquired.
+
+The fit runs on its own thread, fed by the :mod:`~PFTL.model.events` of the experiment, and publishes its
+results as :class:`~PFTL.model.events.FitUpdated` events. It is enabled with the ``Analysis`` section of the
+config file::
+
+    Analysis:
+      live_fit: true
+      min_current: 50uA  # Points below this current are not used
+      tolerance: 0.001  # Relative change of the parameters considered converged
+      stop_on_convergence: false
+"""
+import queue
+import threading
+import traceback
+
+import numpy as np
+
+from PFTL import THERMAL_VOLTAGE, ur
+from PFTL.model.events import FitUpdated, PointsAcquired, ScanStarted
+
+
+def diode_terms(voltages, currents, resistance, min_current):
+    """Builds the least squares problem of the diode equation, see the module documentation
+
+    Parameters
+    ----------
+    voltages : array of float
+        Voltages applied to the diode and the resistor, in Volts
+    currents : array of float
+        Currents measured, in Amperes
+    resistance : float
+        The resistor in series with the diode, in Ohms
+    min_current : float
+        Points with a smaller current are discarded, in Amperes
+
+    Returns
+    -------
+    design : array of float
+        Matrix with one row per point used, so that ``design @ [n * Vt, -n * Vt * ln(Is), Rs] = diode_voltages``
+    diode_voltages : array of float
+        Voltage on the diode for each point used, in Volts
+    """
+    valid = currents > min_current
+    currents = currents[valid]
+    diode_voltages = voltages[valid] - currents * resistance
+    design = np.column_stack([np.log(currents), np.ones(len(currents)), currents])
+    return design, diode_voltages
+
+
+def fit_diode(voltages, currents, resistance, min_current=50e-6):
+    """Fits the diode equation to a complete scan at once. See :func:`diode_terms` for the parameters.
+
+    Returns
+    -------
+    dict
+        ``ideality``, ``saturation_current`` (A), ``series_resistance`` (Ohm) and ``num_points`` used. The
+        parameters are NaN if there are not enough points.
+    """
+    design, diode_voltages = diode_terms(voltages, currents, resistance, min_current)
+    result = {"ideality": np.nan, "saturation_current": np.nan, "series_resistance": np.nan,
+              "num_points": len(diode_voltages)}
+    if len(diode_voltages) < 3:
+        return result
+    n_vt, offset, series_resistance = np.linalg.lstsq(design, diode_voltages, rcond=None)[0]
+    if n_vt > 0:
+        result.update(
+            ideality=n_vt / THERMAL_VOLTAGE,
+            saturation_current=np.exp(-offset / n_vt),
+            series_resistance=series_resistance,
+        )
+    return result
+
+
+class LiveFit:
+    """Incremental fit of the diode equation to the data of an experiment
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment to follow
+    min_current : Quantity or str
+        Points with a smaller current are not used for the fit
+    tolerance : float
+        The fit is converged when no parameter changes more than this (relative) between updates
+    patience : int
+        Number of consecutive updates within the tolerance needed to consider the fit converged
+    min_points : int
+        Minimum number of points used before giving any result
+    stop_on_convergence : bool
+        If True, the scan is stopped as soon as the fit converges
+    curve_points : int
+        Number of points of the fitted curve included in the results
+
+    Attributes
+    ----------
+    last_result : FitUpdated
+        The latest result, None if there is none yet
+    """
+
+    def __init__(self, experiment, min_current="50uA", tolerance=1e-3, patience=3, min_points=5,
+                 stop_on_convergence=False, curve_points=200):
+        self.experiment = experiment
+        self.min_current = ur(min_current).m_as("A") if isinstance(min_current, str) else min_current
+        self.tolerance = tolerance
+        self.patience = patience
+        self.min_points = min_points
+        self.stop_on_convergence = stop_on_convergence
+        self.curve_points = curve_points
+
+        self.last_result = None
+        self.reset()
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.experiment.subscribe(self._on_event)
+
+    def reset(self):
+        """Forgets all the data, to start fitting a new scan"""
+        self.resistance = ur(self.experiment.config["DAQ"]["resistance"]).m_as("ohm")
+        self.normal_matrix = np.zeros((3, 3))
+        self.normal_vector = np.zeros(3)
+        self.num_points = 0
+        self.current_range = (np.inf, 0)
+        self.coefficients = None
+        self.stable_updates = 0
+        self.last_result = None
+
+    def _on_event(self, event):
+        if isinstance(event, (ScanStarted, PointsAcquired)):
+            self.queue.put(event)
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            try:
+                if isinstance(event, ScanStarted):
+                    self.reset()
+                    continue
+                # Batches that arrived while fitting are used at once, the fit never lags behind
+                stop = event.stop
+                start = event.start
+                while not self.queue.empty():
+                    next_event = self.queue.queue[0]
+                    if not isinstance(next_event, PointsAcquired) or next_event.start != stop:
+                        break
+                    stop = self.queue.get().stop
+                self.add_points(
+                    self.experiment.scan_range[start:stop].m_as("V"),
+                    self.experiment.scan_data[start:stop].m_as("A"),
+                )
+                self.update()
+            except Exception:
+                traceback.print_exc()
+
+    def add_points(self, voltages, currents):
+        """Adds points to the sums of the least squares problem
+
+        Parameters
+        ----------
+        voltages : array of float
+            Voltages applied to the diode and the resistor, in Volts
+        currents : array of float
+            Currents measured, in Amperes
+        """
+        design, diode_voltages = diode_terms(voltages, currents, self.resistance, self.min_current)
+        if not len(diode_voltages):
+            return
+        currents = design[:, 2]
+        self.normal_matrix += design.T @ design
+        self.normal_vector += design.T @ diode_voltages
+        self.num_points += len(currents)
+        self.current_range = (
+            min(self.current_range[0], currents.min()),
+            max(self.current_range[1], currents.max()),
+        )
+
+    def update(self):
+        """Solves the fit with the points added so far and publishes the result"""
+        if self.num_points < self.min_points:
+            return
+        coefficients = np.linalg.lstsq(self.normal_matrix, self.normal_vector, rcond=None)[0]
+        n_vt, offset, series_resistance = coefficients
+        if n_vt <= 0:
+            return
+        # The series resistance of the diode can be close to zero, its change is compared to the total
+        # resistance of the circuit instead
+        parameters = np.array([n_vt, offset, series_resistance + self.resistance])
+        if self.coefficients is not None:
+            change = np.abs(parameters - self.coefficients) / np.abs(self.coefficients)
+            self.stable_updates = self.stable_updates + 1 if np.all(change < self.tolerance) else 0
+        self.coefficients = parameters
+        converged = self.stable_updates >= self.patience
+
+        currents = np.geomspace(*self.current_range, self.curve_points)
+        voltages = n_vt * np.log(currents) + offset + (series_resistance + self.resistance) * currents
+        self.last_result = FitUpdated(
+            ideality=n_vt / THERMAL_VOLTAGE,
+            saturation_current=np.exp(-offset / n_vt) * ur("A"),
+            series_resistance=series_resistance * ur("ohm"),
+            num_points=self.num_points,
+            converged=converged,
+            voltages=ur.Quantity(voltages, "V"),
+            currents=ur.Quantity(currents, "A"),
+        )
+        self.experiment.publish(self.last_result)
+        if converged and self.stop_on_convergence and self.experiment.is_running:
+            print("Live fit converged, stopping the scan")
+            self.experiment.stop_scan()
+
+    def close(self):
+        """Stops following the experiment and ends the thread"""
+        self.experiment.unsubscribe(self._on_event)
+        self.queue.put(None)
+        self.thread.join()
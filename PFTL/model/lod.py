@@ -0,0 +1,271 @@
+"""
+Levels of detail
+================
+Scans and recordings can have far more points than pixels on the screen, and far more than fit in memory.
+To browse them, a pyramid of levels of detail is built the first time a file is opened: every level keeps
+the minimum and the maximum of the current over blocks of :data:`FACTOR` points of the level below. Plotting
+the minimum and maximum of every block shows the same envelope as plotting all the points, including
+spikes.
+
+The pyramid is stored in a folder next to the file, with the same name and the ``.lod`` extension, and it is
+built again only if the file changes. Levels are read with memory maps: only the points of the range being
+displayed are loaded, at the finest level that gives about as many points as pixels, so every update takes
+about the same time regardless of the zoom or the size of the file.
+
+The files that can be opened are:
+
+* ``.dat`` files saved by :meth:`~PFTL.model.experiment.Experiment.save_data`.
+* ``.npz`` files of raw scans, see :mod:`~PFTL.model.raw_data`. Their arrays are mapped as well, see
+  :func:`map_npz`.
+* ``.npy`` files with the currents in Amperes, or two columns with the voltages in Volts and the currents. They
+  are mapped directly, without copying them into the pyramid.
+"""
+import json
+import struct
+import zipfile
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from PFTL.model.batch_analysis import parse_data
+
+#: Points of each level summarized by one block of the next level
+FACTOR = 4
+#: The pyramid ends at the first level with at most this number of blocks
+TOP_SIZE = 2048
+#: Points processed at once while building the pyramid
+CHUNK_SIZE = 2**22
+
+
+def map_npz(path):
+    """Memory maps the arrays of a ``.npz`` file, as :func:`numpy.load` does with ``.npy`` files. The files
+    written by :func:`numpy.savez` are not compressed: every array is stored as is, after its header. Arrays
+    that are compressed, and scalars, are loaded
+
+    Returns
+    -------
+    dict
+        The arrays, by name
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename.removesuffix(".npy")
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # The local header of the member has 30 bytes, followed by its name and an extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(name_length + extra_length, 1)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if not shape or dtype.hasobject:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+            else:
+                arrays[name] = np.memmap(
+                    path, dtype=dtype, mode="r", shape=shape, order="F" if fortran_order else "C", offset=f.tell()
+                )
+    return arrays
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Reads a saved scan a few points at a time, so files larger than the memory can be processed
+
+    Parameters
+    ----------
+    path : Path
+        A ``.dat`` file or the ``.npz`` file of a raw scan
+    chunk_size : int
+        Number of points of every chunk
+
+    Yields
+    ------
+    voltages : array of float
+        In Volts
+    currents : array of float
+        In Amperes
+    """
+    path = Path(path)
+    if path.suffix == ".npz":
+        data = map_npz(path)
+        if "input_codes" not in data:
+            raise Exception(f"{path} is not a raw scan")
+        output_codes, input_codes = data["output_codes"], data["input_codes"]
+        output_volts, input_volts = np.asarray(data["output_volts"]), np.asarray(data["input_volts"])
+        resistance = float(data["resistance"])
+        average = data.get("average")  # Repeated scans store their average
+        for start in range(0, len(input_codes), chunk_size):
+            if average is None:
+                currents = input_volts[input_codes[start : start + chunk_size]] / resistance
+            else:
+                currents = average[start : start + chunk_size]
+            yield output_volts[output_codes[start : start + chunk_size]], currents
+    else:
+        with open(path, "r") as f:
+            lines = (line for line in f if line.strip() and not line.startswith("#"))
+            while True:
+                block = list(islice(lines, chunk_size))
+                if not block:
+                    return
+                yield parse_data("".join(block))
+
+
+def reduce_blocks(minimum, maximum, factor=FACTOR):
+    """Minimum and maximum of every block of ``factor`` points. The last block can be shorter. NaNs are
+    ignored"""
+    starts = np.arange(0, len(minimum), factor)
+    return np.fmin.reduceat(minimum, starts), np.fmax.reduceat(maximum, starts)
+
+
+class LodPyramid:
+    """Min/max pyramid of the currents of a saved scan
+
+    Parameters
+    ----------
+    path : Path
+        The file of the scan
+    rebuild : bool
+        Builds the pyramid even if there is an up-to-date one
+
+    Attributes
+    ----------
+    num_points : int
+        Number of points of the scan
+    voltages : array of float
+        Memory map of the voltages, in Volts. None for ``.npy`` files with only currents
+    currents : array of float
+        Memory map of the currents, in Amperes
+    levels : list of array
+        Memory maps of the levels, ``levels[k]`` has the minimum and the maximum of blocks of ``FACTOR**(k+1)``
+        points
+    """
+
+    def __init__(self, path, rebuild=False):
+        self.path = Path(path).expanduser()
+        self.folder = self.path.with_suffix(".lod")
+        info = self._read_info()
+        if rebuild or info is None or info["source"] != self._source_stamp():
+            info = self.build()
+        self.num_points = info["num_points"]
+        self.factor = info["factor"]
+        self.voltages, self.currents = self._map_data()
+        self.levels = [
+            np.memmap(self.folder / f"level_{k}.bin", dtype=np.float64, mode="r", shape=(size, 2))
+            for k, size in enumerate(info["levels"], start=1)
+        ]
+
+    def _source_stamp(self):
+        stat = self.path.stat()
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    def _read_info(self):
+        info_file = self.folder / "info.json"
+        if not info_file.exists():
+            return None
+        return json.loads(info_file.read_text())
+
+    def _map_data(self):
+        if self.path.suffix == ".npy":
+            data = np.load(self.path, mmap_mode="r")
+            if data.ndim == 1:
+                return None, data
+            return data[:, 0], data[:, 1]
+        return tuple(
+            np.memmap(self.folder / f"{name}.bin", dtype=np.float64, mode="r", shape=(self.num_points,))
+            for name in ("voltages", "currents")
+        )
+
+    def build(self):
+        """Builds the pyramid, level by level, without loading the whole scan in memory
+
+        Returns
+        -------
+        dict
+            The information stored with the pyramid
+        """
+        self.folder.mkdir(exist_ok=True)
+        (self.folder / "info.json").unlink(missing_ok=True)  # Marks the pyramid as incomplete
+
+        if self.path.suffix == ".npy":
+            _, currents = self._map_data()
+            num_points = len(currents)
+        else:
+            num_points = 0
+            with open(self.folder / "voltages.bin", "wb") as v, open(self.folder / "currents.bin", "wb") as c:
+                for voltages, currents in read_chunks(self.path):
+                    v.write(np.ascontiguousarray(voltages, dtype=np.float64).tobytes())
+                    c.write(np.ascontiguousarray(currents, dtype=np.float64).tobytes())
+                    num_points += len(currents)
+            if num_points:
+                currents = np.memmap(self.folder / "currents.bin", dtype=np.float64, mode="r", shape=(num_points,))
+        if not num_points:
+            raise Exception(f"{self.path} has no points")
+
+        sizes = []
+        below = currents
+        while len(below) > TOP_SIZE:
+            k = len(sizes) + 1
+            step = CHUNK_SIZE - CHUNK_SIZE % FACTOR
+            with open(self.folder / f"level_{k}.bin", "wb") as f:
+                for start in range(0, len(below), step):
+                    chunk = np.asarray(below[start : start + step])
+                    if chunk.ndim == 1:
+                        minimum, maximum = reduce_blocks(chunk, chunk)
+                    else:
+                        minimum, maximum = reduce_blocks(chunk[:, 0], chunk[:, 1])
+                    f.write(np.column_stack([minimum, maximum]).tobytes())
+            sizes.append(-(-len(below) // FACTOR))
+            below = np.memmap(self.folder / f"level_{k}.bin", dtype=np.float64, mode="r", shape=(sizes[-1], 2))
+
+        info = {"source": self._source_stamp(), "num_points": num_points, "factor": FACTOR, "levels": sizes}
+        (self.folder / "info.json").write_text(json.dumps(info))
+        return info
+
+    def view(self, start, stop, max_points=4000):
+        """The points to plot between ``start`` and ``stop``
+
+        Parameters
+        ----------
+        start, stop : float
+            The range of point numbers displayed
+        max_points : int
+            Largest number of points returned, about twice the width of the plot in pixels
+
+        Returns
+        -------
+        x : array of float
+            Point numbers
+        y : array of float
+            Currents, in Amperes. Above level 0 they alternate the minimum and the maximum of every block
+        level : int
+            The level used, 0 for the points of the scan
+        """
+        start = max(0, int(np.floor(start)))
+        stop = min(self.num_points, int(np.ceil(stop)) + 1)
+        if stop <= start:
+            return np.zeros(0), np.zeros(0), 0
+        level = 0
+        # Every block gives two points, its minimum and its maximum
+        while level < len(self.levels) and (stop - start) / self.factor**level * (2 if level else 1) > max_points:
+            level += 1
+        if level == 0:
+            return np.arange(start, stop, dtype=float), np.array(self.currents[start:stop]), 0
+
+        size = self.factor**level
+        first, last = start // size, -(-stop // size)
+        blocks = np.array(self.levels[level - 1][first:last])
+        x = np.repeat(np.arange(first, last, dtype=float) * size + size / 2, 2)
+        return x, blocks.ravel(), level
+
+    def voltage(self, index):
+        """The voltage of a point, in Volts. NaN if the file has no voltages"""
+        if self.voltages is None or not 0 <= index < self.num_points:
+            return np.nan
+        return float(self.voltages[index])
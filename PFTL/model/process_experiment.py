@@ -0,0 +1,365 @@
+"""
+Experiment in a separate process
+================================
+When the scan runs on a thread, it shares the Global Interpreter Lock with the user interface. Updating the
+plots or converting units in the GUI delays the acquisition, adding jitter to its timing.
+
+:class:`ProcessExperiment` has the same interface as :class:`~PFTL.model.experiment.Experiment`, but the
+DAQ lives in a separate process, which runs the scans. The data is written to shared memory, and the
+attributes read by the GUI (``scan_range``, ``scan_data``, ``settling_time``, ``is_running``,
+``current_scan_index``, etc.) are views of that memory, without any copy. The processes only exchange small
+messages to start a scan or to quit, an event to stop a scan and the :mod:`~PFTL.model.events` of the
+worker, which are published again in the main process.
+
+It is enabled with the ``separate_process`` option of the Scan section of the config file::
+
+    Scan:
+      separate_process: true
+"""
+import multiprocessing
+import threading
+import traceback
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from PFTL import ur
+from PFTL.model.events import AverageUpdated, ScanError, ScanFinished
+from PFTL.model.experiment import Experiment
+from PFTL.model.grid_scan import GridOrder
+
+
+class _SharedBuffer(np.ndarray):
+    """Array on a block of shared memory. It keeps a reference to the block, which therefore stays mapped as
+    long as any view of the array exists"""
+
+
+class SharedScan:
+    """Block of shared memory that holds the status and the data of a scan
+
+    Parameters
+    ----------
+    num_points : int
+        The maximum number of points of the scan
+    name : str
+        The name of an existing block. If None, a new one is created
+
+    Attributes
+    ----------
+    status : array of float
+        Whether the scan is running, the current index and the number of points
+    scan_range : array of float
+        The output voltages, in Volts
+    scan_data : array of float
+        The measured currents, in Amperes
+    settling_time : array of float
+        The time every point needed to settle, in seconds
+    """
+
+    RUNNING, INDEX, LENGTH = range(3)
+    HEADER = 3
+
+    def __init__(self, num_points, name=None):
+        size = (self.HEADER + 3 * num_points) * np.dtype(float).itemsize
+        if name is None:
+            self.shared_memory = SharedMemory(create=True, size=size)
+        else:
+            self.shared_memory = SharedMemory(name=name)
+        self.num_points = num_points
+        buffer = np.ndarray((self.HEADER + 3 * num_points,), dtype=float, buffer=self.shared_memory.buf)
+        # Closing unmaps the memory, it can only be done once every view of the buffer is gone
+        weakref.finalize(buffer, self.shared_memory.close)
+        buffer = buffer.view(_SharedBuffer)
+        buffer.shared_memory = self.shared_memory
+        if name is None:
+            buffer[:] = 0
+        self.status = buffer[: self.HEADER]
+        self.scan_range = buffer[self.HEADER : self.HEADER + num_points]
+        self.scan_data = buffer[self.HEADER + num_points : self.HEADER + 2 * num_points]
+        self.settling_time = buffer[self.HEADER + 2 * num_points :]
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def release(self, unlink=False):
+        """Releases the block. Its handle is closed as soon as no array refers to it anymore (right away if there
+        are none), so data already handed out remains valid. Only the process that created the block should
+        unlink it.
+        """
+        shared_memory = self.shared_memory
+        del self.status, self.scan_range, self.scan_data, self.settling_time, self.shared_memory
+        if unlink:
+            shared_memory.unlink()
+
+
+class _WorkerExperiment(Experiment):
+    """Experiment running in the worker process. It mirrors its status and data into a :class:`SharedScan`"""
+
+    def __init__(self, config, stop_event):
+        self.shared = None
+        self.stop_event = stop_event
+        super().__init__(None)
+        self.config = config
+
+    def setup_analysis(self):
+        # The analysis, the processing and the telemetry run in the main process, with the events forwarded by
+        # the worker
+        pass
+
+    def setup_processing(self):
+        pass
+
+    def setup_telemetry(self):
+        pass
+
+    def _set_status(self, index, value):
+        if self.shared is not None:
+            self.shared.status[index] = value
+
+    @property
+    def is_running(self):
+        return self._is_running
+
+    @is_running.setter
+    def is_running(self, value):
+        self._is_running = value
+        self._set_status(SharedScan.RUNNING, value)
+
+    @property
+    def current_scan_index(self):
+        return self._current_scan_index
+
+    @current_scan_index.setter
+    def current_scan_index(self, value):
+        self._current_scan_index = value
+        self._set_status(SharedScan.INDEX, value)
+
+    def allocate_scan(self, num_points):
+        self.shared.status[SharedScan.LENGTH] = num_points
+        self.scan_range = ur.Quantity(self.shared.scan_range[:num_points], "V")
+        self.scan_data = ur.Quantity(self.shared.scan_data[:num_points], "A")
+        self.settling_time = ur.Quantity(self.shared.settling_time[:num_points], "s")
+
+    @property
+    def keep_running(self):
+        return not self.stop_event.is_set()
+
+    @keep_running.setter
+    def keep_running(self, value):
+        # The event is cleared only by the main process, before requesting a scan, so a stop requested
+        # before the scan actually starts is not lost
+        if not value:
+            self.stop_event.set()
+
+
+def _worker(config, connection, stop_event):
+    """Loop of the worker process: loads the DAQ and runs the scans requested through the connection"""
+    experiment = _WorkerExperiment(config, stop_event)
+    experiment.subscribe(lambda event: connection.send(("event", event)))
+    try:
+        experiment.load_daq()
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+        return
+    connection.send(("ready", (str(experiment.daq), experiment.idn)))
+
+    while True:
+        message = connection.recv()
+        if message[0] == "quit":
+            break
+        _, name, num_points, scan_config = message
+        experiment.config["Scan"].update(scan_config)
+        experiment.shared = SharedScan(num_points, name)
+        try:
+            experiment.do_scan()
+        except Exception:
+            traceback.print_exc()
+        experiment.shared.release()
+        experiment.shared = None
+    experiment.daq.finalize()
+
+
+class ProcessExperiment(Experiment):
+    """Experiment that performs the scans in a separate process. See the module documentation.
+
+    Parameters
+    ----------
+    config_file : str
+        Path to the config file, see :class:`~PFTL.model.experiment.Experiment`
+    """
+
+    def __init__(self, config_file):
+        self.shared = None
+        super().__init__(config_file)
+        self.process = None
+        self.connection = None
+        self.stop_event = None
+        self.listener = None
+
+    def load_daq(self):
+        """Starts the worker process, which loads and initializes the DAQ"""
+        context = multiprocessing.get_context("spawn")
+        self.connection, worker_connection = context.Pipe()
+        self.stop_event = context.Event()
+        self.process = context.Process(
+            target=_worker, args=(self.config, worker_connection, self.stop_event), daemon=True
+        )
+        self.process.start()
+        # Only the worker keeps its end open, so the connection is closed if it dies
+        worker_connection.close()
+        while not self.connection.poll(0.1):
+            if not self.process.is_alive():
+                break
+        try:
+            status, info = self.connection.recv()
+        except (EOFError, OSError):
+            self.process.join()
+            raise Exception(f"The worker process ended before loading the DAQ, exit code {self.process.exitcode}")
+        if status == "error":
+            self.process.join()
+            raise Exception(f"The DAQ could not be loaded in the worker process:\n{info}")
+        name, self.idn = info
+        print(f"Worker process {self.process.pid} using {name}")
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+        self.setup_analysis()
+        self.setup_processing()
+        self.setup_telemetry()
+
+    def _listen(self):
+        """Publishes, in this process, the events of the worker process. It runs until the worker ends"""
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                self._worker_ended()
+                break
+            if message[0] == "event":
+                event = message[1]
+                if isinstance(event, ScanFinished):
+                    self.idle.set()
+                elif isinstance(event, AverageUpdated):
+                    self.last_average = event
+                self.publish(event)
+
+    def _worker_ended(self):
+        """Ends the scan the worker was doing when it ended, so the experiment doesn't stay running forever"""
+        if not self.is_running:
+            return
+        self.process.join(1)  # The connection closes as the process exits, it takes a moment to get its exit code
+        self.shared.status[SharedScan.RUNNING] = 0
+        self.idle.set()
+        self.publish(ScanError(f"The worker process ended during the scan, exit code {self.process.exitcode}"))
+        self.publish(ScanFinished(self.current_scan_index))
+
+    def calibrate(self, force=False):
+        raise Exception("The calibration is loaded by the worker process, when the DAQ is loaded")
+
+    def iter_stream(self, chunk_size, channel_in=None, max_chunks=None):
+        raise Exception("Streaming needs the DAQ in this process, disable separate_process to use it")
+
+    def start_scan(self):
+        """Starts a scan in the worker process. It returns immediately"""
+        if self.is_running:
+            raise Exception("Scan already running")
+        if not self.process.is_alive():
+            raise Exception(f"The worker process ended, exit code {self.process.exitcode}")
+        if self.is_grid_scan:
+            num_points = len(GridOrder.from_config(self.config["Scan"]))
+        else:
+            num_points = int(self.config["Scan"]["num_steps"])
+        if self.shared is not None:
+            self.shared.release(unlink=True)
+        self.shared = SharedScan(num_points)
+        self.shared.status[SharedScan.RUNNING] = 1
+        self.last_average = None
+        self.stop_event.clear()
+        self.idle.clear()
+        self.connection.send(("scan", self.shared.name, num_points, dict(self.config["Scan"])))
+
+    def do_scan(self):
+        """Does a scan, blocking until it finishes"""
+        self.start_scan()
+        self.idle.wait()
+        if not self.process.is_alive():
+            raise Exception(f"The worker process ended during the scan, exit code {self.process.exitcode}")
+
+    def stop_scan(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    def _status(self, index, default=0):
+        if self.shared is None:
+            return default
+        return self.shared.status[index]
+
+    @property
+    def is_running(self):
+        return bool(self._status(SharedScan.RUNNING))
+
+    @is_running.setter
+    def is_running(self, value):
+        pass
+
+    @property
+    def current_scan_index(self):
+        return int(self._status(SharedScan.INDEX))
+
+    @current_scan_index.setter
+    def current_scan_index(self, value):
+        pass
+
+    @property
+    def scan_range(self):
+        if self.shared is None:
+            return ur.Quantity(np.zeros(1), "V")
+        return ur.Quantity(self.shared.scan_range[: int(self.shared.status[SharedScan.LENGTH])], "V")
+
+    @scan_range.setter
+    def scan_range(self, value):
+        pass
+
+    @property
+    def scan_data(self):
+        if self.shared is None:
+            return ur.Quantity(np.zeros(1), "A")
+        return ur.Quantity(self.shared.scan_data[: int(self.shared.status[SharedScan.LENGTH])], "A")
+
+    @scan_data.setter
+    def scan_data(self, value):
+        pass
+
+    @property
+    def settling_time(self):
+        if self.shared is None:
+            return ur.Quantity(np.zeros(1), "s")
+        return ur.Quantity(self.shared.settling_time[: int(self.shared.status[SharedScan.LENGTH])], "s")
+
+    @settling_time.setter
+    def settling_time(self, value):
+        pass
+
+    def finalize(self):
+        """Stops the scan, ends the worker process (which finalizes the DAQ) and releases the shared memory"""
+        print("Finalizing Experiment")
+        self.stop_scan()
+        if self.process is not None:
+            # A worker that died can't finish its scan
+            while self.process.is_alive() and not self.idle.wait(0.1):
+                pass
+            if self.process.is_alive():
+                self.connection.send(("quit",))
+            self.process.join()
+            if self.listener is not None:
+                self.listener.join()
+        if self.live_fit is not None:
+            self.live_fit.close()
+        if self.processing is not None:
+            self.processing.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.shared is not None:
+            self.shared.release(unlink=True)
+            self.shared = None
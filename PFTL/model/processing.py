@@ -0,0 +1,348 @@
+"""
+Processing
+==========
+Filters and reductions applied to the data while it is acquired, instead of offline. The data goes through a
+:class:`Pipeline` of stages in blocks, every time new points are available (see :mod:`~PFTL.model.events`).
+Each stage works on whole blocks with numpy and keeps what it needs from previous blocks (the state of a
+filter, the last points of a window, the points left over by a decimation), therefore processing the data in
+blocks gives the same result as processing it all at once.
+
+Stages receive the voltages and the currents of a block, and return the processed ones:
+
+* ``moving_average``: average of the last ``length`` points.
+* ``fir``: filter with the given ``taps``.
+* ``iir``: filter with coefficients ``b`` and ``a``, with the same convention as ``scipy.signal.lfilter``.
+* ``decimate``: average of every ``factor`` points, which reduces the data to store and to plot.
+* ``derivative``: the derivative dI/dV, in A/V.
+
+The pipeline is defined in the ``Processing`` section of the config, with the stages in order::
+
+    Processing:
+      - stage: moving_average
+        length: 5
+      - stage: decimate
+        factor: 4
+
+The result is kept in :class:`LiveProcessing`, plotted on top of the data and saved next to it, see
+:meth:`~PFTL.model.experiment.Experiment.save_data`.
+"""
+import numpy as np
+
+from PFTL import ur
+from PFTL.model.events import PointsAcquired, ScanStarted
+
+#: Points of each sub-block of the IIR filter. Larger blocks do more work per point but fewer numpy calls
+IIR_BLOCK = 64
+
+
+class Stage:
+    """Base class of the stages. ``process`` gets the voltages and the currents of a block and returns the
+    processed ones, which may have a different length. ``reset`` forgets the previous blocks"""
+
+    def units(self, units):
+        """Units of the output, given the units of the input"""
+        return units
+
+    def reset(self):
+        pass
+
+    def process(self, voltages, values):
+        raise NotImplementedError()
+
+
+class MovingAverage(Stage):
+    """Average of the last ``length`` points. The first points average the points available
+
+    Parameters
+    ----------
+    length : int
+        Number of points averaged
+    """
+
+    def __init__(self, length):
+        self.length = int(length)
+        if self.length < 1:
+            raise Exception(f"The length of the moving average must be at least 1, not {length}")
+        self.reset()
+
+    def reset(self):
+        self.previous = np.zeros(0)
+
+    def process(self, voltages, values):
+        data = np.concatenate([self.previous, values])
+        sums = np.concatenate([[0], np.cumsum(data)])
+        ends = np.arange(len(self.previous) + 1, len(data) + 1)
+        starts = np.maximum(ends - self.length, 0)
+        self.previous = data[max(len(data) - self.length + 1, 0) :] if self.length > 1 else data[:0]
+        return voltages, (sums[ends] - sums[starts]) / (ends - starts)
+
+
+class FIRFilter(Stage):
+    """Finite impulse response filter, ``y[n] = sum(taps[k] * x[n - k])``, starting from zeros
+
+    Parameters
+    ----------
+    taps : list of float
+        The coefficients of the filter
+    """
+
+    def __init__(self, taps):
+        self.taps = np.asarray(taps, dtype=float)
+        self.reset()
+
+    def reset(self):
+        self.previous = np.zeros(len(self.taps) - 1)
+
+    def process(self, voltages, values):
+        if not len(values):
+            # With fewer points than taps, np.convolve would swap its arguments
+            return voltages, np.zeros(0)
+        data = np.concatenate([self.previous, values])
+        self.previous = data[len(data) - len(self.taps) + 1 :]
+        return voltages, np.convolve(data, self.taps, mode="valid")
+
+
+class IIRFilter(Stage):
+    """Infinite impulse response filter, ``a[0] * y[n] = sum(b[k] * x[n - k]) - sum(a[k] * y[n - k])``
+
+    The recursion is not done point by point. The filter is written in state space (the transposed direct
+    form II), and the response to blocks of :data:`IIR_BLOCK` points is computed with matrix products; only the
+    state is carried from one sub-block to the next.
+
+    Parameters
+    ----------
+    b : list of float
+        Coefficients of the input
+    a : list of float
+        Coefficients of the output, ``a[0]`` can't be 0
+    """
+
+    def __init__(self, b, a):
+        b, a = np.asarray(b, dtype=float), np.asarray(a, dtype=float)
+        if a[0] == 0:
+            raise Exception("The first coefficient of a can't be 0")
+        order = max(len(a), len(b)) - 1
+        b = np.pad(b, (0, order + 1 - len(b))) / a[0]
+        a = np.pad(a, (0, order + 1 - len(a))) / a[0]
+        self.order = order
+        self.direct = b[0]
+        self.reset()
+        if not order:
+            return
+
+        # z[n + 1] = A z[n] + B x[n], y[n] = z[n][0] + b[0] x[n]
+        state = np.eye(order, k=1)
+        state[:, 0] -= a[1:]
+        gain = b[1:] - a[1:] * b[0]
+
+        powers = [np.eye(order)]
+        for _ in range(IIR_BLOCK):
+            powers.append(state @ powers[-1])
+        self.powers = np.array(powers)
+        self.block_state = powers[IIR_BLOCK]
+        # Output of every point of a sub-block for the state at its start
+        self.from_state = np.array([power[0] for power in powers[:IIR_BLOCK]]).reshape(IIR_BLOCK, order)
+        # Contribution of every input of a sub-block to the state at its end
+        self.to_state = np.array([powers[IIR_BLOCK - 1 - j] @ gain for j in range(IIR_BLOCK)]).reshape(
+            IIR_BLOCK, order).T
+        # Impulse response, for the output of every point of a sub-block from its inputs
+        response = np.concatenate([[b[0]], [power[0] @ gain for power in powers[: IIR_BLOCK - 1]]])
+        indices = np.arange(IIR_BLOCK)[:, None] - np.arange(IIR_BLOCK)
+        self.from_inputs = np.where(indices >= 0, response[np.clip(indices, 0, None)], 0)
+
+    def reset(self):
+        self.state = np.zeros(self.order)
+
+    def process(self, voltages, values):
+        values = np.asarray(values, dtype=float)
+        if not self.order:
+            return voltages, values * self.direct
+        num_blocks, rest = divmod(len(values), IIR_BLOCK)
+        blocks = values[: num_blocks * IIR_BLOCK].reshape(num_blocks, IIR_BLOCK)
+        output = np.empty(len(values))
+
+        states = np.empty((num_blocks, self.order))
+        state_inputs = blocks @ self.to_state.T
+        for k in range(num_blocks):
+            states[k] = self.state
+            self.state = self.block_state @ self.state + state_inputs[k]
+        output[: num_blocks * IIR_BLOCK] = (blocks @ self.from_inputs.T + states @ self.from_state.T).ravel()
+
+        if rest:
+            tail = values[num_blocks * IIR_BLOCK :]
+            output[num_blocks * IIR_BLOCK :] = (
+                self.from_inputs[:rest, :rest] @ tail + self.from_state[:rest] @ self.state
+            )
+            self.state = self.powers[rest] @ self.state + self.to_state[:, IIR_BLOCK - rest :] @ tail
+        return voltages, output
+
+
+class Decimate(Stage):
+    """Averages every ``factor`` points into one. The points that don't complete a group wait for the next block
+
+    Parameters
+    ----------
+    factor : int
+        Number of points averaged into each output point
+    """
+
+    def __init__(self, factor):
+        self.factor = int(factor)
+        if self.factor < 1:
+            raise Exception(f"The factor of the decimation must be at least 1, not {factor}")
+        self.reset()
+
+    def reset(self):
+        self.previous = (np.zeros(0), np.zeros(0))
+
+    def process(self, voltages, values):
+        voltages = np.concatenate([self.previous[0], voltages])
+        values = np.concatenate([self.previous[1], values])
+        used = len(values) - len(values) % self.factor
+        self.previous = (voltages[used:], values[used:])
+        return (
+            voltages[:used].reshape(-1, self.factor).mean(axis=1),
+            values[:used].reshape(-1, self.factor).mean(axis=1),
+        )
+
+
+class Derivative(Stage):
+    """Derivative of the values with respect to the voltage, ``(y[n] - y[n - 1]) / (V[n] - V[n - 1])``. It is
+    NaN for the first point and where the voltage doesn't change"""
+
+    def __init__(self):
+        self.reset()
+
+    def units(self, units):
+        return f"{units} / V"
+
+    def reset(self):
+        self.previous = (np.array([np.nan]), np.array([np.nan]))
+
+    def process(self, voltages, values):
+        if not len(values):
+            return voltages, values
+        all_voltages = np.concatenate([self.previous[0], voltages])
+        all_values = np.concatenate([self.previous[1], values])
+        self.previous = (all_voltages[-1:], all_values[-1:])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            derivative = np.diff(all_values) / np.diff(all_voltages)
+        derivative[~np.isfinite(derivative)] = np.nan
+        return voltages, derivative
+
+
+#: Stages available in the config, by name
+STAGES = {
+    "moving_average": MovingAverage,
+    "fir": FIRFilter,
+    "iir": IIRFilter,
+    "decimate": Decimate,
+    "derivative": Derivative,
+}
+
+
+class Pipeline:
+    """Stages applied one after the other
+
+    Parameters
+    ----------
+    stages : list of Stage
+        The stages, in order
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.units = "A"
+        for stage in self.stages:
+            self.units = stage.units(self.units)
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the pipeline from a list of dictionaries with the name of the ``stage`` and its options"""
+        stages = []
+        for options in config:
+            options = dict(options)
+            name = options.pop("stage")
+            if name not in STAGES:
+                raise Exception(f"Unknown processing stage {name}. Stages available: {', '.join(STAGES)}")
+            stages.append(STAGES[name](**options))
+        return cls(stages)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, voltages, values):
+        """Processes a block of data
+
+        Parameters
+        ----------
+        voltages : array of float
+            In Volts
+        values : array of float
+            The currents, in Amperes
+
+        Returns
+        -------
+        voltages : array of float
+        values : array of float
+            In :attr:`units`
+        """
+        for stage in self.stages:
+            voltages, values = stage.process(voltages, values)
+        return voltages, values
+
+
+class LiveProcessing:
+    """Processes the data of an experiment as it is acquired. It runs in the thread that publishes the events,
+    as every block is processed in about the time it takes to copy it
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment to follow
+    pipeline : Pipeline
+        The stages to apply
+
+    Attributes
+    ----------
+    num_points : int
+        Number of processed points available
+    """
+
+    def __init__(self, experiment, pipeline):
+        self.experiment = experiment
+        self.pipeline = pipeline
+        self.voltages = np.zeros(0)
+        self.values = np.zeros(0)
+        self.num_points = 0
+        self.experiment.subscribe(self._on_event)
+
+    def _on_event(self, event):
+        if isinstance(event, ScanStarted):
+            self.pipeline.reset()
+            # No stage makes the data longer, the buffers are allocated once per scan
+            self.voltages = np.full(event.num_points, np.nan)
+            self.values = np.full(event.num_points, np.nan)
+            self.num_points = 0
+        elif isinstance(event, PointsAcquired):
+            voltages, values = self.pipeline.process(
+                self.experiment.scan_range[event.start : event.stop].m_as("V"),
+                self.experiment.scan_data[event.start : event.stop].m_as("A"),
+            )
+            stop = self.num_points + len(values)
+            self.voltages[self.num_points : stop] = voltages
+            self.values[self.num_points : stop] = values
+            self.num_points = stop
+
+    @property
+    def data(self):
+        """The processed voltages and values so far, as quantities"""
+        return (
+            ur.Quantity(self.voltages[: self.num_points], "V"),
+            ur.Quantity(self.values[: self.num_points], self.pipeline.units),
+        )
+
+    def close(self):
+        """Stops following the experiment"""
+        self.experiment.unsubscribe(self._on_event)
@@ -0,0 +1,128 @@
+"""
+Raw data
+========
+The DAC takes 12-bit codes and the ADC returns 10-bit codes, but scans are normally stored as 64-bit floats
+with units. With the ``raw`` option of the Scan section of the config, the experiment keeps the codes
+instead, as 16-bit integers, which takes four times less memory and disk::
+
+    Scan:
+      raw: true
+
+``scan_range`` and ``scan_data`` are then :class:`CodeArray` objects. They behave like quantities when
+read, but the conversion to Volts and Amperes is done with a lookup table, only for the elements accessed.
+
+Raw scans are saved as ``.npz`` files with the codes and the lookup tables used during the scan, together
+with the calibration of the input, if any. Since the codes are kept, the data can be processed again with a
+newer calibration, see :func:`load_raw_scan`. Raw buffers are not available with ``separate_process``, in
+which case the scan is acquired and saved as floats.
+"""
+import numpy as np
+
+from PFTL import ur
+
+
+class CodeArray:
+    """Integer codes that read as a quantity
+
+    Parameters
+    ----------
+    codes : array of int
+        The raw codes, written by the scan
+    table : array of float
+        The value, in ``units``, of every possible code
+    units : str
+        The units of the values of the table
+    """
+
+    def __init__(self, codes, table, units):
+        self.codes = codes
+        self.table = table
+        self.units = ur.Unit(units)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        return ur.Quantity(self.table[self.codes[key]], self.units)
+
+    @property
+    def magnitude(self):
+        """The values of all the codes, converted. It is a new array, writing to it doesn't change the codes"""
+        return self.table[self.codes]
+
+    m = magnitude
+
+    def m_as(self, units):
+        return self[:].m_as(units)
+
+    def to(self, units):
+        return self[:].to(units)
+
+
+def save_raw_scan(path, output_codes, input_codes, output_volts, input_volts, resistance, channel_in,
+                  calibration=None, **extra):
+    """Saves the codes of a scan and what is needed to convert them
+
+    Parameters
+    ----------
+    path : Path
+        The ``.npz`` file
+    output_codes : array of int
+        DAC codes output
+    input_codes : array of int
+        ADC codes read
+    output_volts : array of float
+        Voltage of every DAC code, in Volts
+    input_volts : array of float
+        Voltage of every ADC code, in Volts, including the calibration of the input
+    resistance : float
+        The resistance used to convert voltages to currents, in Ohms
+    channel_in : int
+        The input channel
+    calibration : ChannelCalibration
+        The calibration of the input channel, if there was one
+    extra : array
+        Other arrays to store in the file
+    """
+    if calibration is not None:
+        extra.update(calibration_gain=calibration.gain, calibration_offset=calibration.offset)
+    np.savez(
+        path,
+        output_codes=np.asarray(output_codes, dtype=np.uint16),
+        input_codes=np.asarray(input_codes, dtype=np.uint16),
+        output_volts=output_volts,
+        input_volts=input_volts,
+        resistance=resistance,
+        channel_in=channel_in,
+        **extra,
+    )
+
+
+def load_raw_scan(path, calibration=None):
+    """Reads a file saved by :func:`save_raw_scan`
+
+    Parameters
+    ----------
+    path : Path
+        The ``.npz`` file
+    calibration : Calibration
+        If given, the input codes are converted with this calibration instead of the one used during the scan.
+        It doesn't apply to repeated scans, which return the average stored in the file
+
+    Returns
+    -------
+    voltages : array of float
+        In Volts
+    currents : array of float
+        In Amperes
+    """
+    with np.load(path) as data:
+        input_volts = data["input_volts"]
+        channel_in = int(data["channel_in"])
+        if calibration is not None and channel_in in calibration:
+            input_volts = calibration.to_volts(channel_in, np.arange(len(input_volts)))
+        voltages = data["output_volts"][data["output_codes"]]
+        currents = input_volts[data["input_codes"]] / float(data["resistance"])
+        if "average" in data:
+            currents = data["average"]
+    return voltages, currents
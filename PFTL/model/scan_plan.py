@@ -0,0 +1,77 @@
+"""
+Scan Plan
+=========
+Everything that can be computed before a scan starts is computed here, at once, with numpy. The setpoints
+are converted to the integer codes of the DAC, the commands for the device are prepared, and lookup tables
+to translate ADC codes into voltages and currents are built. The loop of the experiment is then left
+dealing only with integers and prepared commands, without any unit conversion per point.
+
+The DAC has a finite resolution, therefore scans with more steps than codes available in the range will
+output the same value more than once. Those repetitions are flagged and, optionally, removed.
+"""
+import numpy as np
+
+
+class ScanPlan:
+    """Precomputed setpoints and conversion tables for a scan
+
+    Parameters
+    ----------
+    daq : DAQBase
+        The DAQ that will perform the scan, used for the conversions between codes and voltages
+    channel_out : int
+        The output channel
+    channel_in : int
+        The input channel, used to pick its calibration if the DAQ has one
+    start : float
+        First setpoint, in Volts
+    stop : float
+        Last setpoint, in Volts
+    num_steps : int
+        Number of setpoints requested
+    resistance : float
+        The resistance used to convert the measured voltage to a current, in Ohms
+    deduplicate : bool
+        If True, consecutive setpoints that map to the same DAC code are output only once
+
+    Attributes
+    ----------
+    codes : array of int
+        The DAC code of every setpoint
+    repeated : array of bool
+        True for the setpoints whose code is the same as the previous one
+    voltages : array of float
+        The voltage that the DAC actually outputs for every setpoint, in Volts
+    commands : list
+        What the DAQ needs to output every setpoint, see :meth:`~PFTL.model.base_daq.DAQBase.prepare_output`
+    input_volts : array of float
+        Voltage, in Volts, for every possible ADC code, including the calibration of the input channel
+    input_current : array of float
+        Current, in Amperes, for every possible ADC code
+    """
+
+    def __init__(self, daq, channel_out, channel_in, start, stop, num_steps, resistance, deduplicate=False):
+        requested = np.linspace(start, stop, num_steps)
+        codes = daq.volts_to_code(requested)
+        repeated = np.zeros(len(codes), dtype=bool)
+        repeated[1:] = codes[1:] == codes[:-1]
+        if deduplicate:
+            codes = codes[~repeated]
+            repeated = repeated[~repeated]
+
+        self.codes = codes
+        self.repeated = repeated
+        self.voltages = daq.code_to_volts(codes)
+        self.commands = daq.prepare_output(channel_out, codes)
+
+        adc_codes = np.arange(daq.ADC_MAX + 1)
+        self.input_volts = daq.adc_to_volts(adc_codes, channel_in)
+        self.input_current = self.input_volts / resistance
+
+    @property
+    def num_repeated(self):
+        """Number of setpoints that repeat the previous DAC code"""
+        return int(np.count_nonzero(self.repeated))
+
+    def __len__(self):
+        return len(self.codes)
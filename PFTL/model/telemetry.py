@@ -0,0 +1,214 @@
+"""
+Telemetry
+=========
+Serves the status of an experiment over HTTP, on the local machine, so rigs can be watched without looking
+at their windows. It is enabled with the ``Telemetry`` section of the config file::
+
+    Telemetry:
+      host: 127.0.0.1
+      port: 8765
+
+The following addresses are available:
+
+* ``/metrics``: metrics in the text format of Prometheus, to be collected by it or read by a person.
+* ``/status``: the same metrics as JSON.
+* ``/data``: the points of the current scan as JSON, decimated to at most ``data_points``.
+
+The metrics are computed on a background thread, fed by the :mod:`~PFTL.model.events` of the experiment
+through a bounded queue. If the thread falls behind, events are dropped (and counted) instead of slowing
+down the scan. Requests are answered from the latest computed values, so slow or many clients never touch
+the acquisition.
+"""
+import json
+import queue
+import threading
+import traceback
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+import numpy as np
+
+from PFTL.model.events import PointsAcquired, ScanError, ScanStarted
+
+#: Time over which the acquisition rate is averaged, in seconds
+RATE_WINDOW = 5
+
+METRICS = {
+    "scan_running": ("gauge", "1 while a scan is running"),
+    "scan_points": ("gauge", "Points acquired in the current scan"),
+    "samples_total": ("counter", "Points acquired since the program started"),
+    "samples_per_second": ("gauge", f"Acquisition rate over the last {RATE_WINDOW} seconds"),
+    "scan_errors_total": ("counter", "Scans stopped by an error"),
+    "event_queue_depth": ("gauge", "Events waiting to be processed by the telemetry"),
+    "events_dropped_total": ("counter", "Events dropped because the telemetry fell behind"),
+    "voltage_out_volts": ("gauge", "Last output voltage"),
+    "last_current_amperes": ("gauge", "Last current measured"),
+    "serial_latency_seconds": ("summary", "Duration of the latest serial transactions"),
+}
+
+
+class Telemetry:
+    """HTTP server with the metrics of an experiment
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment to follow
+    host : str
+        Address to listen on. The default only accepts connections from the same computer
+    port : int
+        The port to listen on
+    max_events : int
+        Events that can wait to be processed before new ones are dropped
+    data_points : int
+        Largest number of points returned by ``/data``
+    update_interval : float
+        Minimum time between updates of the metrics, in seconds
+    """
+
+    def __init__(self, experiment, host="127.0.0.1", port=8765, max_events=1000, data_points=500,
+                 update_interval=0.5):
+        self.experiment = experiment
+        self.data_points = data_points
+        self.update_interval = update_interval
+
+        self.events = queue.Queue(maxsize=max_events)
+        self.dropped = 0
+        self.samples_total = 0
+        self.errors = 0
+        self.acquired = deque()  # (time, number of points) of the recent batches
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.data = {"voltages": [], "currents": []}
+        self.keep_running = True
+
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.experiment.subscribe(self._on_event)
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _on_event(self, event):
+        """Called from the thread of the scan, it never waits"""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        last_update = 0
+        while self.keep_running:
+            try:
+                event = self.events.get(timeout=self.update_interval)
+            except queue.Empty:
+                event = None
+            try:
+                if isinstance(event, PointsAcquired):
+                    self.samples_total += event.stop - event.start
+                    self.acquired.append((monotonic(), event.stop - event.start))
+                elif isinstance(event, ScanStarted):
+                    self.acquired.clear()
+                elif isinstance(event, ScanError):
+                    self.errors += 1
+                if monotonic() - last_update >= self.update_interval:
+                    self.update()
+                    last_update = monotonic()
+            except Exception:
+                traceback.print_exc()
+
+    def update(self):
+        """Computes the metrics and the decimated data served to the clients"""
+        now = monotonic()
+        while self.acquired and self.acquired[0][0] < now - RATE_WINDOW:
+            self.acquired.popleft()
+        experiment = self.experiment
+        metrics = {
+            "scan_running": int(bool(experiment.is_running)),
+            "scan_points": int(experiment.current_scan_index),
+            "samples_total": self.samples_total,
+            "samples_per_second": sum(n for _, n in self.acquired) / RATE_WINDOW,
+            "scan_errors_total": self.errors,
+            "event_queue_depth": self.events.qsize(),
+            "events_dropped_total": self.dropped,
+            "voltage_out_volts": float(experiment.voltage_out.m_as("V")),
+            "last_current_amperes": float(experiment.last_measured_value.m_as("A")),
+        }
+        # Only DAQs that talk to a device through this process have serial latencies
+        latencies = list(getattr(getattr(experiment.daq, "driver", None), "latencies", ()))
+        if latencies:
+            quantiles = np.percentile(np.array(latencies) * 1e-9, [50, 90, 99])
+            metrics["serial_latency_seconds"] = dict(zip(("0.5", "0.9", "0.99"), quantiles.tolist()))
+
+        num_points = int(experiment.current_scan_index)
+        step = max(1, -(-num_points // self.data_points))
+        data = {
+            "voltages": experiment.scan_range[:num_points:step].m_as("V").tolist(),
+            "currents": experiment.scan_data[:num_points:step].m_as("A").tolist(),
+        }
+        with self.lock:
+            self.metrics = metrics
+            self.data = data
+
+    def prometheus(self):
+        """The metrics in the text format of Prometheus"""
+        with self.lock:
+            metrics = dict(self.metrics)
+        lines = []
+        for name, value in metrics.items():
+            kind, description = METRICS[name]
+            lines.append(f"# HELP pftl_{name} {description}")
+            lines.append(f"# TYPE pftl_{name} {kind}")
+            if isinstance(value, dict):
+                lines.extend(f'pftl_{name}{{quantile="{q}"}} {v}' for q, v in value.items())
+            else:
+                lines.append(f"pftl_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Stops following the experiment and stops the server"""
+        self.experiment.unsubscribe(self._on_event)
+        self.keep_running = False
+        self.thread.join()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _handler(telemetry):
+    """Builds the class that answers the requests to the server of ``telemetry``"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                self._send(telemetry.prometheus(), "text/plain; version=0.0.4")
+            elif path == "/status":
+                with telemetry.lock:
+                    text = json.dumps(telemetry.metrics)
+                self._send(text, "application/json")
+            elif path == "/data":
+                with telemetry.lock:
+                    text = json.dumps(telemetry.data)
+                self._send(text, "application/json")
+            else:
+                self.send_error(404)
+
+        def _send(self, text, content_type):
+            body = text.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
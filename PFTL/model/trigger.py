@@ -0,0 +1,237 @@
+"""
+Triggered acquisition
+=====================
+To study transients there is no need to keep hours of data: the input is read continuously (see
+:meth:`~PFTL.model.experiment.Experiment.iter_stream`), and only a window around every trigger is kept. The
+last samples are held in a ring buffer, therefore every record includes what happened before the trigger.
+
+The trigger is evaluated on whole chunks at once, with numpy comparisons:
+
+* ``edge``: the current crosses the ``level``, going up (``slope: rising``) or down (``slope: falling``).
+* ``level``: the current is above (``slope: rising``) or below (``slope: falling``) the ``level``.
+
+After a trigger, new triggers are ignored until the record is complete, so records don't overlap. It is
+configured with the ``Trigger`` section of the config file::
+
+    Trigger:
+      level: 2mA
+      mode: edge
+      slope: rising
+      pre_samples: 100
+      post_samples: 400
+      chunk_size: 100
+
+And runs from the command line, saving every record as a ``.npz`` file in the data folder, until it is
+stopped with Ctrl+C::
+
+    $ py4lab trigger Config/experiment.yml --records 10
+"""
+import argparse
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from PFTL import ur
+
+MODES = ("edge", "level")
+SLOPES = ("rising", "falling")
+
+
+class RingBuffer:
+    """Keeps the last ``size`` samples of a stream, addressed by their position in the whole stream
+
+    Parameters
+    ----------
+    size : int
+        Number of samples kept
+    """
+
+    def __init__(self, size):
+        self.buffer = np.zeros(size)
+        self.size = size
+        self.total = 0  # Samples added since the start
+
+    def extend(self, samples):
+        """Adds samples, overwriting the oldest ones"""
+        samples = np.asarray(samples)
+        total = self.total + len(samples)
+        samples = samples[-self.size :]  # Only the last ones fit, but all of them count
+        start = (total - len(samples)) % self.size
+        first = min(len(samples), self.size - start)
+        self.buffer[start : start + first] = samples[:first]
+        self.buffer[: len(samples) - first] = samples[first:]
+        self.total = total
+
+    def get(self, start, stop):
+        """The samples from position ``start`` to ``stop`` of the stream. They must still be in the buffer"""
+        if start < max(0, self.total - self.size) or stop > self.total:
+            raise Exception(f"Samples {start} to {stop} are not in the buffer")
+        return np.take(self.buffer, np.arange(start, stop) % self.size)
+
+
+def find_triggers(previous, samples, level, mode="edge", slope="rising"):
+    """Positions of the samples that meet the trigger condition
+
+    Parameters
+    ----------
+    previous : float
+        The sample before ``samples``, to detect edges at the start. NaN if there is none
+    samples : array of float
+        The new samples
+    level : float
+        The trigger level
+    mode : str
+        One of :data:`MODES`
+    slope : str
+        One of :data:`SLOPES`
+
+    Returns
+    -------
+    array of int
+    """
+    if mode not in MODES or slope not in SLOPES:
+        raise Exception(f"Unknown trigger {mode} {slope}. Modes: {', '.join(MODES)}, slopes: {', '.join(SLOPES)}")
+    if slope == "falling":
+        samples, previous, level = -samples, -previous, -level
+    condition = samples >= level
+    if mode == "edge":
+        before = np.concatenate([[previous], samples[:-1]])
+        condition &= before < level
+    return np.flatnonzero(condition)
+
+
+@dataclass
+class TriggerRecord:
+    """Samples around a trigger. ``position`` is the position of the trigger in the stream, and the trigger is
+    ``data[pre_samples]``"""
+    position: int
+    time: datetime
+    pre_samples: int
+    data: Any
+
+
+class TriggeredAcquisition:
+    """Reads an input continuously and keeps the samples around every trigger
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment, with the DAQ loaded
+    level : Quantity, str or float
+        The trigger level, a current. Plain numbers are in Amperes
+    mode : str
+        One of :data:`MODES`
+    slope : str
+        One of :data:`SLOPES`
+    pre_samples : int
+        Samples kept before every trigger
+    post_samples : int
+        Samples kept from the trigger on
+    chunk_size : int
+        Samples read at once
+    channel_in : int
+        The input channel, by default the one of the Scan section of the config
+    """
+
+    def __init__(self, experiment, level, mode="edge", slope="rising", pre_samples=100, post_samples=400,
+                 chunk_size=100, channel_in=None):
+        self.experiment = experiment
+        level = ur.Quantity(level) if isinstance(level, str) else level
+        if not isinstance(level, ur.Quantity):
+            level = ur.Quantity(level, "A")
+        self.level = level.m_as("A")
+        self.mode = mode
+        self.slope = slope
+        self.pre_samples = pre_samples
+        self.post_samples = post_samples
+        self.chunk_size = chunk_size
+        self.channel_in = channel_in
+        find_triggers(np.nan, np.zeros(0), self.level, mode, slope)  # Checks the options
+
+    @classmethod
+    def from_config(cls, experiment):
+        """Creates the acquisition from the ``Trigger`` section of the config of the experiment"""
+        return cls(experiment, **experiment.config["Trigger"])
+
+    def records(self, max_records=None):
+        """Acquires until ``max_records`` triggers are captured or the experiment is stopped
+
+        Yields
+        ------
+        TriggerRecord
+        """
+        ring = RingBuffer(self.pre_samples + self.post_samples + self.chunk_size)
+        previous = np.nan
+        armed_from = self.pre_samples  # The first trigger needs a full pre-trigger window
+        pending = []
+        num_records = 0
+        for chunk in self.experiment.iter_stream(self.chunk_size, self.channel_in):
+            samples = chunk.m_as("A")
+            first = ring.total
+            ring.extend(samples)
+            for position in first + find_triggers(previous, samples, self.level, self.mode, self.slope):
+                if position >= armed_from:
+                    pending.append((position, datetime.now()))
+                    armed_from = position + self.post_samples
+            previous = samples[-1]
+
+            while pending and pending[0][0] + self.post_samples <= ring.total:
+                position, moment = pending.pop(0)
+                data = ring.get(position - self.pre_samples, position + self.post_samples)
+                yield TriggerRecord(int(position), moment, self.pre_samples, ur.Quantity(data, "A"))
+                num_records += 1
+                if max_records is not None and num_records >= max_records:
+                    return
+
+
+def save_record(record, folder, number):
+    """Saves a record as ``trigger_<number>.npz``, with the ``data`` in Amperes
+
+    Returns
+    -------
+    Path
+    """
+    path = Path(folder).expanduser() / f"trigger_{number:04d}.npz"
+    np.savez(
+        path,
+        data=record.data.m_as("A"),
+        position=record.position,
+        time=record.time.isoformat(),
+        pre_samples=record.pre_samples,
+    )
+    return path
+
+
+def next_record_number(folder):
+    """The number following the largest one of the records saved in the folder, 1 if there are none"""
+    pattern = re.compile(r"trigger_(\d+)\.npz")
+    numbers = [int(m.group(1)) for path in Path(folder).glob("trigger_*.npz") if (m := pattern.fullmatch(path.name))]
+    return max(numbers, default=0) + 1
+
+
+def main(args):
+    """Command line interface, see the module documentation"""
+    parser = argparse.ArgumentParser(prog="py4lab trigger", description="Triggered acquisition")
+    parser.add_argument("config", help="The config file of the experiment, with a Trigger section")
+    parser.add_argument("--records", type=int, help="Stop after this number of records")
+    options = parser.parse_args(args)
+
+    from PFTL.model.experiment import Experiment
+
+    with Experiment(options.config) as experiment:
+        folder = Path(experiment.config["Saving"]["folder"]).expanduser() / f"{datetime.today():%Y-%m-%d}"
+        folder.mkdir(exist_ok=True, parents=True)
+        acquisition = TriggeredAcquisition.from_config(experiment)
+        first = next_record_number(folder)
+        number = 0
+        try:
+            for number, record in enumerate(acquisition.records(options.records), start=1):
+                path = save_record(record, folder, first + number - 1)
+                print(f"Trigger at sample {record.position} saved to {path}")
+        except KeyboardInterrupt:
+            pass
+        print(f"{number} records")
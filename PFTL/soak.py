@@ -0,0 +1,316 @@
+"""
+Soak Test
+=========
+Problems such as memory that grows slowly, threads that are never stopped or a user interface that becomes
+sluggish only show up after hours. The soak test runs scans back to back, for as long as asked, through the
+whole program: the experiment, the DAQ of the config file and the main window, with Qt drawing offscreen so
+no display is needed. A fast simulated DAQ (``DummyDaq`` with no delay) or a recording of the serial port
+(see :mod:`~PFTL.controller.recording`) can be used to run it without the device::
+
+    $ py4lab soak Config/experiment.yml --duration 8h --interval 1min --max-rss-growth 50MB
+
+Every ``interval`` the memory used by the process (RSS), the memory allocated by Python (with
+``tracemalloc``), the number of threads and the percentiles of the update latency are printed. The latency
+is the time from the moment new points are published by the scan until the window finished showing them.
+The RSS and the threads are measured between two scans, when the experiment is idle, otherwise the thread
+of the scan would count as a new thread in some samples and not in others.
+
+The first samples, during ``warmup``, are not compared: the baseline is the first sample after it. The test
+fails, and the command exits with an error, as soon as a value grows beyond its bound. The allocations that
+grew the most since the baseline are recorded at every sample; the largest one is printed, and the whole list
+of the last sample at the end.
+"""
+import argparse
+import csv
+import os
+import sys
+import threading
+import tracemalloc
+from collections import deque
+from dataclasses import asdict, dataclass
+from time import perf_counter
+
+import numpy as np
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication
+
+from PFTL import ur
+from PFTL.model.events import PointsAcquired
+from PFTL.view.main_window import MainWindow
+
+#: Number of allocations listed in the report
+TOP_ALLOCATIONS = 10
+
+
+@dataclass
+class Sample:
+    """The state of the process at one moment of the soak test. Memory in bytes, latencies in seconds. ``rss``
+    and ``threads`` are the values between the latest two scans"""
+    time: float
+    scans: int
+    rss: int
+    traced: int
+    threads: int
+    latency_p50: float
+    latency_p95: float
+    latency_p99: float
+
+
+def resident_memory():
+    """Memory used by this process, in bytes"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # Not Linux. The peak is the best available without extra dependencies
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def take_snapshot():
+    """Snapshot of the memory allocated by Python, without the allocations of tracemalloc itself"""
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+class SoakTest:
+    """Runs scans through the main window, one after the other, and samples the process periodically
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment, with the DAQ loaded. The window is created for it, the QApplication must exist
+    duration : float
+        Duration of the test, in seconds
+    interval : float
+        Time between samples, in seconds
+    warmup : float
+        Time before the baseline sample, in seconds
+    bounds : dict
+        Largest growth from the baseline allowed for ``rss``, ``traced`` and ``threads``, and largest
+        ``latency_p99``. Missing values are not checked
+
+    Attributes
+    ----------
+    window : MainWindow
+        The window that runs the scans
+    samples : list of Sample
+        All the samples taken
+    failures : list of str
+        The bounds that were exceeded
+    allocations : list of tuple
+        The time of every sample after the baseline, with the allocations that grew the most until then
+    """
+
+    def __init__(self, experiment, duration, interval=10, warmup=30, bounds=None):
+        self.experiment = experiment
+        self.duration = duration
+        self.interval = interval
+        self.warmup = warmup
+        self.bounds = bounds or {}
+
+        self.samples = []
+        self.baseline = None
+        self.baseline_snapshot = None
+        self.failures = []
+        self.allocations = []
+        self.idle_rss = None
+        self.idle_threads = None
+        self.scans = 0
+        self.start_time = None
+        self.published = {}  # Time at which every batch of points was published, by (start, stop)
+        self.latencies = deque(maxlen=100000)
+        self.lock = threading.Lock()
+
+        # Subscribed before the window, so the time of publication is known before the window gets the event
+        self.experiment.subscribe(self._on_event)
+        self.window = MainWindow(experiment)
+        self.window.signals.points_acquired.connect(self._on_displayed)
+        self.window.signals.finished.connect(self._on_finished)
+
+    def _on_event(self, event):
+        if isinstance(event, PointsAcquired):
+            with self.lock:
+                self.published[(event.start, event.stop)] = perf_counter()
+
+    def _on_displayed(self, start, stop):
+        """Connected after the slots of the window, it runs when they finished showing the points"""
+        with self.lock:
+            published = self.published.pop((start, stop), None)
+        if published is not None:
+            self.latencies.append(perf_counter() - published)
+
+    def _on_finished(self):
+        self.scans += 1
+        with self.lock:
+            self.published.clear()
+        self._start_scan()
+
+    def _start_scan(self):
+        if self.start_time is None or perf_counter() - self.start_time >= self.duration or self.failures:
+            return
+        if self.experiment.is_running:
+            QTimer.singleShot(10, self._start_scan)
+            return
+        self._measure_idle()
+        self.window.start_scan()
+
+    def _measure_idle(self):
+        """Measures the memory and the threads between two scans, once the thread of the last one ended"""
+        if self.experiment.scan_thread is not None:
+            self.experiment.scan_thread.join()
+        self.idle_rss = resident_memory()
+        self.idle_threads = threading.active_count()
+
+    def sample(self):
+        """Takes a sample and compares it with the baseline"""
+        latencies = np.array(self.latencies)
+        self.latencies.clear()
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+        sample = Sample(
+            perf_counter() - self.start_time,
+            self.scans,
+            self.idle_rss,
+            tracemalloc.get_traced_memory()[0],
+            self.idle_threads,
+            p50,
+            p95,
+            p99,
+        )
+        self.samples.append(sample)
+        print(
+            f"{sample.time:8.0f} s {sample.scans:6d} scans  RSS {sample.rss / 2**20:8.1f} MiB  "
+            f"traced {sample.traced / 2**20:8.1f} MiB  {sample.threads:3d} threads  "
+            f"latency p50/p95/p99 {p50 * 1e3:.1f}/{p95 * 1e3:.1f}/{p99 * 1e3:.1f} ms"
+        )
+
+        if self.baseline is None:
+            if sample.time >= self.warmup:
+                self.baseline = sample
+                self.baseline_snapshot = take_snapshot()
+            return
+        statistics = take_snapshot().compare_to(self.baseline_snapshot, "lineno")
+        grown = [statistic for statistic in statistics if statistic.size_diff > 0]
+        top = sorted(grown, key=lambda statistic: statistic.size_diff, reverse=True)[:TOP_ALLOCATIONS]
+        self.allocations.append((sample.time, top))
+        if top:
+            print(f"{'':10} grew the most: {top[0]}")
+        for name in ("rss", "traced", "threads"):
+            growth = getattr(sample, name) - getattr(self.baseline, name)
+            if name in self.bounds and growth > self.bounds[name]:
+                self.failures.append(
+                    f"{name} grew by {growth} (bound {self.bounds[name]:g}) after {sample.time:.0f} s"
+                )
+        if "latency_p99" in self.bounds and p99 > self.bounds["latency_p99"]:
+            self.failures.append(
+                f"99th percentile of the latency is {p99 * 1e3:.1f} ms "
+                f"(bound {self.bounds['latency_p99'] * 1e3:.1f} ms) after {sample.time:.0f} s"
+            )
+
+    def run(self):
+        """Runs the test, returning when the duration is over or a bound is exceeded
+
+        Returns
+        -------
+        bool
+            True if no bound was exceeded
+        """
+        tracemalloc.start()
+        self.window.show()
+        sample_timer = QTimer()
+        sample_timer.timeout.connect(self._check)
+        sample_timer.start(int(self.interval * 1000))
+        self.start_time = perf_counter()
+        self._start_scan()
+        QApplication.instance().exec()
+
+        sample_timer.stop()
+        self.experiment.stop_scan()
+        self.experiment.idle.wait()
+        self.window.close()
+        self.experiment.unsubscribe(self._on_event)
+        return not self.failures
+
+    def _check(self):
+        self.sample()
+        if self.failures or perf_counter() - self.start_time >= self.duration:
+            QApplication.instance().quit()
+
+    def top_allocations(self):
+        """The lines of code whose allocations grew the most from the baseline to the last sample"""
+        if not self.allocations:
+            return []
+        return self.allocations[-1][1]
+
+    def write_report(self, path):
+        """Writes all the samples as a CSV file"""
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(asdict(self.samples[0])) if self.samples else [])
+            writer.writeheader()
+            writer.writerows(asdict(sample) for sample in self.samples)
+
+
+def main(args):
+    """Command line interface, see the module documentation. It returns 1 if the test failed"""
+    parser = argparse.ArgumentParser(prog="py4lab soak", description="Long-duration test of the whole program")
+    parser.add_argument("config", help="The config file of the experiment, preferably with a simulated DAQ")
+    parser.add_argument("--duration", default="10min", help="Duration of the test, such as 8h")
+    parser.add_argument("--interval", default="10s", help="Time between samples")
+    parser.add_argument("--warmup", default="30s", help="Time before the baseline sample")
+    parser.add_argument("--max-rss-growth", help="Largest growth of the memory of the process, such as 50MB")
+    parser.add_argument("--max-traced-growth", help="Largest growth of the memory allocated by Python")
+    parser.add_argument("--max-thread-growth", type=int, help="Largest growth of the number of threads")
+    parser.add_argument("--max-latency", help="Largest 99th percentile of the update latency, such as 100ms")
+    parser.add_argument("--report", help="CSV file with all the samples")
+    options = parser.parse_args(args)
+
+    bounds = {}
+    if options.max_rss_growth:
+        bounds["rss"] = ur(options.max_rss_growth).m_as("B")
+    if options.max_traced_growth:
+        bounds["traced"] = ur(options.max_traced_growth).m_as("B")
+    if options.max_thread_growth is not None:
+        bounds["threads"] = options.max_thread_growth
+    if options.max_latency:
+        bounds["latency_p99"] = ur(options.max_latency).m_as("s")
+
+    # Qt reads the platform when the application is created. Set it in the environment to use a display
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PFTL.model.experiment import Experiment
+
+    experiment = Experiment(options.config)
+    experiment.load_config()
+    if experiment.config["Scan"].get("separate_process"):
+        from PFTL.model.process_experiment import ProcessExperiment
+
+        experiment = ProcessExperiment(options.config)
+        experiment.load_config()
+    experiment.load_daq()
+
+    app = QApplication(sys.argv[:1])
+    try:
+        test = SoakTest(
+            experiment,
+            ur(options.duration).m_as("s"),
+            ur(options.interval).m_as("s"),
+            ur(options.warmup).m_as("s"),
+            bounds,
+        )
+        passed = test.run()
+    finally:
+        experiment.finalize()
+    del app
+
+    if options.report:
+        test.write_report(options.report)
+    print("Allocations that grew the most until the last sample:")
+    for statistic in test.top_allocations():
+        print(f"  {statistic}")
+    if not passed:
+        print("FAILED")
+        for failure in test.failures:
+            print(f"  {failure}")
+        return 1
+    print(f"PASSED: {test.scans} scans in {ur(options.duration):~P}")
+    return 0
@@ -6,14 +6,36 @@ It takes one argument that is the path to the configuration file::
 
     $ py4lab Config/experiment.yml
 
+Other tools are available as commands, for example to find saved scans (see :mod:`~PFTL.model.catalog`)::
+
+    $ py4lab catalog ~/Data --since 7d resistance=220ohm
+
 """
 
 import sys
+from importlib import import_module
+
+#: Commands available from the command line, as ``name: module:function``. The function gets the rest of
+#: the arguments.
+COMMANDS = {
+    "catalog": "PFTL.model.catalog:main",
+    "analyze": "PFTL.model.batch_analysis:main",
+    "queue": "PFTL.model.job_queue:main",
+    "recording": "PFTL.controller.recording:main",
+    "ports": "PFTL.controller.discovery:main",
+    "trigger": "PFTL.model.trigger:main",
+    "view": "PFTL.view.scan_viewer:main",
+    "soak": "PFTL.soak:main",
+}
 
 
 def start():
-    """Starts the GUI for the experiment using the config file specified as system argument."""
+    """Starts the GUI for the experiment using the config file specified as system argument, or runs one of
+    the :data:`COMMANDS` if its name is the first argument."""
     args = sys.argv[1:]
+    if args and args[0] in COMMANDS:
+        module_name, function_name = COMMANDS[args[0]].split(":")
+        return getattr(import_module(module_name), function_name)(args[1:])
     if len(args) != 1:
         print(help_message)
         return
@@ -23,6 +45,11 @@ def start():
 
     experiment = Experiment(args[0])
     experiment.load_config()
+    if experiment.config["Scan"].get("separate_process"):
+        from PFTL.model.process_experiment import ProcessExperiment
+
+        experiment = ProcessExperiment(args[0])
+        experiment.load_config()
     experiment.load_daq()
     start_gui(experiment)
     experiment.finalize()
@@ -34,6 +61,16 @@ Welcome to Python For The Lab
 In order to run the program, you need to supply the path to the config file.
 For example, you can invoke this program as:
 py4lab Config/experiment.yml
+
+Other commands available:
+py4lab catalog <data folder> [--since 7d] [KEY=VALUE ...]
+py4lab analyze <data folder> [--function summary|diode_fit] [--output analysis.csv]
+py4lab queue submit|list|cancel|run ...
+py4lab recording <file.rec>
+py4lab ports
+py4lab trigger <config> [--records N]
+py4lab view <data file>
+py4lab soak <config> [--duration 8h] [--max-rss-growth 50MB] ...
 """
 
 
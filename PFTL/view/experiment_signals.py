@@ -0,0 +1,52 @@
+"""
+Experiment Signals
+==================
+Adapter between the :mod:`~PFTL.model.events` of an experiment and Qt. The events are published from the
+thread that runs the scan, while widgets can only be updated from the main thread. Emitting a signal is
+safe from any thread: Qt queues it and the connected slots run in the main thread.
+
+"""
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from PFTL.model.events import AverageUpdated, FitUpdated, PointsAcquired, ScanError, ScanFinished, ScanStarted
+
+
+class ExperimentSignals(QObject):
+    """Emits a Qt signal for every event of an experiment
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment to subscribe to
+    """
+
+    started = pyqtSignal(int)
+    points_acquired = pyqtSignal(int, int)
+    finished = pyqtSignal(int)
+    error = pyqtSignal(str)
+    fit_updated = pyqtSignal(object)
+    average_updated = pyqtSignal(object)
+
+    def __init__(self, experiment, parent=None):
+        super().__init__(parent)
+        self.experiment = experiment
+        self.experiment.subscribe(self.emit_event)
+
+    def emit_event(self, event):
+        """Translates an event into the corresponding signal"""
+        if isinstance(event, PointsAcquired):
+            self.points_acquired.emit(event.start, event.stop)
+        elif isinstance(event, ScanStarted):
+            self.started.emit(event.num_points)
+        elif isinstance(event, ScanFinished):
+            self.finished.emit(event.num_points)
+        elif isinstance(event, ScanError):
+            self.error.emit(event.message)
+        elif isinstance(event, FitUpdated):
+            self.fit_updated.emit(event)
+        elif isinstance(event, AverageUpdated):
+            self.average_updated.emit(event)
+
+    def disconnect_experiment(self):
+        """Stops listening to the experiment"""
+        self.experiment.unsubscribe(self.emit_event)
@@ -8,10 +8,17 @@ own .ui file, generated with Qt Designer.
 
 from pathlib import Path
 
+import numpy as np
 import pyqtgraph as pg
 from PyQt6 import uic
-from PyQt6.QtCore import QTimer
-from PyQt6.QtWidgets import QMainWindow
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QFileDialog, QLabel, QMainWindow, QMessageBox, QPushButton
+
+from PFTL import ur
+from PFTL.model.grid_scan import GridOrder
+from PFTL.model.job_queue import DEFAULT_QUEUE_FILE, JobQueue, QueueRunner
+from PFTL.view.experiment_signals import ExperimentSignals
+from PFTL.view.scan_viewer import ScanViewer
 
 pg.setConfigOption("background", "w")
 pg.setConfigOption("foreground", "k")
@@ -33,8 +40,20 @@ class MainWindow(QMainWindow):
         Widget to hold the plot
     plot : pg.PlotWidget.plotItem
         The real plot that can be updated with new data
+    fit_plot : pg.PlotWidget.plotItem
+        The curve of the live fit, if enabled
+    average_plot : pg.PlotWidget.plotItem
+        The average of the sweeps of repeated scans
+    processed_plot : pg.PlotWidget.plotItem
+        The data processed while it is acquired, if it is still a current
+    image_view : pg.ImageView
+        Image of grid scans, hidden for scans of a single output
     start_button : QPushButton
         The start button
+    queue_runner : QueueRunner
+        Runs the jobs of the queue, if there is a Queue section in the config
+    viewers : list of ScanViewer
+        The windows of the saved scans opened
     """
 
     def __init__(self, experiment=None):
@@ -52,6 +71,16 @@ class MainWindow(QMainWindow):
 
         pen = pg.mkPen(cosmetic=False, width=0.05, color="black")
         self.plot = self.plot_widget.plot([0], [0], pen=pen, title='I vs V')
+        fit_pen = pg.mkPen(width=2, color="r", style=Qt.PenStyle.DashLine)
+        self.fit_plot = self.plot_widget.plot([], [], pen=fit_pen)
+        self.fit_label = QLabel()
+        self.statusBar().addPermanentWidget(self.fit_label)
+        average_pen = pg.mkPen(width=2, color="b")
+        self.average_plot = self.plot_widget.plot([], [], pen=average_pen)
+        self.average_label = QLabel()
+        processed_pen = pg.mkPen(width=2, color="g")
+        self.processed_plot = self.plot_widget.plot([], [], pen=processed_pen)
+        self.statusBar().addPermanentWidget(self.average_label)
 
         plot_item = self.plot_widget.getPlotItem()
         plot_item.setXRange(0, 3.3)
@@ -60,36 +89,135 @@ class MainWindow(QMainWindow):
         self.start_button.clicked.connect(self.start_scan)
         self.stop_button.clicked.connect(self.stop_scan)
         self.actionSave.triggered.connect(self.experiment.save_data)
+        self.actionOpen.triggered.connect(self.open_scan)
+        self.viewers = []
+
+        self.image_view = pg.ImageView(view=pg.PlotItem())
+        self.image_view.setVisible(self.experiment.is_grid_scan)
+        self.central_widget.layout().addWidget(self.image_view)
+        self._reset_image = True
 
-        self.start_line.setText(self.experiment.config["Scan"]["start"])
-        self.stop_line.setText(self.experiment.config["Scan"]["stop"])
-        self.num_steps_line.setText(str(self.experiment.config["Scan"]["num_steps"]))
-        self.delay_line.setText(self.experiment.config["Scan"]["delay"])
+        # In grid scans the fields of the output refer to the fast axis
+        scan = self.experiment.config["Scan"]
+        axis = scan["axes"][-1] if self.experiment.is_grid_scan else scan
+        self.start_line.setText(axis["start"])
+        self.stop_line.setText(axis["stop"])
+        self.num_steps_line.setText(str(axis["num_steps"]))
+        self.delay_line.setText(scan["delay"])
         self.out_channel_line.setText(
-            str(self.experiment.config["Scan"]["channel_out"])
+            str(axis["channel_out"])
             )
-        self.in_channel_line.setText(str(self.experiment.config["Scan"]["channel_in"]))
+        self.in_channel_line.setText(str(scan["channel_in"]))
 
-        self.gui_timer = QTimer()
-        self.plot_timer = QTimer()
+        self.signals = ExperimentSignals(self.experiment, self)
+        self.signals.started.connect(self.update_gui)
+        self.signals.points_acquired.connect(self.update_plot)
+        self.signals.points_acquired.connect(self.update_gui)
+        self.signals.points_acquired.connect(self.update_image)
+        self.signals.finished.connect(self.update_plot)
+        self.signals.finished.connect(self.update_image)
+        self.signals.finished.connect(self.update_gui)
+        self.signals.error.connect(self.show_error)
+        self.signals.fit_updated.connect(self.update_fit)
+        self.signals.average_updated.connect(self.update_average)
 
-        self.plot_timer.timeout.connect(self.update_plot)
-        self.gui_timer.start(50)
-        self.gui_timer.timeout.connect(self.update_gui)
+        self.queue_runner = None
+        if "Queue" in self.experiment.config:
+            queue_file = (self.experiment.config["Queue"] or {}).get("file", DEFAULT_QUEUE_FILE)
+            self.queue_runner = QueueRunner(self.experiment, JobQueue(queue_file))
+            self.queue_button = QPushButton("Add to Queue")
+            self.queue_button.clicked.connect(self.queue_scan)
+            self.button_widgets.layout().addWidget(self.queue_button)
+            # Jobs start and end without events for the window, the buttons are updated periodically
+            self.queue_timer = QTimer(self)
+            self.queue_timer.timeout.connect(self.update_gui)
+            self.queue_timer.start(500)
+            self.queue_runner.start()
+        self.update_gui()
 
     def update_plot(self):
-        """ This method is called periodically via a QTimer. It updates the plot to show what is currently available
-        in the experiment data. If the acquisition is over, the timer is stopped (this prevents wasting computation
-        resources updating a plot that does not change).
+        """ This method is called when the experiment notifies that new data is available. It updates the plot to
+        show what is currently available in the experiment data. Nothing is redrawn while there is no new data.
 
         """
         self.plot.setData(
             self.experiment.scan_range[: self.experiment.current_scan_index].m_as("V"),
             self.experiment.scan_data[: self.experiment.current_scan_index].m_as("mA"),
             )
+        # Processed data in other units, such as a derivative, doesn't share the axis with the data
+        processing = self.experiment.processing
+        if processing is not None and ur.Unit(processing.pipeline.units) == ur.Unit("A"):
+            voltages, values = processing.data
+            self.processed_plot.setData(voltages.m_as("V"), values.m_as("mA"))
+
+    def update_image(self):
+        """ Shows the data of grid scans as an image of the two fastest axes. If there are more axes, the image is
+        the slice that contains the latest point. Bidirectional scans show the forward sweeps.
+        """
+        if not self.experiment.is_grid_scan or not self.experiment.current_scan_index:
+            return
+        order = GridOrder.from_config(self.experiment.config["Scan"])
+        data = self.experiment.grid_data().m_as("mA")
+        if order.order == "bidirectional":
+            data = data[..., 0]
+        latest = order.index[self.experiment.current_scan_index - 1]
+        data = data[tuple(latest[: data.ndim - 2])].reshape(-1, data.shape[-1])
+        measured = data[np.isfinite(data)]
+
+        setpoints = [setpoints.m_as("V") for _, setpoints in self.experiment.grid_axes()[-2:]]
+        if len(setpoints) == 1:
+            setpoints.insert(0, np.zeros(1))
+        y, x = setpoints
+        step_x = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 1
+        step_y = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else 1
+        self.image_view.setImage(
+            data.T,
+            autoRange=self._reset_image,
+            autoLevels=False,
+            levels=(measured.min(), measured.max()),
+            pos=(x[0], y[0]),
+            scale=(step_x, step_y),
+        )
+        self._reset_image = False
+
+    def update_fit(self, fit):
+        """ Shows the latest result of the live fit, the parameters in the status bar and the curve on top of the
+        data.
+        """
+        self.fit_plot.setData(fit.voltages.m_as("V"), fit.currents.m_as("mA"))
+        status = "converged" if fit.converged else f"{fit.num_points} points"
+        self.fit_label.setText(
+            f"Fit ({status}): n = {fit.ideality:.2f}, Is = {fit.saturation_current:.2e~P}, "
+            f"Rs = {fit.series_resistance:.1f~P}"
+        )
+
+    def update_average(self, average):
+        """ Shows the average of the sweeps of a repeated scan, and the largest standard error of its points, which
+        decreases as sweeps are added.
+        """
+        self.average_plot.setData(self.experiment.scan_range.m_as("V"), average.average.m_as("mA"))
+        text = f"Average of {average.repeats} sweeps"
+        if average.repeats > 1:
+            text += f", error < {average.standard_error.m_as('mA').max():.2e} mA"
+        self.average_label.setText(text)
+
+    def scan_values(self):
+        """ Reads the parameters of the scan from the UI (start, stop, num_steps, delay, channel_in, channel_out)
+        """
+        return {
+            "start": self.start_line.text(),
+            "stop": self.stop_line.text(),
+            "num_steps": int(self.num_steps_line.text()),
+            "channel_in": int(self.in_channel_line.text()),
+            "channel_out": int(self.out_channel_line.text()),
+            "delay": self.delay_line.text(),
+            }
 
-        if not self.experiment.is_running:
-            self.plot_timer.stop()
+    def queue_scan(self):
+        """ Adds a scan with the values of the UI to the job queue. It runs as soon as the previous jobs finish.
+        """
+        job_id = self.queue_runner.submit(self.experiment.merge_scan(self.scan_values()))
+        self.statusBar().showMessage(f"Job {job_id} added to the queue", 3000)
 
     def start_scan(self):
         """ Wrapper that updates the values from the UI (start, stop, num_steps, delay, channel_in, channel_out)
@@ -98,36 +226,34 @@ class MainWindow(QMainWindow):
         .. Warning:: There is a bug in this code (left for students to find out and sort it). If a user changes the
             values on the UI and presses "start" again, the metadata will store the new values, not the proper ones.
         """
-        start = self.start_line.text()
-        stop = self.stop_line.text()
-        num_steps = int(self.num_steps_line.text())
-        delay = self.delay_line.text()
-        channel_in = int(self.in_channel_line.text())
-        channel_out = int(self.out_channel_line.text())
-
-        self.experiment.config["Scan"].update(
-            {
-                "start": start,
-                "stop": stop,
-                "num_steps": num_steps,
-                "channel_in": channel_in,
-                "channel_out": channel_out,
-                "delay": delay,
-                }
-            )
+        if self.experiment.is_running or self.queue_busy:
+            return
+        values = self.scan_values()
+        self.experiment.config["Scan"] = self.experiment.merge_scan(values)
+        self.fit_plot.setData([], [])
+        self.fit_label.clear()
+        self.average_plot.setData([], [])
+        self.average_label.clear()
+        self.processed_plot.setData([], [])
+        self.image_view.setVisible(self.experiment.is_grid_scan)
+        self._reset_image = True
         self.experiment.start_scan()
-        self.plot_widget.setLabel('bottom', f"Port: {self.experiment.config['Scan']['channel_out']}", units="V")
-        self.plot_widget.setLabel('left', f"Port: {self.experiment.config['Scan']['channel_in']}", units="mA")
+        self.plot_widget.setLabel('bottom', f"Port: {values['channel_out']}", units="V")
+        self.plot_widget.setLabel('left', f"Port: {values['channel_in']}", units="mA")
 
-        self.plot_timer.start(50)
+    @property
+    def queue_busy(self):
+        """True while the queue runner has a job, and therefore the DAQ"""
+        return self.queue_runner is not None and self.queue_runner.current_job is not None
 
     def update_gui(self):
-        """ It is called on a timer to display the latest values of the applied voltage and the measured voltage.
+        """ It is called on every event of the experiment to display the latest values of the applied voltage and
+        the measured voltage.
         """
         self.out_line.setText(f"{self.experiment.voltage_out:3.2f}")
         self.measured_line.setText(f"{self.experiment.last_measured_value:.2f~#P}")
 
-        if self.experiment.is_running:
+        if self.experiment.is_running or self.queue_busy:
             self.start_button.setEnabled(False)
             self.stop_button.setEnabled(True)
 
@@ -143,3 +269,28 @@ class MainWindow(QMainWindow):
         """
         self.experiment.stop_scan()
         print("UI: Stopping Scan")
+
+    def open_scan(self):
+        """ Opens a saved scan in a :class:`~PFTL.view.scan_viewer.ScanViewer` """
+        folder = str(Path(self.experiment.config["Saving"]["folder"]).expanduser())
+        path, _ = QFileDialog.getOpenFileName(self, "Open Scan", folder, "Scans (*.dat *.npz *.npy)")
+        if not path:
+            return
+        try:
+            viewer = ScanViewer(path, self)
+        except Exception as e:
+            QMessageBox.critical(self, "Open Scan", str(e))
+            return
+        self.viewers.append(viewer)
+        viewer.show()
+
+    def show_error(self, message):
+        """ Shows the error that stopped a scan """
+        QMessageBox.critical(self, "Scan Error", message)
+
+    def closeEvent(self, event):
+        """ Stops the job queue, if any, and stops listening to the experiment, which outlives the window """
+        if self.queue_runner is not None:
+            self.queue_runner.stop()
+        self.signals.disconnect_experiment()
+        super().closeEvent(event)
@@ -0,0 +1,89 @@
+"""
+Scan Viewer
+===========
+Window to browse saved scans of any size. The data is read through a :class:`~PFTL.model.lod.LodPyramid`:
+every time the visible range changes, only the points of that range are read, at the level of detail that
+matches the width of the plot. It can be opened from the File menu of the main window, or from the command
+line::
+
+    $ py4lab view ~/Data/2024-05-01/data_001.dat
+
+The first time a file is opened its levels of detail are built, which for very large files can take a while.
+"""
+import sys
+
+import pyqtgraph as pg
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication, QMainWindow
+
+from PFTL.model.lod import LodPyramid
+
+
+class ScanViewer(QMainWindow):
+    """Plots a saved scan against the number of every point
+
+    Parameters
+    ----------
+    path : Path
+        The file of the scan
+    parent : QWidget
+        The parent window, if any
+
+    Attributes
+    ----------
+    pyramid : LodPyramid
+        The levels of detail of the scan
+    plot_widget : pg.PlotWidget
+        Widget that holds the plot
+    """
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.pyramid = LodPyramid(path)
+        self.setWindowTitle(f"Scan Viewer - {self.pyramid.path.name}")
+
+        self.plot_widget = pg.PlotWidget(labels={"left": "Current (mA)", "bottom": "Point"})
+        self.setCentralWidget(self.plot_widget)
+        pen = pg.mkPen(width=1, color="black")
+        self.plot = self.plot_widget.plot([], [], pen=pen)
+
+        # Changes of the range come in bursts while panning, the plot is updated once they stop
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(20)
+        self.update_timer.timeout.connect(self.update_plot)
+
+        plot_item = self.plot_widget.getPlotItem()
+        plot_item.setAutoVisible(y=True)
+        plot_item.setLimits(xMin=0, xMax=self.pyramid.num_points)
+        plot_item.setXRange(0, self.pyramid.num_points, padding=0)
+        plot_item.getViewBox().sigXRangeChanged.connect(self.update_timer.start)
+        self.resize(800, 500)
+        self.update_plot()
+
+    def update_plot(self):
+        """Reads the points of the visible range, at the level of detail that matches the width of the plot"""
+        view_box = self.plot_widget.getPlotItem().getViewBox()
+        start, stop = view_box.viewRange()[0]
+        x, y, level = self.pyramid.view(start, stop, max_points=2 * max(100, int(view_box.width())))
+        self.plot.setData(x, y * 1e3)
+
+        start, stop = max(0, int(start)), min(self.pyramid.num_points, int(stop)) - 1
+        message = f"Points {start} to {stop} of {self.pyramid.num_points}"
+        if level:
+            message += f", min/max of every {self.pyramid.factor**level} points"
+        if self.pyramid.voltages is not None:
+            message += f", {self.pyramid.voltage(start):.3f} V to {self.pyramid.voltage(stop):.3f} V"
+        self.statusBar().showMessage(message)
+
+
+def main(args):
+    """Command line interface, see the module documentation"""
+    if len(args) != 1:
+        print("Usage: py4lab view <file>")
+        return
+    print("Loading levels of detail")
+    ap = QApplication(sys.argv)
+    viewer = ScanViewer(args[0])
+    viewer.show()
+    ap.exit(ap.exec())
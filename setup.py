@@ -27,6 +27,10 @@ setup(
     test_suite="testsuite.testsuite",
     entry_points={
         "console_scripts": ["py4lab = PFTL.start:start"],
+        "pftl.daq": [
+            "DummyDaq = PFTL.model.dummy_daq:DummyDaq",
+            "AnalogDaq = PFTL.model.analog_daq:AnalogDaq",
+        ],
     },
     install_requires=[
         "pint",
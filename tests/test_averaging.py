@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import yaml
+
+from PFTL.model.averaging import RunningAverage
+from PFTL.model.experiment import MIN_REPEATS, Experiment
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    config = {
+        "DAQ": {"name": "DummyDaq", "port": "dummy", "resistance": "220ohm"},
+        "Scan": {
+            "start": "0V",
+            "stop": "3.3V",
+            "num_steps": 50,
+            "channel_out": 0,
+            "channel_in": 0,
+            "delay": "0ms",
+        },
+        "Saving": {"filename": "data.dat", "folder": str(tmp_path / "data")},
+    }
+    config_file = tmp_path / "experiment.yml"
+    config_file.write_text(yaml.dump(config))
+    with Experiment(config_file) as experiment:
+        yield experiment
+
+
+def test_running_average_matches_numpy():
+    sweeps = np.random.default_rng(0).normal(1e-3, 1e-5, size=(20, 100))
+    average = RunningAverage(100)
+    for sweep in sweeps:
+        average.add(sweep)
+    assert average.count == 20
+    np.testing.assert_allclose(average.mean, np.mean(sweeps, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(average.variance, np.var(sweeps, axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_allclose(average.standard_error, np.std(sweeps, axis=0, ddof=1) / np.sqrt(20), rtol=1e-9)
+
+
+def test_running_average_variance_needs_two_sweeps():
+    average = RunningAverage(3)
+    average.add(np.ones(3))
+    assert np.isnan(average.variance).all()
+
+
+def test_scan_stops_at_target_error(experiment):
+    experiment.config["Scan"].update(repeats=20, target_error="1A")
+    experiment.do_scan()
+    assert experiment.last_average.repeats == MIN_REPEATS
+
+
+def test_scan_does_all_repeats_without_target(experiment):
+    experiment.config["Scan"].update(repeats=5)
+    experiment.do_scan()
+    assert experiment.last_average.repeats == 5
+
+
+@pytest.mark.parametrize("repeats", [0, -1])
+def test_scan_needs_one_repeat(experiment, repeats):
+    experiment.config["Scan"].update(repeats=repeats)
+    with pytest.raises(Exception, match="repeats must be at least 1"):
+        experiment.do_scan()
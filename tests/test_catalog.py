@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PFTL.model.catalog import Catalog
+
+
+def test_numbers_follow_each_other(tmp_path):
+    catalog = Catalog(tmp_path)
+    names = [catalog.next_filename(tmp_path / "day", "data.dat").name for _ in range(3)]
+    assert names == ["data_0001.dat", "data_0002.dat", "data_0003.dat"]
+    assert catalog.next_filename(tmp_path / "day", "other.dat").name == "other_0001.dat"
+    assert catalog.next_filename(tmp_path / "next_day", "data.dat").name == "data_0001.dat"
+
+
+def test_new_catalog_counts_every_file_on_disk(tmp_path):
+    folder = tmp_path / "day"
+    folder.mkdir()
+    for name in ("data_0002.dat", "data_0007.npz", "data_0007.yml", "data_0009_processed.dat", "database.txt"):
+        (folder / name).touch()
+    catalog = Catalog(tmp_path / "catalog.sqlite")
+    assert catalog.next_filename(folder, "data.dat").name == "data_0010.dat"
+
+
+def test_concurrent_reservations_are_unique(tmp_path):
+    def reserve(_):
+        catalog = Catalog(tmp_path)
+        try:
+            return [catalog.next_filename(tmp_path, "data.dat").name for _ in range(20)]
+        finally:
+            catalog.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        names = [name for names in executor.map(reserve, range(8)) for name in names]
+    assert len(set(names)) == len(names) == 160
+    assert max(names) == "data_0160.dat"
+
+
+def test_query_matches_complete_keys(tmp_path):
+    catalog = Catalog(tmp_path)
+    config = {"Scan": {"num_steps": 10, "numXsteps": 5}, "DAQ": {"resistance": "220ohm"}}
+    catalog.add_scan(tmp_path / "data_0001.dat", config, np.linspace(0, 3, 10), np.linspace(0, 1e-3, 10))
+    assert len(catalog.query(config={"num_steps": 10})) == 1
+    assert len(catalog.query(config={"Scan.num_steps": 10})) == 1
+    assert len(catalog.query(config={"num_steps": 5})) == 0
+    assert len(catalog.query(config={"steps": 10})) == 0
+    assert len(catalog.query(config={"Resistance": "220ohm"})) == 0
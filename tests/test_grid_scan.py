@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from PFTL.model.grid_scan import GridOrder
+
+
+def steps(order):
+    """Largest change of any index between consecutive points"""
+    return np.abs(np.diff(order.index[:, : len(order.shape)], axis=0)).sum(axis=1)
+
+
+@pytest.mark.parametrize("order", ["raster", "serpentine", "bidirectional"])
+def test_every_point_is_measured(order):
+    grid = GridOrder((3, 4, 5), order)
+    positions = {tuple(row) for row in grid.index}
+    assert len(positions) == len(grid) == np.prod(grid.dense_shape)
+    assert grid.to_dense(np.arange(len(grid))).shape == grid.dense_shape
+
+
+def test_raster():
+    grid = GridOrder((2, 3), "raster")
+    assert grid.index.tolist() == [[0, 0], [0, 1], [0, 2], [1, 0], [1, 1], [1, 2]]
+    assert not grid.reversed.any()
+
+
+def test_serpentine_moves_one_step_at_a_time():
+    grid = GridOrder((2, 3), "serpentine")
+    assert grid.index.tolist() == [[0, 0], [0, 1], [0, 2], [1, 2], [1, 1], [1, 0]]
+    assert (steps(GridOrder((3, 4, 5), "serpentine")) == 1).all()
+
+
+def test_bidirectional_goes_back_and_forth():
+    grid = GridOrder((2, 3), "bidirectional")
+    assert grid.dense_shape == (2, 3, 2)
+    assert grid.num_lines == 4
+    assert grid.reversed.tolist() == [False, True, False, True]
+    assert grid.index[:6].tolist() == [[0, 0, 0], [0, 1, 0], [0, 2, 0], [0, 2, 1], [0, 1, 1], [0, 0, 1]]
+
+
+def test_to_dense_leaves_missing_points():
+    grid = GridOrder((2, 3), "serpentine")
+    dense = grid.to_dense(np.array([1.0, 2, 3, 4]))
+    np.testing.assert_array_equal(dense, [[1, 2, 3], [np.nan, np.nan, 4]])
+
+
+def test_from_config():
+    scan = {"axes": [{"num_steps": 2}, {"num_steps": 3}], "order": "raster"}
+    assert GridOrder.from_config(scan).shape == (2, 3)
+    with pytest.raises(Exception, match="Unknown scan order"):
+        GridOrder((2, 3), "spiral")
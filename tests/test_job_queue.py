@@ -0,0 +1,64 @@
+import subprocess
+import sys
+
+import pytest
+
+from PFTL.model.job_queue import CANCELLED, DONE, PENDING, RUNNING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite")
+    yield queue
+    queue.close()
+
+
+def test_claim_by_priority_then_order(queue):
+    first = queue.submit({"num_steps": 1})
+    second = queue.submit({"num_steps": 2})
+    urgent = queue.submit({"num_steps": 3}, priority=1)
+    claimed = [queue.claim()["id"] for _ in range(3)]
+    assert claimed == [urgent, first, second]
+    assert queue.claim() is None
+    assert all(job["status"] == RUNNING and job["owner"] == queue.owner for job in queue.jobs())
+
+
+def test_claim_returns_the_scan(queue):
+    queue.submit({"stop": "2V", "num_steps": 200})
+    job = queue.claim()
+    assert job["scan"] == {"stop": "2V", "num_steps": 200}
+    assert job["status"] == RUNNING
+
+
+def test_requeue(queue):
+    job_id = queue.submit({})
+    queue.claim()
+    queue.requeue(job_id)
+    assert queue.status(job_id) == PENDING
+    assert queue.claim()["id"] == job_id
+
+
+def test_cancel_while_running_is_kept(queue):
+    job_id = queue.submit({})
+    queue.claim()
+    assert queue.cancel(job_id)
+    queue.finish(job_id, DONE)
+    assert queue.status(job_id) == CANCELLED
+    assert not queue.cancel(job_id)
+
+
+def test_recover_only_jobs_of_ended_processes(queue, tmp_path):
+    mine, dead, remote, legacy = (queue.submit({}) for _ in range(4))
+    for _ in range(4):
+        queue.claim()
+    ended = subprocess.Popen([sys.executable, "-c", "pass"])
+    ended.wait()
+    host = queue.owner.rpartition(":")[0]
+    queue.connection.execute("UPDATE jobs SET owner = ? WHERE id = ?", (f"{host}:{ended.pid}", dead))
+    queue.connection.execute("UPDATE jobs SET owner = 'another-computer:1' WHERE id = ?", (remote,))
+    queue.connection.execute("UPDATE jobs SET owner = NULL WHERE id = ?", (legacy,))
+
+    other = JobQueue(tmp_path / "queue.sqlite")
+    assert other.recover() == 2
+    other.close()
+    assert [queue.status(job_id) for job_id in (mine, dead, remote, legacy)] == [RUNNING, PENDING, RUNNING, PENDING]
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from PFTL.model.lod import LodPyramid, map_npz, read_chunks
+from PFTL.model.raw_data import load_raw_scan, save_raw_scan
+
+
+@pytest.fixture
+def raw_scan(tmp_path):
+    rng = np.random.default_rng(0)
+    path = tmp_path / "data_0001.npz"
+    save_raw_scan(
+        path,
+        rng.integers(0, 4096, 10000),
+        rng.integers(0, 1024, 10000),
+        np.linspace(0, 3.3, 4096),
+        np.linspace(0, 3.3, 1024),
+        220.0,
+        0,
+    )
+    return path
+
+
+def test_map_npz_maps_the_arrays(raw_scan):
+    arrays = map_npz(raw_scan)
+    with np.load(raw_scan) as data:
+        assert set(arrays) == set(data)
+        for name in data:
+            np.testing.assert_array_equal(arrays[name], data[name])
+    assert isinstance(arrays["input_codes"], np.memmap)
+    assert not isinstance(arrays["resistance"], np.memmap)
+
+
+def test_map_npz_compressed_and_fortran(tmp_path):
+    matrix = np.asfortranarray(np.arange(12.0).reshape(3, 4))
+    np.savez(tmp_path / "fortran.npz", matrix=matrix)
+    np.testing.assert_array_equal(map_npz(tmp_path / "fortran.npz")["matrix"], matrix)
+    np.savez_compressed(tmp_path / "compressed.npz", values=np.arange(5), scalar=2.0)
+    arrays = map_npz(tmp_path / "compressed.npz")
+    np.testing.assert_array_equal(arrays["values"], np.arange(5))
+    assert arrays["scalar"] == 2.0
+
+
+def test_read_chunks_of_raw_scan(raw_scan):
+    chunks = list(read_chunks(raw_scan, chunk_size=3000))
+    assert [len(currents) for _, currents in chunks] == [3000, 3000, 3000, 1000]
+    voltages, currents = load_raw_scan(raw_scan)
+    np.testing.assert_allclose(np.concatenate([v for v, _ in chunks]), voltages)
+    np.testing.assert_allclose(np.concatenate([c for _, c in chunks]), currents)
+
+
+def test_read_chunks_of_data_file(tmp_path):
+    path = tmp_path / "data_0001.dat"
+    path.write_text("# Scan range in 'V', Scan Data in 'mA', Settling time in 'ms'\n0.1 1 5\n0.2 2 5\n0.3 3 5\n")
+    chunks = list(read_chunks(path, chunk_size=2))
+    assert len(chunks) == 2
+    np.testing.assert_allclose(np.concatenate([c for _, c in chunks]), [1e-3, 2e-3, 3e-3])
+
+
+def test_pyramid_keeps_the_envelope(raw_scan):
+    pyramid = LodPyramid(raw_scan)
+    _, currents = load_raw_scan(raw_scan)
+    assert pyramid.num_points == len(currents)
+    x, y, level = pyramid.view(0, len(currents), max_points=1000)
+    assert level > 0
+    assert y.min() == currents.min() and y.max() == currents.max()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from PFTL.model.processing import STAGES, Decimate, MovingAverage, Pipeline
+
+#: Options of every stage, chosen so their state spans several blocks
+OPTIONS = {
+    "moving_average": {"length": 7},
+    "fir": {"taps": [0.5, 0.25, 0.125, 0.0625, 0.0625]},
+    "iir": {"b": [0.2, 0.1], "a": [1, -0.5, 0.2]},
+    "decimate": {"factor": 3},
+    "derivative": {},
+}
+
+
+def process_in_blocks(stage, voltages, values, sizes):
+    """Processes the data in blocks of the given sizes, repeated until the data ends"""
+    outputs = []
+    start = 0
+    while start < len(values):
+        for size in sizes:
+            stop = start + size
+            outputs.append(stage.process(voltages[start:stop], values[start:stop]))
+            start = stop
+    return np.concatenate([v for v, _ in outputs]), np.concatenate([y for _, y in outputs])
+
+
+def test_every_stage_has_options():
+    assert set(OPTIONS) == set(STAGES)
+
+
+@pytest.mark.parametrize("name", STAGES)
+@pytest.mark.parametrize("sizes", [[1], [2], [1, 0, 5, 2], [100], [300]], ids=str)
+def test_blocks_match_whole_array(name, sizes):
+    rng = np.random.default_rng(1)
+    voltages = np.cumsum(rng.uniform(0.001, 0.01, 300))
+    values = rng.normal(1e-3, 1e-4, 300)
+    expected_voltages, expected_values = STAGES[name](**OPTIONS[name]).process(voltages, values)
+    stage = STAGES[name](**OPTIONS[name])
+    result_voltages, result_values = process_in_blocks(stage, voltages, values, sizes)
+    np.testing.assert_allclose(result_voltages, expected_voltages, rtol=1e-12)
+    np.testing.assert_allclose(result_values, expected_values, rtol=1e-9, atol=1e-18)
+
+    stage.reset()
+    np.testing.assert_allclose(stage.process(voltages, values)[1], expected_values, rtol=1e-9, atol=1e-18)
+
+
+def test_moving_average():
+    _, values = MovingAverage(3).process(np.arange(5.0), np.array([1.0, 2, 3, 4, 5]))
+    np.testing.assert_allclose(values, [1, 1.5, 2, 3, 4])
+
+
+def test_pipeline_from_config():
+    pipeline = Pipeline.from_config([{"stage": "moving_average", "length": 2}, {"stage": "derivative"}])
+    assert pipeline.units == "A / V"
+    with pytest.raises(Exception, match="Unknown processing stage"):
+        Pipeline.from_config([{"stage": "median"}])
+
+
+@pytest.mark.parametrize("stage, options", [(MovingAverage, {"length": 0}), (Decimate, {"factor": 0})])
+def test_invalid_options(stage, options):
+    with pytest.raises(Exception, match="at least 1"):
+        stage(**options)
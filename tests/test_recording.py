@@ -0,0 +1,64 @@
+import pytest
+
+from PFTL.controller.pftl_daq import Device
+from PFTL.controller.recording import READ, WRITE, read_recording
+
+IDN = "PFTL DAQ device. Rev 02.2024"
+
+
+class FakeSerial:
+    """Replies as the firmware does: the identification, the value set on an output, or a reading"""
+
+    def __init__(self):
+        self.reply = b""
+
+    def write(self, data):
+        command = data.decode().strip()
+        if command == "*IDN?":
+            self.reply = IDN
+        elif command.startswith("OUT:"):
+            self.reply = command.split()[-1]
+        else:
+            self.reply = "512"
+        self.reply = (self.reply + "\r\n").encode()
+        return len(data)
+
+    def readline(self):
+        return self.reply
+
+    def close(self):
+        pass
+
+
+def session(device):
+    device.initialize()
+    try:
+        return device.idn(), device.set_analog_output(0, 1024), device.get_analog_input(0)
+    finally:
+        device.finalize()
+
+
+def test_replay_gives_the_recorded_replies(tmp_path):
+    path = tmp_path / "session.rec"
+    device = Device("fake", record=path)
+    device.rsc = FakeSerial()
+    recorded = session(device)
+    assert recorded == (IDN, "1024", 512)
+
+    _, records = read_recording(path)
+    assert [kind for _, kind, _ in records] == [WRITE, READ] * 3
+    assert records[0][2] == b"*IDN?\n"
+
+    assert session(Device(f"replay://{path}?speed=0")) == recorded
+
+
+def test_replay_checks_the_commands(tmp_path):
+    path = tmp_path / "session.rec"
+    device = Device("fake", record=path)
+    device.rsc = FakeSerial()
+    session(device)
+
+    replay = Device(f"replay://{path}?speed=0")
+    replay.initialize()
+    with pytest.raises(Exception, match="differs from the recording"):
+        replay.get_analog_input(1)
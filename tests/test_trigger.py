@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from PFTL import ur
+from PFTL.model.trigger import RingBuffer, TriggeredAcquisition, find_triggers, next_record_number
+
+
+def test_ring_buffer_keeps_the_last_samples():
+    ring = RingBuffer(5)
+    ring.extend([0, 1, 2])
+    ring.extend([3, 4, 5, 6])
+    assert ring.total == 7
+    np.testing.assert_array_equal(ring.get(2, 7), [2, 3, 4, 5, 6])
+    ring.extend(np.arange(7, 20))
+    np.testing.assert_array_equal(ring.get(15, 20), [15, 16, 17, 18, 19])
+    with pytest.raises(Exception, match="not in the buffer"):
+        ring.get(14, 16)
+    with pytest.raises(Exception, match="not in the buffer"):
+        ring.get(18, 21)
+
+
+def test_edges():
+    samples = np.array([0, 2, 3, 1, 0, 2])
+    np.testing.assert_array_equal(find_triggers(np.nan, samples, 1.5), [1, 5])
+    np.testing.assert_array_equal(find_triggers(np.nan, samples, 1.5, slope="falling"), [3])
+    # An edge between the previous chunk and this one
+    np.testing.assert_array_equal(find_triggers(0, np.array([2, 2]), 1.5), [0])
+    np.testing.assert_array_equal(find_triggers(2, np.array([2, 2]), 1.5), [])
+
+
+def test_levels():
+    samples = np.array([0, 2, 3, 1])
+    np.testing.assert_array_equal(find_triggers(np.nan, samples, 1.5, mode="level"), [1, 2])
+    np.testing.assert_array_equal(find_triggers(np.nan, samples, 1.5, mode="level", slope="falling"), [0, 3])
+    with pytest.raises(Exception, match="Unknown trigger"):
+        find_triggers(np.nan, samples, 1.5, mode="window")
+
+
+@pytest.mark.parametrize("level", ["2mA", ur("2mA"), 0.002])
+def test_level_units(level):
+    assert TriggeredAcquisition(None, level).level == pytest.approx(0.002)
+
+
+def test_record_numbers_follow_the_largest(tmp_path):
+    assert next_record_number(tmp_path) == 1
+    for name in ("trigger_0001.npz", "trigger_0004.npz", "trigger_x.npz"):
+        (tmp_path / name).touch()
+    assert next_record_number(tmp_path) == 5